@@ -32,7 +32,7 @@ from scipy.sparse import diags
 from scipy.sparse.linalg import inv as sparse_inv
 from scipy.sparse import hstack
 
-from skimpy.utils.tensor import Tensor
+from skimpy.utils.tensor import Tensor, TensorSummary
 from skimpy.utils.namespace import SPLIT, NET
 from skimpy.analysis.mca.utils import get_reversible_fluxes
 
@@ -64,8 +64,15 @@ class ConcentrationControlFunction:
         self.displacement_function = displacement_function
         self.mca_type = mca_type
 
-    def __call__(self,  flux_dict, concentration_dict, parameter_population):
-
+    def __call__(self,  flux_dict, concentration_dict, parameter_population,
+                 summarize=False, sketch_size=64):
+        """
+        :param summarize: If True, only accumulate the mean, variance and
+                          quantile sketch of the control coefficients over
+                          the population and return a `TensorSummary`
+                          instead of the full `Tensor`
+        :param sketch_size: Capacity of the quantile sketch levels
+        """
         # Calculate the Concentration Control coefficients
         # Log response of the concentration with respect to the log change in a Parameter
         #
@@ -81,80 +88,103 @@ class ConcentrationControlFunction:
         num_concentration = len(self.independent_variable_ix)
         population_size = len(parameter_population)
 
-        concentration_control_coefficients = zeros((num_concentration, num_parameters, population_size))
+        concentration_index = pd.Index([self.model.reactants.iloc(i)[0] for i in self.independent_variable_ix],
+                                       name="concentration")
+        parameter_index = pd.Index(self.parameter_elasticity_function.respective_variables, name="parameter")
 
+        if summarize:
+            summary = TensorSummary([concentration_index, parameter_index],
+                                    sketch_size=sketch_size)
+        else:
+            concentration_control_coefficients = zeros((num_concentration, num_parameters, population_size))
 
-        for i,parameters in enumerate(parameter_population):
+        # Gather the population once into canonical parameter vectors
+        parameter_array = self.model.get_parameter_array(parameter_population)
 
-            # net control coeffecients
-            if self.mca_type == NET:
-                flux_matrix = diags(array(fluxes), 0).tocsc()
-                effective_reduced_stoichiometry = self.reduced_stoichometry
+        for i, parameters in enumerate(parameter_array):
 
-            # fwd and bwd control coeffecients
-            elif self.mca_type == SPLIT:
-                displacements = self.displacement_function(concentration_dict, parameters=parameters)
+            this_cc = self.get_control_coefficients(fluxes, flux_dict,
+                                                    concentrations, concentration_dict,
+                                                    parameters)
+            if summarize:
+                summary.update(this_cc)
+            else:
+                concentration_control_coefficients[:,:,i] = this_cc
 
-                forward_fluxes, backward_fluxes = get_reversible_fluxes(flux_dict,
-                                                                        displacements,
-                                                                        self.model.reactions)
+        if summarize:
+            return summary
 
-                flux_matrix = diags(append(forward_fluxes, backward_fluxes), 0).tocsc()
-                effective_reduced_stoichiometry = hstack([self.reduced_stoichometry, -self.reduced_stoichometry],
-                                                         format='csc')
+        sample_index = pd.Index(range(population_size), name="sample")
 
-            if self.volume_ratio_function is None:
-                volume_ratios = array([1, ] * len(concentrations) )
-            else:
-                volume_ratios = self.volume_ratio_function(parameters)
+        tensor_ccc = Tensor(concentration_control_coefficients, [concentration_index,parameter_index,sample_index])
 
-            # Elasticity matrix
+        return tensor_ccc
 
-            if self.conservation_relation.nnz == 0:
-                # If there are no moieties
-                volume_ratio_matrix = diags(array(volume_ratios)).tocsc()
+    def get_control_coefficients(self, fluxes, flux_dict, concentrations, concentration_dict, parameters):
+        """
+        Concentration control coefficients for a single parameter set
 
-                elasticity_matrix = self.independent_elasticity_function(concentrations,parameters)
+        :return: dense array (independent concentrations x parameters)
+        """
+        # net control coeffecients
+        if self.mca_type == NET:
+            flux_matrix = diags(array(fluxes), 0).tocsc()
+            effective_reduced_stoichiometry = self.reduced_stoichometry
 
-            else:
-                # If there are moieties
-                ix = self.independent_variable_ix
+        # fwd and bwd control coeffecients
+        elif self.mca_type == SPLIT:
+            displacements = self.displacement_function(concentration_dict, parameters=parameters)
 
-                volume_ratio_matrix = diags(array(volume_ratios)[ix]).tocsc()
+            forward_fluxes, backward_fluxes = get_reversible_fluxes(flux_dict,
+                                                                    displacements,
+                                                                    self.model.reactions)
 
-                elasticity_matrix = self.independent_elasticity_function(concentrations, parameters)
+            flux_matrix = diags(append(forward_fluxes, backward_fluxes), 0).tocsc()
+            effective_reduced_stoichiometry = hstack([self.reduced_stoichometry, -self.reduced_stoichometry],
+                                                     format='csc')
 
-                dependent_weights = self.dependent_elasticity_function.\
-                    get_dependent_weights(
-                                    concentration_vector=concentrations,
-                                    L0=self.conservation_relation,
-                                    all_dependent_ix=self.dependent_variable_ix,
-                                    all_independent_ix=self.independent_variable_ix,
-                                    volume_ratios=volume_ratios
-                                )
+        if self.volume_ratio_function is None:
+            volume_ratios = array([1, ] * len(concentrations) )
+        else:
+            volume_ratios = self.volume_ratio_function(parameters)
 
-                # Calculate the effective elasticises
-                elasticity_matrix += self.dependent_elasticity_function(concentrations, parameters)\
-                                     .dot(dependent_weights)
+        # Elasticity matrix
 
+        if self.conservation_relation.nnz == 0:
+            # If there are no moieties
+            volume_ratio_matrix = diags(array(volume_ratios)).tocsc()
 
+            elasticity_matrix = self.independent_elasticity_function(concentrations,parameters)
 
-            N_E_V = volume_ratio_matrix.dot(effective_reduced_stoichiometry).dot(flux_matrix).dot(elasticity_matrix)
-            N_E_V_inv = sparse_inv(N_E_V)
+        else:
+            # If there are moieties
+            ix = self.independent_variable_ix
 
-            parameter_elasticity_matrix = self.parameter_elasticity_function(concentrations, parameters)
+            volume_ratio_matrix = diags(array(volume_ratios)[ix]).tocsc()
 
-            N_E_P = volume_ratio_matrix.dot(effective_reduced_stoichiometry).dot(flux_matrix).dot(parameter_elasticity_matrix)
+            elasticity_matrix = self.independent_elasticity_function(concentrations, parameters)
 
-            this_cc = - N_E_V_inv.dot(N_E_P)
-            concentration_control_coefficients[:,:,i] = this_cc.todense()
+            dependent_weights = self.dependent_elasticity_function.\
+                get_dependent_weights(
+                                concentration_vector=concentrations,
+                                L0=self.conservation_relation,
+                                all_dependent_ix=self.dependent_variable_ix,
+                                all_independent_ix=self.independent_variable_ix,
+                                volume_ratios=volume_ratios
+                            )
 
-        concentration_index = pd.Index([self.model.reactants.iloc(i)[0] for i in self.independent_variable_ix],
-                                       name="concentration")
-        parameter_index = pd.Index(self.parameter_elasticity_function.respective_variables, name="parameter")
-        sample_index = pd.Index(range(population_size), name="sample")
+            # Calculate the effective elasticises
+            elasticity_matrix += self.dependent_elasticity_function(concentrations, parameters)\
+                                 .dot(dependent_weights)
 
-        tensor_ccc = Tensor(concentration_control_coefficients, [concentration_index,parameter_index,sample_index])
 
-        return tensor_ccc
 
+        N_E_V = volume_ratio_matrix.dot(effective_reduced_stoichiometry).dot(flux_matrix).dot(elasticity_matrix)
+        N_E_V_inv = sparse_inv(N_E_V)
+
+        parameter_elasticity_matrix = self.parameter_elasticity_function(concentrations, parameters)
+
+        N_E_P = volume_ratio_matrix.dot(effective_reduced_stoichiometry).dot(flux_matrix).dot(parameter_elasticity_matrix)
+
+        this_cc = - N_E_V_inv.dot(N_E_P)
+        return this_cc.toarray()
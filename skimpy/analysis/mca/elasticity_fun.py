@@ -39,11 +39,13 @@ from scipy.sparse.linalg import inv as sparse_inv
 from sympy import symbols,Symbol
 
 from skimpy.utils.tabdict import TabDict
-from skimpy.utils.compile_sympy import make_cython_function
+from skimpy.utils.compile_sympy import make_function
+from skimpy.utils.namespace import GCC
 from skimpy.utils.general import robust_index
 
 class ElasticityFunction:
-    def __init__(self, expressions, respective_variables, variables,  parameters, shape, pool=None):
+    def __init__(self, expressions, respective_variables, variables,  parameters, shape, pool=None,
+                 backend=GCC):
         """
         Constructor for a precompiled function to compute elasticities
         numerically
@@ -54,6 +56,7 @@ class ElasticityFunction:
                             e.g: (1,1)
         :param parameters:  list of parameter names
         :param shape: Tuple defining the over all matrix size e.g (10,30)
+        :param backend: GCC or NUMPY
 
         """
         self.respective_variables = respective_variables
@@ -61,6 +64,7 @@ class ElasticityFunction:
         self.expressions = expressions
         self.parameters = parameters
         self.shape = shape
+        self._parameter_ix = None
 
         # Unpacking is needed as ufuncify only take ArrayTypes
         parameters = [x for x in self.parameters]
@@ -81,19 +85,29 @@ class ElasticityFunction:
         # self.function = theano_function(sym_vars, expressions,
         #                                 on_unused_input='ignore')
 
-        self.function = make_cython_function(sym_vars, expressions, pool=pool,
-                                             simplify=True, optimize=True)
+        self.function = make_function(sym_vars, expressions, pool=pool,
+                                      simplify=True, backend=backend)
+
+    def link_parameter_index(self, parameter_index):
+        """
+        Precompute the positions of the function parameters in the
+        canonical parameter vector of the model
+        """
+        self._parameter_ix = parameter_index.link(self.parameters)
 
     def __call__(self, variables, parameters):
         """
         Return a sparse matrix type with elasticity values
         """
-        parameter_values = array([parameters[x] for x in
-                                  self.parameters.values()], dtype=double)
+        if isinstance(parameters, np.ndarray):
+            parameter_values = parameters[self._parameter_ix]
+        else:
+            parameter_values = array([parameters[x] for x in
+                                      self.parameters.values()], dtype=double)
 
         input_vars = append_array(variables , parameter_values)
 
-        values = array(zeros(len(self.expressions)),dtype=double)
+        values = array(zeros(len(self.rows)),dtype=double)
 
         self.function(input_vars, values)
 
@@ -31,7 +31,7 @@ from numpy import array, zeros
 from scipy.sparse import diags
 from scipy.sparse.linalg import inv as sparse_inv
 
-from skimpy.utils.tensor import Tensor
+from skimpy.utils.tensor import Tensor, TensorSummary
 from skimpy.utils.namespace import SPLIT, NET
 
 
@@ -63,8 +63,15 @@ class FluxControlFunction:
         self.mca_type = mca_type
 
 
-    def __call__(self, flux_dict, concentration_dict, parameter_population):
-
+    def __call__(self, flux_dict, concentration_dict, parameter_population,
+                 summarize=False, sketch_size=64):
+        """
+        :param summarize: If True, only accumulate the mean, variance and
+                          quantile sketch of the control coefficients over
+                          the population and return a `TensorSummary`
+                          instead of the full `Tensor`
+        :param sketch_size: Capacity of the quantile sketch levels
+        """
         # Calculate the Flux Control coefficients
         # Log response of the concentration with respect to the log change in a Parameter
         #
@@ -83,10 +90,25 @@ class FluxControlFunction:
 
         population_size = len(parameter_population)
 
+        if self.mca_type == NET:
+            flux_index = pd.Index(self.model.reactions.keys(), name="flux")
+        elif self.mca_type == SPLIT:
+            fwd_fluxes = ["fwd_"+k for k in self.model.reactions.keys()]
+            bwd_fluxes = ["bwd_"+k for k in self.model.reactions.keys()]
+            flux_index = pd.Index(fwd_fluxes+bwd_fluxes, name="flux")
+
+        parameter_index = pd.Index(self.parameter_elasticity_function.respective_variables, name="parameter")
+
+        if summarize:
+            summary = TensorSummary([flux_index, parameter_index],
+                                    sketch_size=sketch_size)
+        else:
+            flux_control_coefficients = zeros((num_fluxes,num_parameters,population_size))
 
-        flux_control_coefficients = zeros((num_fluxes,num_parameters,population_size))
+        # Gather the population once into canonical parameter vectors
+        parameter_array = self.model.get_parameter_array(parameter_population)
 
-        for i, parameters in enumerate(parameter_population):
+        for i, parameters in enumerate(parameter_array):
 
             if self.concentration_control_fun.volume_ratio_function is None:
                 volume_ratios = array([1, ] * len(concentrations) )
@@ -115,21 +137,24 @@ class FluxControlFunction:
                 elasticity_matrix += self.dependent_elasticity_function(concentrations, parameters)\
                                      .dot(dependent_weights)
 
-            C_Xi_P = self.concentration_control_fun(flux_dict, concentration_dict, [parameters])._data
+            C_Xi_P = self.concentration_control_fun.get_control_coefficients(fluxes,
+                                                                             flux_dict,
+                                                                             concentrations,
+                                                                             concentration_dict,
+                                                                             parameters)
 
             parameter_elasticity_matrix = self.parameter_elasticity_function(concentrations, parameters)
 
-            this_cc = elasticity_matrix.dot(C_Xi_P[:,:,0]) + parameter_elasticity_matrix
-            flux_control_coefficients[:,:,i] = this_cc
+            this_cc = elasticity_matrix.dot(C_Xi_P) + parameter_elasticity_matrix
 
-        if self.mca_type == NET:
-            flux_index = pd.Index(self.model.reactions.keys(), name="flux")
-        elif self.mca_type == SPLIT:
-            fwd_fluxes = ["fwd_"+k for k in self.model.reactions.keys()]
-            bwd_fluxes = ["bwd_"+k for k in self.model.reactions.keys()]
-            flux_index = pd.Index(fwd_fluxes+bwd_fluxes, name="flux")
+            if summarize:
+                summary.update(this_cc)
+            else:
+                flux_control_coefficients[:,:,i] = this_cc
+
+        if summarize:
+            return summary
 
-        parameter_index = pd.Index(self.parameter_elasticity_function.respective_variables, name="parameter")
         sample_index = pd.Index(range(population_size), name="sample")
 
         tensor_fcc = Tensor(flux_control_coefficients, [flux_index,parameter_index,sample_index])
@@ -27,11 +27,16 @@ limitations under the License.
 
 from skimpy.analysis.mca.elasticity_fun import ElasticityFunction
 from skimpy.analysis.mca.utils import get_dlogx_dlogy
-from skimpy.utils import iterable_to_tabdict
-from skimpy.utils.general import join_dicts
-from skimpy.utils.namespace import QSSA, PARAMETER, TQSSA, ELEMENTARY, NET, SPLIT
+from skimpy.analysis.ode.utils import get_expressions_from_model
+from skimpy.utils.namespace import QSSA, TQSSA, ELEMENTARY, NET, SPLIT, GCC
 
 from skimpy.utils import TabDict, iterable_to_tabdict
+from skimpy.utils.general import LRUCache
+from skimpy.utils.profiling import phase, count
+
+# Elasticity expressions indexed by (expression, variable)
+ELASTICITY_CACHE_SIZE = 2**18
+elasticity_cache = LRUCache(ELASTICITY_CACHE_SIZE)
 
 
 def make_mca_functions(kinetic_model,parameter_list,sim_type, mca_type=NET):
@@ -41,45 +46,12 @@ def make_mca_functions(kinetic_model,parameter_list,sim_type, mca_type=NET):
     :return:
     """
 
-    # Get all variables and expressions (Better solution with types?)
-    # TODO This should be a method in KineticModel that stores the expressions
+    # The rate expressions are derived once and shared with the ODE and flux
+    # functions
     if sim_type == QSSA:
-        all_data = []
-        # TODO Modifiers should be applicable for all simulation types
-        for this_reaction in kinetic_model.reactions.values():
-            this_reaction.mechanism.get_qssa_rate_expression()
-            # Update rate expressions
-            for this_mod in this_reaction.modifiers.values():
-                this_mod(this_reaction.mechanism.reaction_rates)
-            this_reaction.mechanism.update_qssa_rate_expression()
-
-            # Add modifier expressions
-            for this_mod in this_reaction.modifiers.values():
-                # Get parameters from modifiers
-                for p_type, parameter in this_mod.parameters.items():
-                    mod_sym = parameter.symbol
-                    this_reaction.mechanism.expression_parameters.update([mod_sym])
-
-                for r_type, reactant in this_mod.reactants.items():
-                    # Add massbalances for modfier reactants if as non-zero stoich
-                    if this_mod.reactant_stoichiometry[r_type] == 0:
-                        continue
-
-                    mod_sym = reactant.symbol
-                    flux = this_reaction.mechanism.reaction_rates['v_net']
-                    flux_expression = flux * this_mod.reactant_stoichiometry[r_type]
-                    this_reaction.mechanism.expressions[mod_sym] = flux_expression
-
-                    # Add small molecule parameters if they are
-                    if reactant.type == PARAMETER:
-                        this_reaction.mechanism.expression_parameters.update([mod_sym])
-
-            flux = this_reaction.mechanism.reaction_rates['v_net']
-            dxdt = this_reaction.mechanism.expressions
-            parameters = this_reaction.mechanism.expression_parameters
-
-            all_data.append((this_reaction.mechanism.expressions,
-                         this_reaction.mechanism.expression_parameters))
+        with phase('rate expressions'):
+            all_data = [(dxdt, parameters) for dxdt, _, parameters
+                        in get_expressions_from_model(kinetic_model, sim_type)]
 
     elif sim_type == TQSSA:
         raise(NotImplementedError)
@@ -130,7 +102,9 @@ def make_mca_functions(kinetic_model,parameter_list,sim_type, mca_type=NET):
                                                          parameter_list,
                                                          all_variables,
                                                          all_parameters,
-                                                         kinetic_model.pool
+                                                         kinetic_model.pool,
+                                                         cache=elasticity_cache,
+                                                         backend=kinetic_model.backend
                                                          )
     else:
         parameter_elasticities_fun = None
@@ -140,7 +114,9 @@ def make_mca_functions(kinetic_model,parameter_list,sim_type, mca_type=NET):
                                                       all_independent_variables,
                                                       all_variables,
                                                       all_parameters,
-                                                      kinetic_model.pool
+                                                      kinetic_model.pool,
+                                                      cache=elasticity_cache,
+                                                      backend=kinetic_model.backend
                                                      )
 
     if all_dependent_variables:
@@ -148,7 +124,9 @@ def make_mca_functions(kinetic_model,parameter_list,sim_type, mca_type=NET):
                                                         all_dependent_variables,
                                                         all_variables,
                                                         all_parameters,
-                                                        kinetic_model.pool
+                                                        kinetic_model.pool,
+                                                        cache=elasticity_cache,
+                                                        backend=kinetic_model.backend
                                                        )
     else:
         dependent_elasticity_fun = None
@@ -156,61 +134,46 @@ def make_mca_functions(kinetic_model,parameter_list,sim_type, mca_type=NET):
     return independent_elasticity_fun, dependent_elasticity_fun, parameter_elasticities_fun
 
 
-def make_elasticity_fun(expressions, respective_variables, variables, parameters, pool=None):
+def make_elasticity_fun(expressions, respective_variables, variables, parameters, pool=None,
+                        cache=None, backend=GCC):
     """
     Create an ElasticityFunction with elasticity = dlog(expression)/dlog(respective_variable)
     :param expressions  tab_dict of expressions (e.g. forward and backward fluxes)
     :param variables    list of variables as string (e.g. concentrations or parameters)
+    :param cache        optional LRUCache of elasticities indexed by (expression, variable),
+                        only the missing elasticities are derived and added
+    :param backend      GCC or NUMPY
 
     """
-    if pool is None:
-        elasticity_fun = make_elasticity_fun_single_cpu(expressions,
-                                                       respective_variables,
-                                                       variables,
-                                                       parameters)
-    else:
-        elasticity_fun = make_elasticity_fun_multicore(expressions,
-                                                      respective_variables,
-                                                      variables,
-                                                      parameters,
-                                                      pool)
-
-
-    return elasticity_fun
-
-
-def make_elasticity_fun_single_cpu(expressions,respective_variables ,variables, parameters):
-    # Get the derivative of expression x vs variable y
-    elasticity_expressions = {}
+    if cache is None:
+        cache = LRUCache(ELASTICITY_CACHE_SIZE)
 
+    # Find the non-zero entries that are not derived yet
+    entries = []
+    missing = []
     for row, this_expression in enumerate(expressions):
-
-        for column,this_variable in enumerate(respective_variables.values()):
-
-            if this_variable in this_expression.free_symbols:
-                this_elasticity = get_dlogx_dlogy(this_expression, this_variable)
-                elasticity_expressions[(row, column)] = this_elasticity
-
-    # Shape of the matrix
-    shape = (len(expressions), len(respective_variables))
-
-    # Create the elasticity function
-    elasticity_fun = ElasticityFunction(elasticity_expressions,
-                                        respective_variables,
-                                        variables,
-                                        parameters,
-                                        shape, )
-    return elasticity_fun
-
-
-def make_elasticity_fun_multicore(expressions,respective_variables ,variables, parameters, pool):
-    # Get the derivative of expression x vs variable y
-
-    inputs = [(i,e,respective_variables) for i,e in enumerate(expressions)]
-
-    all_row_slices = pool.map(make_elasticity_single_row,inputs)
-
-    elasticity_expressions = join_dicts(all_row_slices)
+        free_symbols = this_expression.free_symbols
+        missing_columns = []
+        for column, this_variable in enumerate(respective_variables.values()):
+            if this_variable in free_symbols:
+                entries.append(((row, column), (this_expression, this_variable)))
+                if cache.lookup((this_expression, this_variable)) is None:
+                    missing_columns.append((column, this_variable))
+        if missing_columns:
+            missing.append((row, this_expression, missing_columns))
+
+    with phase('elasticities'):
+        if pool is None:
+            all_row_slices = [make_elasticity_single_row(x) for x in missing]
+        else:
+            all_row_slices = pool.map(make_elasticity_single_row, missing)
+    count('derived elasticities', sum(len(x[2]) for x in missing))
+
+    for (row, this_expression, missing_columns), this_row_slice in zip(missing, all_row_slices):
+        for column, this_variable in missing_columns:
+            cache.store((this_expression, this_variable), this_row_slice[(row, column)])
+
+    elasticity_expressions = TabDict([(coord, cache[key]) for coord, key in entries])
 
     # Shape of the matrix
     shape = (len(expressions), len(respective_variables))
@@ -221,23 +184,23 @@ def make_elasticity_fun_multicore(expressions,respective_variables ,variables, p
                                         variables,
                                         parameters,
                                         shape,
-                                        pool=pool)
+                                        pool=pool,
+                                        backend=backend)
     return elasticity_fun
 
 
 def make_elasticity_single_row(input):
     """
     Halter function to compute a full row of the elasticity matrix
-    :param input: input tuple of row, expression and all respective vars
+    :param input: input tuple of row, expression and a list of the columns
+                  and respective variables to derive
     :return:
     """
     elasticity_expressions_row_slice = {}
-    this_row, this_expression, respective_variables = input
-
-    for column, this_variable in enumerate(respective_variables.values()):
+    this_row, this_expression, respective_columns = input
 
-        if this_variable in this_expression.free_symbols:
-            this_elasticity = get_dlogx_dlogy(this_expression, this_variable)
-            elasticity_expressions_row_slice[(this_row, column)] = this_elasticity
+    for column, this_variable in respective_columns:
+        this_elasticity = get_dlogx_dlogy(this_expression, this_variable)
+        elasticity_expressions_row_slice[(this_row, column)] = this_elasticity
 
-    return elasticity_expressions_row_slice
\ No newline at end of file
+    return elasticity_expressions_row_slice
@@ -26,6 +26,7 @@ limitations under the License.
 """
 from .utils import get_reduced_stoichiometry
 from skimpy.utils.tabdict import TabDict
+from skimpy.utils.profiling import phase
 
 
 def prepare_mca(kinetic_model, **kwargs):
@@ -34,8 +35,9 @@ def prepare_mca(kinetic_model, **kwargs):
     all_variables = TabDict([(k,v.symbol) for k,v in kinetic_model.reactants.items()])
 
     #Get depedent variables (i.e. concentrations)
-    reduced_stoichiometry, dependent_weights, independent_ix, dependent_ix = \
-        get_reduced_stoichiometry(kinetic_model, all_variables)
+    with phase('reduced stoichiometry'):
+        reduced_stoichiometry, dependent_weights, independent_ix, dependent_ix = \
+            get_reduced_stoichiometry(kinetic_model, all_variables)
 
 
     return reduced_stoichiometry,\
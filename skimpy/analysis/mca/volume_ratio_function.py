@@ -25,7 +25,7 @@ limitations under the License.
 
 """
 
-from numpy import array, double, zeros
+from numpy import array, double, zeros, ndarray
 from numpy import append as append_array
 
 from sympy import symbols
@@ -48,11 +48,27 @@ class VolumeRatioFunction:
 
         """
         self.reactants = model.reactants
+        self._cell_volume_ix = None
+        self._volume_ix = None
+
+    def link_parameter_index(self, parameter_index):
+        """
+        Precompute the positions of the function parameters in the
+        canonical parameter vector of the model
+        """
+        compartments = [v.compartment.parameters for v in self.reactants.values()]
+        self._cell_volume_ix = parameter_index.link(
+            [c.cell_volume.symbol for c in compartments])
+        self._volume_ix = parameter_index.link(
+            [c.volume.symbol for c in compartments])
 
     def __call__(self,parameters):
         """
         Return a list of volume ratios
         """
+        if isinstance(parameters, ndarray):
+            return parameters[self._cell_volume_ix] / parameters[self._volume_ix]
+
         values = [parameters[v.compartment.parameters.cell_volume.symbol] /
                   parameters[v.compartment.parameters.volume.symbol]
                   for k, v in self.reactants.items()]
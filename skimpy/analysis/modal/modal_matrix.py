@@ -30,8 +30,8 @@ import numpy as np
 import scipy
 
 from numpy.linalg import eig
-from skimpy.utils import TabDict
-from skimpy.analysis.ode import FluxFunction
+from skimpy.analysis.ode.utils import make_flux_fun
+from skimpy.utils.namespace import QSSA
 
 def modal_matrix(kmodel,concentration_dict,parameters, flux_modes=False, tolerance=1e-12):
     """
@@ -53,17 +53,8 @@ def modal_matrix(kmodel,concentration_dict,parameters, flux_modes=False, toleran
         raise RuntimeError("MCA function not compiled cannot proceed modal analysis!")
 
     if not hasattr(kmodel,'flux_fun'):
-
-        flux_expressions = TabDict([ (rxn.name, rxn.mechanism.reaction_rates['v_net'])
-                             for rxn in kmodel.reactions.values()])
-        flux_parameters = TabDict([(p.name, p) for rxn in kmodel.reactions.values()
-                            for p in rxn.mechanism.expression_parameters])
-        kmodel.flux_fun = FluxFunction(kmodel.variables,
-                                       flux_expressions,
-                                       flux_parameters,
-                                       kmodel.pool)
-
-
+        kmodel.flux_fun = make_flux_fun(kmodel, QSSA)
+        kmodel.link_parameter_index(kmodel.flux_fun)
 
     fluxes = kmodel.flux_fun(concentration_dict,parameters=parameters)
 
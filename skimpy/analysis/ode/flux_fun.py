@@ -26,12 +26,14 @@ limitations under the License.
 """
 
 import numpy as np
+import pandas as pd
 from sympy import symbols
-from skimpy.utils.compile_sympy import make_cython_function
+from skimpy.utils.compile_sympy import make_function, instantiate_rates
+from skimpy.utils.namespace import GCC
 
 
 class FluxFunction:
-    def __init__(self, variables, expr, parameters, pool=None):
+    def __init__(self, variables, expr, parameters, pool=None, rates=None, backend=GCC):
         """
         Constructor for a precompiled function to solve the ode epxressions
         numerically
@@ -39,32 +41,117 @@ class FluxFunction:
         :param expr: dict of sympy expressions for the rate of
                      change of a variable indexed by the variable name
         :param parameters: dict of parameters with parameter values
+        :param rates: optional list of rates (rate symbol, template,
+                      arguments), if given the expressions are the rate
+                      symbols and the rates are evaluated with one template
+                      per mechanism
+        :param backend: GCC or NUMPY
 
         """
         self.variables = variables
-        self.expr = expr
+        self.rates = rates
+        if rates is None:
+            self.rate_expressions = None
+            self.expr = expr
+        else:
+            self.rate_expressions = expr
+            self._expr = None
+        self.reactions = list(expr.keys())
         self.parameters = parameters
+        self._parameter_ix = None
 
         # Unpacking is needed as ufuncify only take ArrayTypes
         the_param_keys = [x for x in self.parameters]
         the_variable_keys = [x for x in variables]
         sym_vars = list(symbols(the_variable_keys+the_param_keys))
 
-        self.function = make_cython_function(sym_vars, expr.values(), simplify=True, pool=pool)
+        self.function = make_function(sym_vars, expr.values(), simplify=True, pool=pool,
+                                      backend=backend, rates=rates)
+
+    @property
+    def expr(self):
+        # Templated functions instantiate the full expressions on demand
+        if self._expr is None and self.rates is not None:
+            self._expr = instantiate_rates(self.rate_expressions, self.rates)
+        return self._expr
+
+    @expr.setter
+    def expr(self, value):
+        self._expr = value
+
+    def link_parameter_index(self, parameter_index):
+        """
+        Precompute the positions of the function parameters in the
+        canonical parameter vector of the model
+        """
+        self._parameter_ix = parameter_index.link(self.parameters)
+
+    def get_default_parameters(self):
+        """
+        Parameter values of the model when the function was made, see
+        make_flux_fun
 
+        :return: list of the values in the order of the function parameters
+        """
+        values = getattr(self, '_parameter_values', dict())
+        missing = [x for x in self.parameters if values.get(x) is None]
+        if missing:
+            raise ValueError("No values for the parameters {}, pass the "
+                             "parameters explicitly".format(missing))
+        return [values[x] for x in self.parameters]
 
     def __call__(self,concentrations,  parameters=None):
-        # Todo handle different input types
+        # Arrays of concentrations are evaluated in one batched call
+        if isinstance(concentrations, (np.ndarray, pd.DataFrame)):
+            return self.batch(concentrations, parameters)
+
         variables = [concentrations[str(x)] for x in self.variables]
 
         if parameters is None:
-            input_vars = list(variables)+list(self.parameters.values())
+            input_vars = list(variables) + self.get_default_parameters()
+        elif isinstance(parameters, np.ndarray):
+            input_vars = list(variables) + list(parameters[self._parameter_ix])
         else:
             input_vars = list(variables) \
                          + [parameters[x] for x in self.parameters]
 
-        fluxes = np.zeros(len(self.expr))
+        fluxes = np.zeros(len(self.reactions))
 
         self.function(input_vars, fluxes)
 
-        return {k:v for k,v in zip(list(self.expr.keys()) , fluxes)}
+        return {k:v for k,v in zip(self.reactions, fluxes)}
+
+    def batch(self, concentrations, parameters=None):
+        """
+        Evaluate the fluxes for each row of the concentrations in one call
+
+        :param concentrations: (samples x variables) array in the order of
+                               the variables or a data frame with the
+                               variables as columns, e.g. an ode trajectory
+        :param parameters: None for the model values (see
+                           get_default_parameters), dict, parameter vector
+                           in canonical order
+                           (see link_parameter_index) or (samples x parameters)
+                           array of parameter vectors
+        :return: (samples x reactions) array of the fluxes
+        """
+        if isinstance(concentrations, pd.DataFrame):
+            concentrations = concentrations[[str(x) for x in self.variables]].values
+        concentrations = np.atleast_2d(concentrations)
+
+        num_variables = len(self.variables)
+        num_inputs = num_variables + len(self.parameters)
+        inputs = self.function.make_input_buffer(concentrations.shape[0])
+        inputs[:, :num_variables] = concentrations
+
+        if parameters is None:
+            inputs[:, num_variables:num_inputs] = self.get_default_parameters()
+        elif isinstance(parameters, np.ndarray):
+            inputs[:, num_variables:num_inputs] = parameters[..., self._parameter_ix]
+        else:
+            inputs[:, num_variables:num_inputs] = [parameters[x] for x in self.parameters]
+
+        fluxes = np.empty((concentrations.shape[0], len(self.reactions)))
+        self.function.batch(inputs, fluxes)
+
+        return fluxes
@@ -27,7 +27,6 @@ limitations under the License.
 
 import numpy as np
 from sympy import symbols
-from skimpy.utils.compile_sympy import make_cython_function
 from skimpy.analysis.ode.flux_fun import FluxFunction
 
 # Same as flux function
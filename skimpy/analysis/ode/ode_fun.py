@@ -25,10 +25,13 @@ limitations under the License.
 
 """
 
+from time import perf_counter
+
 from numpy import array, double
 from sympy import symbols, Symbol
 
-from skimpy.utils.compile_sympy import make_cython_function
+from skimpy.utils.compile_sympy import make_function, instantiate_rates
+from skimpy.utils.namespace import GCC, TIME
 from skimpy.utils.general import robust_index
 from ...utils.tabdict import TabDict
 from warnings import warn
@@ -36,7 +39,8 @@ from warnings import warn
 
 class ODEFunction:
     def __init__(self, model, variables, expressions, parameters,
-                 pool=None, with_time=False, custom_ode_update=None):
+                 pool=None, with_time=False, custom_ode_update=None,
+                 rates=None, backend=GCC):
         """
         Constructor for a precompiled function to solve the ode epxressions
         numerically
@@ -44,30 +48,63 @@ class ODEFunction:
         :param expressions: dict of sympy expressions for the rate of
                      change of a variable indexed by the variable name
         :param parameters: dict of parameters
+        :param with_time: the expressions depend on the time TIME
+        :param rates: optional list of rates (rate symbol, template,
+                      arguments), if given the expressions are in terms of
+                      the rate symbols and the rates are evaluated with one
+                      template per mechanism
+        :param backend: GCC or NUMPY
 
         """
         self.variables = variables
-        self.expressions = expressions
+        self.rates = rates
+        if rates is None:
+            self.rate_expressions = None
+            self.expressions = expressions
+        else:
+            self.rate_expressions = expressions
+            self._expressions = None
         self.model = model
         self.with_time = with_time
         self.custom_ode_update=custom_ode_update
+        # Opt-in EvaluationStatistics of the calls
+        self.statistics = None
         # Link to the model
         self._parameters = parameters
+        self._parameter_ix = None
+
+        # Input buffer of the kernel: time, state and parameters. The
+        # parameters are written by get_params and the state by each call.
+        self._num_states = len(variables) + (1 if with_time else 0)
+        self._input_buffer = None
+        self._kernel = None
 
         # Unpacking is needed as ufuncify only take ArrayTypes
         the_param_keys = [x for x in self._parameters]
         the_variable_keys = [x for x in variables]
 
         if with_time:
-            the_variable_keys = ['t',] + the_variable_keys
+            the_variable_keys = [TIME,] + the_variable_keys
 
         sym_vars = list(symbols(the_variable_keys+the_param_keys))
 
         # Sort the expressions
-        expressions = [self.expressions[x] for x in self.variables.values()]
+        expressions = [expressions[x] for x in self.variables.values()]
 
         # Awsome magic
-        self.function = make_cython_function(sym_vars, expressions, simplify=True, pool=pool)
+        self.function = make_function(sym_vars, expressions, simplify=True, pool=pool,
+                                      backend=backend, rates=rates)
+
+    @property
+    def expressions(self):
+        # Templated functions instantiate the full expressions on demand
+        if self._expressions is None and self.rates is not None:
+            self._expressions = instantiate_rates(self.rate_expressions, self.rates)
+        return self._expressions
+
+    @expressions.setter
+    def expressions(self, value):
+        self._expressions = value
 
     @property
     def parameters(self):
@@ -79,15 +116,76 @@ class ODEFunction:
     def parameters(self, value):
         self._parameters = value
 
-    def get_params(self):
-        self._parameters_values = self.parameters.values()
+    def link_parameter_index(self, parameter_index):
+        """
+        Precompute the positions of the function parameters in the
+        canonical parameter vector of the model
+        """
+        self._parameter_ix = parameter_index.link(self._parameters)
+
+    def get_params(self, parameters=None):
+        """
+        Fetch the parameter values used by the solver
+        :param parameters: optional parameter vector in the canonical order of
+                           the model, if None the model values are used
+        """
+        if parameters is None and self.model is None:
+            raise ValueError("Detached functions require a parameter vector")
+
+        if self._parameter_ix is None:
+            if parameters is not None:
+                raise ValueError("Parameter vectors require a linked "
+                                 "parameter index")
+            self._parameters_values = self.parameters.values()
+        else:
+            if parameters is None:
+                parameters = self.model.get_parameter_vector()
+
+            self._parameters_values = parameters[self._parameter_ix]
+
+        # The buffer holds the work space of templated kernels behind the inputs
+        self._input_buffer = self.function.make_input_buffer()
+        self._input_buffer[self._num_states:self.function.num_inputs] = \
+            list(self._parameters_values)
+        self._kernel = self.function.bind(self._input_buffer)
+
+    def __getstate__(self):
+        # The model is not pickled, detached functions are evaluated with
+        # parameter vectors or the parameter values fetched before pickling
+        state = self.__dict__.copy()
+        state['model'] = None
+        # The kernel is bound again to the unpickled buffer
+        state['_kernel'] = None
+        return state
 
     def __call__(self, t, y, ydot):
+        statistics = self.statistics
+        if statistics is not None:
+            start = perf_counter()
+
+        kernel = self._kernel
+        if kernel is None:
+            if self._input_buffer is None:
+                raise RuntimeError("The parameters need to be fetched with "
+                                   "get_params before the first call")
+            kernel = self._kernel = self.function.bind(self._input_buffer)
+
+        # Copy the state in place, ydot needs to be a contiguous float64 array
         if self.with_time:
-            input_vars = [t,]+list(y)+list(self._parameters_values)
+            self._input_buffer[0] = t
+            self._input_buffer[1:self._num_states] = y
         else:
-            input_vars = list(y)+list(self._parameters_values)
-        self.function(input_vars, ydot)
-        
+            self._input_buffer[:self._num_states] = y
+
+        if statistics is None:
+            kernel(ydot)
+        else:
+            kernel_start = perf_counter()
+            kernel(ydot)
+            kernel_time = perf_counter() - kernel_start
+
         if not self.custom_ode_update is None:
             self.custom_ode_update( t, y, ydot)
+
+        if statistics is not None:
+            statistics.add(kernel_time, perf_counter() - start)
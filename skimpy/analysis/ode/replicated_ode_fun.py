@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import numpy as np
+from sympy import Symbol
+
+from skimpy.utils.compile_sympy import make_function
+from skimpy.utils.namespace import GCC, TIME
+from skimpy.utils.tabdict import TabDict
+
+# Placeholders of the strain kernels and the medium function
+STRAIN_BIOMASS = '_biomass_'
+STRAIN_BIOMASS_SCALING = '_biomass_scaling_'
+STRAIN_RATE = '_strains_{}'
+
+
+class StrainKernel:
+    """
+    Compiled mass balances of one strain model in its own, unprefixed names.
+    The inputs are the states, the parameters and the biomass scaling, the
+    outputs are the rates of change of the states. The states are the
+    biomass STRAIN_BIOMASS, the medium and the intracellular reactants.
+    """
+    def __init__(self, function, states, parameters):
+        """
+        :param function: CompiledFunction or NumpyFunction
+        :param states: list of the state names
+        :param parameters: list of the parameter names
+        """
+        self.function = function
+        self.states = states
+        self.parameters = parameters
+
+    def __repr__(self):
+        return "{}({} states, {} parameters)".format(self.__class__.__name__,
+                                                   len(self.states),
+                                                   len(self.parameters))
+
+
+class ReplicatedODEFunction:
+    def __init__(self, reactor, variables, kernels, exchange_expressions,
+                 exchange_parameters, custom_ode_update=None, backend=GCC):
+        """
+        Ode function of a reactor evaluating each strain kernel for all its
+        strains in one batched call. The strain rates are scattered to the
+        reactor variables with index maps, the rates of the shared medium and
+        biomass variables then pass through the exchange function applying
+        the boundary conditions and custom terms.
+
+        :param reactor: ReplicatedReactor
+        :param variables: TabDict of the variable symbols of the reactor
+        :param kernels: list of tuples (StrainKernel, list of strain names)
+        :param exchange_expressions: TabDict of the expressions of the medium
+                                     and biomass variables indexed by their
+                                     name, in terms of the summed strain
+                                     rates Symbol(STRAIN_RATE.format(name))
+        :param exchange_parameters: TabDict of the reactor parameters used
+                                    by the exchange expressions
+        :param backend: GCC or NUMPY
+        """
+        self.reactor = reactor
+        self.variables = variables
+        self.kernels = kernels
+        self.exchange_expressions = exchange_expressions
+        self.custom_ode_update = custom_ode_update
+        self._parameters = exchange_parameters
+
+        variable_ix = {k: i for i, k in enumerate(variables)}
+
+        # Reactor variables of the states of each strain
+        self._state_ix = []
+        for kernel, strains in kernels:
+            state_ix = [[variable_ix[get_strain_variable(strain, x, reactor.medium)]
+                         for x in kernel.states]
+                        for strain in strains]
+            self._state_ix.append(np.array(state_ix, dtype=int).reshape(len(strains),
+                                                                       len(kernel.states)))
+
+        # Exchange function: time, summed strain rates, variables and parameters
+        self._exchange_ix = np.array([variable_ix[k] for k in exchange_expressions],
+                                     dtype=int)
+        inputs = [Symbol(TIME)] \
+                 + [Symbol(STRAIN_RATE.format(k)) for k in exchange_expressions] \
+                 + [variables[k] for k in exchange_expressions] \
+                 + list(exchange_parameters.values())
+
+        self.exchange_function = make_function(inputs, exchange_expressions.values(),
+                                               simplify=True, backend=backend)
+
+        self._inputs = None
+        self._outputs = None
+        self._exchange_buffer = None
+        self._exchange_rates = None
+
+        # Positions of the parameters in the canonical reactor parameters
+        self._parameter_ix = None
+        self._biomass_scaling = None
+
+    @property
+    def parameters(self):
+        reactor_params = self.reactor.parameters
+        return TabDict((k, reactor_params[k]) for k in self._parameters)
+
+    def link_parameter_index(self, parameter_index):
+        """
+        Precompute the positions of the strain and exchange parameters in
+        the canonical parameter vector of the reactor, whose parameters are
+        named strain_parameter
+        """
+        strain_ix = [parameter_index.link(['{}_{}'.format(s, p)
+                                           for s in strains
+                                           for p in kernel.parameters])
+                     .reshape(len(strains), len(kernel.parameters))
+                     for kernel, strains in self.kernels]
+        self._parameter_ix = (strain_ix, parameter_index.link(self._parameters))
+        self._fetch_biomass_scaling()
+
+    def _fetch_biomass_scaling(self):
+        # Detached functions keep the scalings fetched before pickling
+        self._biomass_scaling = [[self.reactor.biomass_scaling[s] for s in strains]
+                                 for _, strains in self.kernels]
+
+    def get_params(self, parameters=None):
+        """
+        Fetch the strain parameters and the biomass scalings of the reactor
+        :param parameters: optional parameter vector in the canonical order
+                           of the reactor, see link_parameter_index
+        """
+        if parameters is None and self.reactor is None:
+            raise ValueError("Detached functions require a parameter vector")
+        if parameters is not None and self._parameter_ix is None:
+            raise ValueError("Parameter vectors require a linked "
+                             "parameter index")
+
+        if self.reactor is not None:
+            self._fetch_biomass_scaling()
+
+        self._inputs = []
+        self._outputs = []
+        for kernel_ix, (kernel, strains) in enumerate(self.kernels):
+            num_states = len(kernel.states)
+            inputs = np.zeros((len(strains), kernel.function.num_inputs))
+            if parameters is None:
+                inputs[:, num_states:-1] = [[self.reactor.strain_parameters[s][p]
+                                             for p in kernel.parameters]
+                                            for s in strains]
+            else:
+                inputs[:, num_states:-1] = parameters[self._parameter_ix[0][kernel_ix]]
+            inputs[:, -1] = self._biomass_scaling[kernel_ix]
+
+            self._inputs.append(inputs)
+            self._outputs.append(np.zeros((len(strains), num_states)))
+
+        num_exchange = len(self._exchange_ix)
+        self._exchange_buffer = np.zeros(self.exchange_function.num_inputs)
+        self._exchange_buffer[1 + 2*num_exchange:] = list(self.parameters.values()) \
+            if parameters is None else parameters[self._parameter_ix[1]]
+        self._exchange_rates = np.zeros(num_exchange)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['reactor'] = None
+        return state
+
+    def __call__(self, t, y, ydot):
+        if self._inputs is None:
+            raise RuntimeError("The parameters need to be fetched with "
+                               "get_params before the first call")
+
+        y = np.asarray(y)
+        num_variables = len(y)
+        rates = np.zeros(num_variables)
+
+        for kernel_ix, (kernel, _) in enumerate(self.kernels):
+            state_ix = self._state_ix[kernel_ix]
+            inputs = self._inputs[kernel_ix]
+            outputs = self._outputs[kernel_ix]
+
+            inputs[:, :state_ix.shape[1]] = y[state_ix]
+            kernel.function.batch(inputs, outputs)
+
+            # The medium is shared, its rates are summed over the strains
+            rates += np.bincount(state_ix.ravel(), weights=outputs.ravel(),
+                                 minlength=num_variables)
+
+        num_exchange = len(self._exchange_ix)
+        buffer = self._exchange_buffer
+        buffer[0] = t
+        buffer[1:1 + num_exchange] = rates[self._exchange_ix]
+        buffer[1 + num_exchange:1 + 2*num_exchange] = y[self._exchange_ix]
+        self.exchange_function(buffer, self._exchange_rates)
+        rates[self._exchange_ix] = self._exchange_rates
+
+        ydot[:] = rates
+
+        if not self.custom_ode_update is None:
+            self.custom_ode_update(t, y, ydot)
+
+
+def get_strain_variable(strain, state, medium):
+    """
+    :return: name of the reactor variable of a state of a strain kernel
+    """
+    if state == STRAIN_BIOMASS:
+        return 'biomass_{}'.format(strain)
+    elif state in medium:
+        return state
+    else:
+        return '{}_{}'.format(strain, state)
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from sympy import symbols
+
+from skimpy.analysis.ode.symbolic_jacobian_fun import SymbolicJacobianFunction, \
+    make_symbolic_jacobian
+from skimpy.utils.compile_sympy import make_function
+from skimpy.utils.namespace import GCC
+
+
+class ODEDerivativeFunction:
+    def __init__(self, ode_fun, sensitivity_parameters, pool=None, backend=GCC):
+        """
+        Compiled derivatives df/dx and df/dp of the ode expressions, base of
+        the forward sensitivities and the adjoint. The jacobian df/dx is a
+        SymbolicJacobianFunction, the derivatives df/dp are compiled with the
+        same inputs such that both kernels read one buffer of the state and
+        the parameters.
+
+        Custom ode updates of the ode function are not derived.
+
+        :param ode_fun: ODEFunction of the model
+        :param sensitivity_parameters: list of the parameter names of df/dp
+        :param backend: GCC or NUMPY
+        """
+        if ode_fun.with_time:
+            raise NotImplementedError("Derivatives of time dependent ode "
+                                      "functions are not supported")
+
+        self.ode_fun = ode_fun
+        self.variables = ode_fun.variables
+        self.parameters = ode_fun._parameters
+        self.sensitivity_parameters = [str(p) for p in sensitivity_parameters]
+        self._parameter_ix = None
+
+        missing = [p for p in self.sensitivity_parameters if p not in self.parameters]
+        if missing:
+            raise ValueError("Parameters {} are not parameters of the ode "
+                             "function".format(missing))
+
+        expressions = ode_fun.expressions
+        self.jacobian_fun = SymbolicJacobianFunction(self.variables, expressions,
+                                                     self.parameters, pool=pool,
+                                                     backend=backend)
+
+        self.parameter_expressions = make_symbolic_jacobian(
+            self.variables.values(), expressions, pool=pool,
+            symbols=[self.parameters[p] for p in self.sensitivity_parameters])
+
+        # Same inputs as the jacobian: the variables and the parameters
+        sym_vars = list(symbols(list(self.variables) + list(self.parameters)))
+        if self.parameter_expressions:
+            coordinates, parameter_expressions = zip(*self.parameter_expressions.items())
+            self.parameter_function = make_function(sym_vars, parameter_expressions,
+                                                    pool=pool, simplify=False,
+                                                    backend=backend)
+        else:
+            coordinates = []
+            self.parameter_function = None
+
+        # The entry (k, j) is the derivative of the expression j by parameter k
+        self._parameter_entries = (np.array([j for _, j in coordinates], dtype=int),
+                                   np.array([k for k, _ in coordinates], dtype=int))
+
+        # The entry (i, j) of the jacobian function is the derivative of the
+        # expression j by the variable i, the data of the sparse jacobian is
+        # gathered from the kernel output with a permutation
+        num_variables = len(self.variables)
+        self._jacobian_entries = (np.array(self.jacobian_fun.columns, dtype=int),
+                                  np.array(self.jacobian_fun.rows, dtype=int))
+        positions = np.arange(1, len(self._jacobian_entries[0]) + 1, dtype=np.float64)
+        self._jacobian = coo_matrix((positions, self._jacobian_entries),
+                                    shape=(num_variables, num_variables)).tocsr()
+        self._jacobian_permutation = self._jacobian.data.astype(int) - 1
+
+        self._input_buffer = None
+        self._jacobian_kernel = None
+        self._parameter_kernel = None
+
+    def link_parameter_index(self, parameter_index):
+        """
+        Precompute the positions of the function parameters in the
+        canonical parameter vector of the model
+        """
+        self._parameter_ix = parameter_index.link(self.parameters)
+        self.jacobian_fun.link_parameter_index(parameter_index)
+
+    def get_params(self, parameters=None):
+        """
+        Fetch the parameter values used by the solver
+        :param parameters: optional parameter vector in the canonical order of
+                           the model, if None the model values are used
+        """
+        if self._parameter_ix is None:
+            raise ValueError("The derivatives require a linked parameter index")
+
+        if parameters is None:
+            if self.ode_fun.model is None:
+                raise ValueError("Detached functions require a parameter vector")
+            parameters = self.ode_fun.model.get_parameter_vector()
+
+        self.ode_fun.get_params(parameters)
+
+        num_variables = len(self.variables)
+        self._input_buffer = np.zeros(num_variables + len(self.parameters))
+        self._input_buffer[num_variables:] = parameters[self._parameter_ix]
+
+        self._jacobian_values = np.zeros(len(self._jacobian_permutation))
+        self._jacobian_kernel = self.jacobian_fun.function.bind(self._input_buffer)
+
+        self._parameter_values = np.zeros(len(self._parameter_entries[0]))
+        if self.parameter_function is not None:
+            self._parameter_kernel = self.parameter_function.bind(self._input_buffer)
+
+    def set_state(self, y):
+        """
+        Write the variables to the input buffer of the kernels
+        """
+        if self._input_buffer is None:
+            raise RuntimeError("The parameters need to be fetched with "
+                               "get_params before the first call")
+
+        self._input_buffer[:len(self.variables)] = y[:len(self.variables)]
+
+    def evaluate_jacobian(self):
+        """
+        :return: sparse jacobian df/dx at the current state, it is updated
+                 in place by the next evaluation
+        """
+        self._jacobian_kernel(self._jacobian_values)
+        self._jacobian.data[:] = self._jacobian_values[self._jacobian_permutation]
+        return self._jacobian
+
+    def evaluate_parameter_jacobian(self):
+        """
+        :return: values of the non zero entries of df/dp at the current state,
+                 the entries are indexed by _parameter_entries
+        """
+        if self._parameter_kernel is not None:
+            self._parameter_kernel(self._parameter_values)
+        return self._parameter_values
+
+    def __getstate__(self):
+        # The kernels are bound again by get_params
+        state = self.__dict__.copy()
+        state['_jacobian_kernel'] = None
+        state['_parameter_kernel'] = None
+        state['_input_buffer'] = None
+        return state
+
+
+class SensitivityFunction(ODEDerivativeFunction):
+    def __init__(self, ode_fun, sensitivity_parameters, pool=None, backend=GCC):
+        """
+        Right hand side of the ode augmented with the forward sensitivities
+        S = dx/dp of the variables to a subset of the parameters
+
+            dS/dt = df/dx S + df/dp
+
+        The state is the variables followed by the row major (variables x
+        parameters) sensitivity matrix.
+
+        :param ode_fun: ODEFunction of the model
+        :param sensitivity_parameters: list of parameter names
+        :param backend: GCC or NUMPY
+        """
+        ODEDerivativeFunction.__init__(self, ode_fun, sensitivity_parameters,
+                                       pool=pool, backend=backend)
+
+    @property
+    def num_states(self):
+        return len(self.variables)*(len(self.sensitivity_parameters) + 1)
+
+    def get_params(self, parameters=None):
+        ODEDerivativeFunction.get_params(self, parameters)
+        num_variables = len(self.variables)
+        self._parameter_jacobian = np.zeros((num_variables, len(self.sensitivity_parameters)))
+        self._rates = np.zeros(num_variables)
+
+    def __call__(self, t, y, ydot):
+        num_variables = len(self.variables)
+        y = np.asarray(y)
+
+        self.set_state(y)
+        jacobian = self.evaluate_jacobian()
+        self._parameter_jacobian[self._parameter_entries] = self.evaluate_parameter_jacobian()
+
+        self.ode_fun(t, y[:num_variables], self._rates)
+        ydot[:num_variables] = self._rates
+
+        sensitivities = y[num_variables:].reshape(num_variables, -1)
+        ydot[num_variables:] = (jacobian.dot(sensitivities) + self._parameter_jacobian).ravel()
+
+    def jacobian_times_vector(self, v, Jv, t, y):
+        """
+        Product of the jacobian of the augmented system with a vector for the
+        iterative linear solvers (jac_times_vecfn of cvode with the spgmr
+        linsolver). Neglecting the second derivatives, the jacobian applies
+        df/dx to the variables and to each column of the sensitivities, thus
+        only the sparse (variables x variables) jacobian is evaluated.
+
+        :param v: vector of the states
+        :param Jv: product array, it is overwritten
+        :return: 0
+        """
+        num_variables = len(self.variables)
+        v = np.asarray(v)
+
+        self.set_state(np.asarray(y))
+        jacobian = self.evaluate_jacobian()
+
+        Jv[:num_variables] = jacobian.dot(v[:num_variables])
+        sensitivities = v[num_variables:].reshape(num_variables, -1)
+        Jv[num_variables:] = jacobian.dot(sensitivities).ravel()
+        return 0
+
+
+class AdjointFunction(ODEDerivativeFunction):
+    def __init__(self, ode_fun, pool=None, backend=GCC):
+        """
+        Adjoint of the ode in the reversed time s = -t along a trajectory
+        x(t) of the variables
+
+            dl/ds = (df/dx)^T l
+
+        The gradient of a loss by the parameters is the integral of
+        (df/dp)^T l over the time, see gradient_density. The derivatives are
+        taken by all parameters of the ode function.
+
+        :param ode_fun: ODEFunction of the model
+        :param backend: GCC or NUMPY
+        """
+        ODEDerivativeFunction.__init__(self, ode_fun, list(ode_fun._parameters),
+                                       pool=pool, backend=backend)
+        self.trajectory = None
+
+    def set_trajectory(self, trajectory):
+        """
+        :param trajectory: callable returning the variables at a time t
+        """
+        self.trajectory = trajectory
+
+    def __call__(self, s, y, ydot):
+        self.set_state(self.trajectory(-s))
+        ydot[:] = self.evaluate_jacobian().T.dot(np.asarray(y))
+
+    def jacobian(self, s, y, fy, J):
+        """
+        Jacobian (df/dx)^T of the adjoint for the solvers accepting a
+        jacobian function (jacfn of cvode)
+
+        :param J: (variables x variables) array, it is overwritten
+        :return: 0
+        """
+        self.set_state(self.trajectory(-s))
+        J[:] = self.evaluate_jacobian().T.toarray()
+        return 0
+
+    def gradient_density(self, x, adjoint):
+        """
+        :param x: variables
+        :param adjoint: adjoint variables at the same time
+        :return: (df/dp)^T l in the order of the parameters of the function
+        """
+        self.set_state(x)
+        values = self.evaluate_parameter_jacobian()
+        rows, columns = self._parameter_entries
+        return np.bincount(columns, weights=adjoint[rows]*values,
+                           minlength=len(self.sensitivity_parameters))
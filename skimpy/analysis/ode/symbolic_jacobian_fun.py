@@ -25,20 +25,22 @@ limitations under the License.
 
 """
 
-from numpy import array, zeros, double
+from numpy import array, zeros, double, ndarray
 from numpy import append as append_array
 from sympy import symbols
-from sympy import diff
+from sympy import diff, sympify
 
 from scipy.sparse import coo_matrix
 
-from skimpy.utils.compile_sympy import make_cython_function
+from skimpy.utils.compile_sympy import make_function
 from skimpy.utils.general import join_dicts
+from skimpy.utils.namespace import GCC
+from skimpy.utils.profiling import phase
 
 
 class SymbolicJacobianFunction:
 
-    def __init__(self, variables, ode_expressions, parameters, pool=None):
+    def __init__(self, variables, ode_expressions, parameters, pool=None, backend=GCC):
         """
         Constructor for a precompiled function to compute epxressions
         numerically
@@ -46,12 +48,14 @@ class SymbolicJacobianFunction:
         :param expr: dict of sympy expressions for the rate of
                      change of a variable indexed by the variable name
         :param parameters: dict of parameters
+        :param backend: GCC or NUMPY
 
         """
         self.variables = variables
         self.ode_expressions = ode_expressions
         self.parameters = parameters
         self.shape = (len(variables), len(ode_expressions) )
+        self._parameter_ix = None
 
         # Unpacking is needed as ufuncify only take ArrayTypes
         parameters = [x for x in self.parameters]
@@ -77,17 +81,28 @@ class SymbolicJacobianFunction:
         # self.function = theano_function(sym_vars, expressions,
         #                                 on_unused_input='ignore')
 
-        self.function = make_cython_function(sym_vars, expressions, pool=pool, simplify=False)
+        self.function = make_function(sym_vars, expressions, pool=pool, simplify=False,
+                                      backend=backend)
+
+    def link_parameter_index(self, parameter_index):
+        """
+        Precompute the positions of the function parameters in the
+        canonical parameter vector of the model
+        """
+        self._parameter_ix = parameter_index.link(self.parameters)
 
     def __call__(self, fluxes, concentrations, parameters):
         """
         Return a sparse matrix type with elasticity values
         """
-        parameter_values = array([parameters[x.symbol] for x in self.parameters.values()], dtype=double)
+        if isinstance(parameters, ndarray):
+            parameter_values = parameters[self._parameter_ix]
+        else:
+            parameter_values = array([parameters[x.symbol] for x in self.parameters.values()], dtype=double)
 
         input_vars = append_array(concentrations , parameter_values)
 
-        values = array(zeros(len(self.expressions)),dtype=double)
+        values = array(zeros(len(self.rows)),dtype=double)
 
         self.function(input_vars, values)
 
@@ -98,38 +113,47 @@ class SymbolicJacobianFunction:
         return jacobian
 
 
-def make_symbolic_jacobian(variables,ode_expressions, pool=None):
-    # List of Vars and ode_
-
-    if pool is None:
-        expressions = {}
-        for i, var_i in enumerate(variables):
-            for j, var_j in enumerate(variables):
-                derivative = diff(ode_expressions[var_j], var_i)
-                if derivative != 0:
-                    expressions[(i,j)] = derivative
-    else:
+def make_symbolic_jacobian(variables,ode_expressions, pool=None, symbols=None):
+    """
+    Non zero entries (i, j) of the derivatives of the ode expressions j by
+    the variables i
 
-        pickled_variables = [v for v in variables]
-        pickled_ode_expressions = {k:v for k,v in ode_expressions.items()}
-
-        inputs = [(i,var_i,pickled_variables,pickled_ode_expressions)
-                  for i,var_i in enumerate(variables) ]
+    :param symbols: optional symbols to derive by instead of the variables,
+                    e.g. the parameters, the entries are then (i, j) for the
+                    symbol i
+    :return: dict of the derivatives indexed by (i, j)
+    """
+    # List of Vars and ode_
+    variables = list(variables)
+    symbols = variables if symbols is None else list(symbols)
 
-        row_slices = pool.map(make_symbolic_jacobian_row, inputs)
+    # Only derive each expression by the variables it depends on, this way
+    # every expression is sent once to the workers
+    inputs = []
+    for j, var_j in enumerate(variables):
+        this_expression = sympify(ode_expressions[var_j])
+        respective_variables = [(i, var_i) for i, var_i in enumerate(symbols)
+                                if var_i in this_expression.free_symbols]
+        inputs.append((j, this_expression, respective_variables))
 
-        expressions = join_dicts(row_slices)
+    with phase('jacobian derivatives'):
+        if pool is None:
+            column_slices = [make_symbolic_jacobian_column(x) for x in inputs]
+        else:
+            column_slices = pool.map(make_symbolic_jacobian_column, inputs)
 
-    return expressions
+    expressions = join_dicts(column_slices)
 
+    # Keep the row major order
+    return {k: expressions[k] for k in sorted(expressions)}
 
 
-def make_symbolic_jacobian_row(input):
-    i, var_i, variables, ode_expressions = input
-    expressions_row_slice = {}
-    for j, var_j in enumerate(variables):
-        derivative = diff(ode_expressions[var_j], var_i)
+def make_symbolic_jacobian_column(input):
+    j, expression_j, respective_variables = input
+    expressions_column_slice = {}
+    for i, var_i in respective_variables:
+        derivative = diff(expression_j, var_i)
         if derivative != 0:
-            expressions_row_slice[(i, j)] = derivative
+            expressions_column_slice[(i, j)] = derivative
 
-    return expressions_row_slice
+    return expressions_column_slice
@@ -24,7 +24,10 @@ See the License for the specific language governing permissions and
 limitations under the License.
 
 """
-from sympy import simplify
+from copy import copy
+from collections import OrderedDict
+
+from sympy import simplify, sympify, Symbol
 
 from skimpy.analysis.ode.ode_fun import ODEFunction
 from skimpy.analysis.ode.flux_fun import FluxFunction
@@ -32,20 +35,47 @@ from skimpy.analysis.ode.gamma_fun import GammaFunction
 
 from skimpy.utils import iterable_to_tabdict, TabDict
 from skimpy.utils.namespace import *
-from skimpy.utils.general import join_dicts
+from skimpy.utils.general import LRUCache
+from skimpy.utils.compile_sympy import TEMPLATE_ARGUMENT
+from skimpy.utils.profiling import phase
+
+# Rate expressions of the reactions indexed by their signature
+RATE_EXPRESSION_CACHE_SIZE = 2**14
+rate_expression_cache = LRUCache(RATE_EXPRESSION_CACHE_SIZE)
+
+# Rate expressions in placeholder arguments indexed by the signature of
+# the reactions without names
+RATE_TEMPLATE_CACHE_SIZE = 2**10
+rate_template_cache = LRUCache(RATE_TEMPLATE_CACHE_SIZE)
 
+# Symbols of the reaction rates for the templated code generation
+RATE_SYMBOL = '_rate_{}'
 
-def make_ode_fun(kinetic_model, sim_type, pool=None, custom_ode_update=None):
+
+def make_ode_fun(kinetic_model, sim_type, pool=None, custom_ode_update=None,
+                 codegen=INLINED, custom_ode_terms=None):
     """
 
     :param kinetic_model:
     :param sim_type:
+    :param codegen: INLINED or TEMPLATED, the latter evaluates the rates
+                    with one code block per mechanism (QSSA only)
+    :param custom_ode_terms: optional dict of sympy expressions indexed by
+                             variable name, see add_custom_ode_terms
     :return:
     """
-    all_data = get_expressions_from_model(kinetic_model, sim_type)
+    check_codegen(sim_type, codegen)
+
+    with phase('rate expressions'):
+        if codegen == TEMPLATED:
+            # The mass balances are expressed in the rate symbols
+            rates, all_expr, all_parameters = make_rate_templates(kinetic_model)
+        else:
+            all_data = get_expressions_from_model(kinetic_model, sim_type)
 
-    # get expressions for dxdt
-    all_expr, _, all_parameters = list(zip(*all_data))
+            # get expressions for dxdt
+            all_expr, _, all_parameters = list(zip(*all_data))
+            rates = None
 
     # Flatten all the lists
     flatten_list = lambda this_list: [item for sublist in this_list \
@@ -73,13 +103,17 @@ def make_ode_fun(kinetic_model, sim_type, pool=None, custom_ode_update=None):
     else:
         volume_ratios = None
 
-    expr = make_expressions(variables,all_expr, volume_ratios=volume_ratios ,pool=pool)
+    with phase('mass balances'):
+        expr = make_expressions(variables,all_expr, volume_ratios=volume_ratios ,pool=pool)
 
     # Apply constraints. Constraints are modifiers that act on
     # expressions
     for this_constraint in kinetic_model.constraints.values():
         this_constraint(expr)
 
+    with_time = add_custom_ode_terms(expr, custom_ode_terms, variables,
+                                     all_parameters, kinetic_model.parameters)
+
     # NEW: Boundary conditions are now handled as parameters
     # Apply boundary conditions. Boundaries are modifiers that act on
     # expressions
@@ -88,30 +122,76 @@ def make_ode_fun(kinetic_model, sim_type, pool=None, custom_ode_update=None):
 
     # Make vector function from expressions
     ode_fun = ODEFunction(kinetic_model, variables, expr, all_parameters, pool=pool,
-                          custom_ode_update=custom_ode_update)
+                          with_time=with_time,
+                          custom_ode_update=custom_ode_update, rates=rates,
+                          backend=kinetic_model.backend)
 
     return ode_fun, variables
 
 
-def make_expressions(variables, all_flux_expr, volume_ratios=None,pool=None):
+def add_custom_ode_terms(expr, custom_ode_terms, variables, parameters,
+                         model_parameters):
+    """
+    Add custom terms to the mass balances, such that they are compiled into
+    the ode function instead of being evaluated by a python callback. The
+    terms can depend on the variables, the parameters of the model and on
+    the time as the symbol TIME.
+
+    :param expr: dict of the mass balances indexed by the variable symbols
+    :param custom_ode_terms: dict of sympy expressions indexed by the
+                             variable names or None
+    :param variables: TabDict of the variable symbols indexed by name
+    :param parameters: TabDict of the parameters of the ode function, the
+                       parameters of the terms are added
+    :param model_parameters: TabDict of the parameters of the model
+    :return: True if a term depends on the time
+    """
+    if not custom_ode_terms:
+        return False
 
-    if pool is None:
-        expr = dict.fromkeys(variables.values(), 0.0)
+    time_symbol = Symbol(TIME)
+    variable_symbols = set(variables.values())
 
-        for this_reaction in all_flux_expr:
-            for this_variable_key in this_reaction:
-                try:
-                    expr[this_variable_key] += this_reaction[this_variable_key]
-                except KeyError:
-                    pass
+    with_time = False
+    for name, this_term in custom_ode_terms.items():
+        if str(name) not in variables:
+            raise ValueError('Custom term for {} which is not a variable'.format(name))
 
-    else:
+        this_term = sympify(this_term)
+        for this_symbol in this_term.free_symbols:
+            if this_symbol == time_symbol:
+                with_time = True
+            elif this_symbol in variable_symbols:
+                continue
+            elif str(this_symbol) in model_parameters:
+                parameters[str(this_symbol)] = this_symbol
+            else:
+                raise ValueError('Symbol {} of the custom term for {} is neither a '
+                                 'variable nor a parameter'.format(this_symbol, name))
+
+        this_variable = variables[str(name)]
+        expr[this_variable] = expr[this_variable] + this_term
 
-        inputs = [(v,all_flux_expr) for v in variables.values()]
+    return with_time
 
-        list_expressions = pool.map(make_expresson_single_var, inputs)
 
-        expr = join_dicts(list_expressions)
+def make_expressions(variables, all_flux_expr, volume_ratios=None,pool=None):
+
+    # Collect the terms of each variable in a single pass, such that every
+    # term is only sent to the worker summing its variable
+    terms = dict((v, []) for v in variables.values())
+
+    for this_reaction in all_flux_expr:
+        for this_variable_key, this_term in this_reaction.items():
+            try:
+                terms[this_variable_key].append(this_term)
+            except KeyError:
+                pass
+
+    if pool is None:
+        expr = dict(make_expresson_single_var(x) for x in terms.items())
+    else:
+        expr = dict(pool.map(make_expresson_single_var, list(terms.items())))
 
     #Add compartment volumes
     if not volume_ratios is None:
@@ -124,31 +204,37 @@ def make_expressions(variables, all_flux_expr, volume_ratios=None,pool=None):
     return expr
 
 def make_expresson_single_var(input):
-    var, all_flux_expr = input
-
-    this_expr = dict()
-    this_expr[var] = 0.0
-
-    for this_reaction in all_flux_expr:
-        for this_variable_key in this_reaction:
-            if this_variable_key == var:
-                this_expr[this_variable_key] += this_reaction[this_variable_key]
+    var, terms = input
 
-    return this_expr
+    this_expr = 0.0
+    for this_term in terms:
+        this_expr += this_term
 
+    return var, this_expr
 
 
-def make_flux_fun(kinetic_model, sim_type):
+def make_flux_fun(kinetic_model, sim_type, codegen=INLINED):
     """
 
     :param kinetic_model:
     :param sim_type:
+    :param codegen: INLINED or TEMPLATED, the latter evaluates the rates
+                    with one code block per mechanism (QSSA only)
     :return:
     """
-    all_data = get_expressions_from_model(kinetic_model, sim_type)
+    check_codegen(sim_type, codegen)
+
+    with phase('rate expressions'):
+        if codegen == TEMPLATED:
+            # The fluxes are expressed in the rate symbols
+            rates, _, all_parameters = make_rate_templates(kinetic_model)
+            all_expr = [symbol for symbol, _, _ in rates]
+        else:
+            all_data = get_expressions_from_model(kinetic_model, sim_type)
 
-    # Get flux expressions
-    _, all_expr, all_parameters = list(zip(*all_data))
+            # Get flux expressions
+            _, all_expr, all_parameters = list(zip(*all_data))
+            rates = None
 
     reactions = kinetic_model.reactions.keys()
 
@@ -173,7 +259,8 @@ def make_flux_fun(kinetic_model, sim_type):
 
     # Make vector function from expressions in this case all_expressions
     # are all the expressions indexed by the
-    flux_fun = FluxFunction(variables, expr, all_parameters)
+    flux_fun = FluxFunction(variables, expr, all_parameters, rates=rates,
+                            backend=kinetic_model.backend)
     flux_fun._parameter_values = {v:p.value for v,p in kinetic_model.parameters.items()}
 
     return flux_fun
@@ -187,39 +274,12 @@ def get_expressions_from_model(kinetic_model, sim_type,
         all_data = []
         # TODO Modifiers should be applicable for all simulation types
         for this_reaction in kinetic_model.reactions.values():
-            this_reaction.mechanism.get_qssa_rate_expression()
-            # Update rate expressions
-            for this_mod in this_reaction.modifiers.values():
-                this_mod(this_reaction.mechanism.reaction_rates)
-            this_reaction.mechanism.update_qssa_rate_expression()
-
-            # Add modifier expressions
-            for this_mod in this_reaction.modifiers.values():
-                # Get parameters from modifiers
-                for p_type, parameter in this_mod.parameters.items():
-                    mod_sym = parameter.symbol
-                    this_reaction.mechanism.expression_parameters.update([mod_sym])
-
-                for r_type, reactant in this_mod.reactants.items():
-                    # Add massbalances for modfier reactants if as non-zero stoich
-                    if this_mod.reactant_stoichiometry[r_type] == 0:
-                        continue
-
-                    mod_sym = reactant.symbol
-                    flux = this_reaction.mechanism.reaction_rates['v_net']
-                    flux_expression = flux * this_mod.reactant_stoichiometry[r_type]
-                    this_reaction.mechanism.expressions[mod_sym] = flux_expression
-
-                    # Add small molecule parameters if they are
-                    if reactant.type == PARAMETER:
-                        this_reaction.mechanism.expression_parameters.update([mod_sym])
-
-            flux = this_reaction.mechanism.reaction_rates['v_net']
-            dxdt = this_reaction.mechanism.expressions
-            parameters = this_reaction.mechanism.expression_parameters
+            # Only the reactions that changed since the last call are derived
+            dxdt, flux, parameters = get_qssa_rate_expressions(this_reaction)
 
             # For reactor building
             if not medium_symbols is None:
+                dxdt = dict(dxdt)
                 vars_in_medium = [v for v in dxdt if v in medium_symbols]
                 for v in vars_in_medium:
                     dxdt[v] = dxdt[v]*biomass_symbol
@@ -239,12 +299,294 @@ def get_expressions_from_model(kinetic_model, sim_type,
                              this_reaction.mechanism.reaction_rates,
                              this_reaction.mechanism.expression_parameters)
                             )
+
+        # The elementary mechanisms add the enzyme states to their reactants
+        # and redefine the rate constants, so the registries are outdated
+        kinetic_model.update()
     else:
         raise(ValueError('Simulation type not recognized: {}'.format(sim_type)))
 
     return all_data
 
 
+
+def check_codegen(sim_type, codegen):
+    if codegen == TEMPLATED:
+        if sim_type.lower() != QSSA:
+            raise NotImplementedError('Templated code generation is only '
+                                      'implemented for QSSA')
+    elif codegen != INLINED:
+        raise ValueError('Code generation {} is not recognized'.format(codegen))
+
+
+def make_rate_templates(kinetic_model):
+    """
+    Rates of the reactions as QSSA rate templates, the expressions of the
+    individual reactions are not derived. The mass balance terms are
+    expressed in rate symbols, terms that are not the rate times the
+    stoichiometry of the reactant are kept as they are.
+
+    :param kinetic_model: KineticModel
+    :return: tuple of the list of rates (rate symbol, template, arguments),
+             the list of mass balance terms and the list of expression
+             parameters per reaction
+    """
+    rates = []
+    all_expr = []
+    all_parameters = []
+
+    # Whether a template term factors into stoichiometry and rate
+    factors = dict()
+
+    for this_reaction in kinetic_model.reactions.values():
+        template, arguments = get_qssa_rate_template(this_reaction)
+        expressions, reaction_rates, expression_parameters = template
+
+        substitutions = {Symbol(TEMPLATE_ARGUMENT.format(i)): x
+                         for i, x in enumerate(arguments)}
+
+        flux = reaction_rates['v_net']
+        rate_symbol = Symbol(RATE_SYMBOL.format(len(rates)))
+        rates.append((rate_symbol, flux, arguments))
+
+        stoichiometry = get_reaction_stoichiometry(this_reaction)
+
+        rate_terms = dict()
+        for k, this_term in expressions.items():
+            this_variable = substitutions.get(k, k)
+            coefficient = stoichiometry.get(this_variable)
+
+            key = (this_term, flux, coefficient)
+            if key not in factors:
+                factors[key] = coefficient is not None \
+                               and coefficient*flux == this_term
+
+            if factors[key]:
+                rate_terms[this_variable] = coefficient*rate_symbol
+            else:
+                rate_terms[this_variable] = sympify(this_term).xreplace(substitutions)
+
+        all_expr.append(rate_terms)
+        all_parameters.append([substitutions.get(x, x) for x in expression_parameters])
+
+    return rates, all_expr, all_parameters
+
+
+def get_reaction_stoichiometry(reaction):
+    """
+    Stoichiometry of the reactants of a reaction and its modifiers as used
+    in the mass balances of the mechanism
+
+    :param reaction: Reaction
+    :return: dict of stoichiometric coefficients indexed by reactant symbol
+    """
+    mechanism = reaction.mechanism
+    stoichiometry = dict()
+    for k, v in mechanism.reactant_stoichiometry.items():
+        if k in mechanism.reactants:
+            this_symbol = mechanism.reactants[k].symbol
+            stoichiometry[this_symbol] = stoichiometry.get(this_symbol, 0) + v
+
+    for this_modifier in reaction.modifiers.values():
+        for k, v in this_modifier.reactant_stoichiometry.items():
+            if v != 0:
+                stoichiometry[this_modifier.reactants[k].symbol] = v
+
+    return stoichiometry
+
+
+def get_reaction_signature(reaction, symbols=None):
+    """
+    Hashable description of everything the rate expressions of a reaction
+    depend on: the mechanism, the reactant and parameter bindings and the
+    modifiers. A reaction whose signature did not change since the last
+    compilation does not need to be derived again, in this or any other
+    model.
+
+    :param reaction: Reaction
+    :param symbols: optional dict, if given the bound symbols are replaced
+                    by their position in it and added on their first
+                    occurrence. The signature is then shared by all the
+                    reactions that only differ by the names of their symbols.
+    :return: tuple
+    """
+    mechanism = reaction.mechanism
+
+    if symbols is None:
+        name = lambda x: str(x)
+    else:
+        name = lambda x: symbols.setdefault(x, len(symbols))
+
+    bind = lambda items: tuple((k, name(v.symbol), v.type)
+                               for k, v in items.items())
+
+    reactants = bind(mechanism.reactants)
+    parameters = bind(mechanism.parameters) \
+        if mechanism.parameters is not None else None
+    inhibitors = bind(mechanism.inhibitors) \
+        if mechanism.inhibitors is not None else None
+
+    modifiers = tuple((k,
+                       m.__class__,
+                       bind(m.reactants),
+                       tuple(sorted(m.reactant_stoichiometry.items())),
+                       bind(m.parameters))
+                      for k, m in reaction.modifiers.items())
+
+    return (mechanism.__class__,
+            reactants,
+            parameters,
+            inhibitors,
+            modifiers)
+
+
+def get_qssa_rate_expressions(reaction):
+    """
+    QSSA rate expressions of a reaction, derived only if no reaction with the
+    same signature was derived before. The mechanism attributes are restored
+    from the cache otherwise.
+
+    :param reaction: Reaction
+    :return: tuple of the mass balance expressions, the reaction rates and
+             the expression parameters
+    """
+    mechanism = reaction.mechanism
+    signature = get_reaction_signature(reaction)
+
+    cached_data = rate_expression_cache.lookup(signature)
+
+    if cached_data is None:
+        make_qssa_rate_expressions(reaction)
+        cached_data = (mechanism.expressions,
+                       mechanism.reaction_rates,
+                       mechanism.expression_parameters)
+        rate_expression_cache.store(signature, [copy(x) for x in cached_data])
+    else:
+        mechanism.expressions, \
+        mechanism.reaction_rates, \
+        mechanism.expression_parameters = [copy(x) for x in cached_data]
+
+    return mechanism.expressions, \
+           mechanism.reaction_rates['v_net'], \
+           mechanism.expression_parameters
+
+
+def get_qssa_rate_template(reaction):
+    """
+    QSSA rate expressions of a reaction with the bound symbols replaced by
+    placeholder arguments. The template is shared by all reactions with the
+    same mechanism and modifiers whose bindings only differ by names, thus it
+    is derived once per mechanism.
+
+    :param reaction: Reaction
+    :return: tuple of the template (mass balance expressions, reaction rates
+             and expression parameters) and the list of symbols bound to the
+             placeholder arguments
+    """
+    symbols = OrderedDict()
+    signature = get_reaction_signature(reaction, symbols)
+    symbols = list(symbols)
+
+    # Templates of expressions containing unbound symbols are only valid
+    # for the same names
+    named_signature = (signature, tuple(str(x) for x in symbols))
+
+    cached_data = rate_template_cache.lookup(signature)
+    if cached_data is None:
+        cached_data = rate_template_cache.lookup(named_signature)
+
+    if cached_data is None:
+        mechanism = reaction.mechanism
+        get_qssa_rate_expressions(reaction)
+        data = (mechanism.expressions,
+                mechanism.reaction_rates,
+                mechanism.expression_parameters)
+
+        unbound = sorted(get_rate_expression_symbols(data).difference(symbols), key=str)
+        arguments = [Symbol(TEMPLATE_ARGUMENT.format(i))
+                     for i in range(len(symbols) + len(unbound))]
+        template = substitute_rate_expressions(data, dict(zip(symbols + unbound, arguments)))
+
+        cached_data = (template, unbound)
+        if unbound:
+            rate_template_cache.store(named_signature, cached_data)
+        else:
+            rate_template_cache.store(signature, cached_data)
+
+    template, unbound = cached_data
+
+    return template, symbols + unbound
+
+
+def substitute_rate_expressions(data, substitutions):
+    """
+    Substitute the symbols in the rate expressions of a mechanism
+
+    :param data: tuple of the mass balance expressions, the reaction rates
+                 and the expression parameters
+    :param substitutions: dict of symbols
+    :return: tuple of substituted copies
+    """
+    expressions, reaction_rates, expression_parameters = data
+
+    expressions = expressions.__class__(
+        (substitutions.get(k, k), sympify(v).xreplace(substitutions))
+        for k, v in expressions.items())
+    reaction_rates = reaction_rates.__class__(
+        (k, sympify(v).xreplace(substitutions))
+        for k, v in reaction_rates.items())
+    expression_parameters = set(substitutions.get(x, x)
+                                for x in expression_parameters)
+
+    return expressions, reaction_rates, expression_parameters
+
+
+def get_rate_expression_symbols(data):
+    expressions, reaction_rates, expression_parameters = data
+
+    all_symbols = set(expressions.keys()).union(expression_parameters)
+    for this_expression in list(expressions.values()) + list(reaction_rates.values()):
+        all_symbols.update(sympify(this_expression).free_symbols)
+
+    return all_symbols
+
+
+def make_qssa_rate_expressions(reaction):
+    """
+    Derive the QSSA rate expressions of a reaction and apply its modifiers,
+    the results are stored in the mechanism
+
+    :param reaction: Reaction
+    :return:
+    """
+    reaction.mechanism.get_qssa_rate_expression()
+    # Update rate expressions
+    for this_mod in reaction.modifiers.values():
+        this_mod(reaction.mechanism.reaction_rates)
+    reaction.mechanism.update_qssa_rate_expression()
+
+    # Add modifier expressions
+    for this_mod in reaction.modifiers.values():
+        # Get parameters from modifiers
+        for p_type, parameter in this_mod.parameters.items():
+            mod_sym = parameter.symbol
+            reaction.mechanism.expression_parameters.update([mod_sym])
+
+        for r_type, reactant in this_mod.reactants.items():
+            # Add massbalances for modfier reactants if as non-zero stoich
+            if this_mod.reactant_stoichiometry[r_type] == 0:
+                continue
+
+            mod_sym = reactant.symbol
+            flux = reaction.mechanism.reaction_rates['v_net']
+            flux_expression = flux * this_mod.reactant_stoichiometry[r_type]
+            reaction.mechanism.expressions[mod_sym] = flux_expression
+
+            # Add small molecule parameters if they are
+            if reactant.type == PARAMETER:
+                reaction.mechanism.expression_parameters.update([mod_sym])
+
+
 def make_gamma_fun(kinetic_model):
     """
     Return a function that calculates the thermodynamic displacement for
@@ -292,7 +634,8 @@ def make_gamma_fun(kinetic_model):
 
     # Make vector function from expressions in this case all_expressions
     # are all the expressions indexed by the
-    gamma_fun = GammaFunction(variables, expr, all_parameters)
+    gamma_fun = GammaFunction(variables, expr, all_parameters,
+                              backend=kinetic_model.backend)
     gamma_fun._parameter_values = {v:p.value for v,p in kinetic_model.parameters.items()}
 
     return gamma_fun
\ No newline at end of file
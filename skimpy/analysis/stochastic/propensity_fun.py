@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import numpy as np
+from sympy import symbols, sympify
+
+from skimpy.analysis.ode.utils import get_qssa_rate_expressions
+from skimpy.utils.compile_sympy import make_function
+from skimpy.utils.general import get_stoichiometry
+from skimpy.utils.namespace import GCC
+from skimpy.utils.tabdict import TabDict
+
+
+class PropensityFunction:
+    def __init__(self, variables, channels, stoichiometry, parameters,
+                 pool=None, backend=GCC):
+        """
+        Compiled propensities of the channels of a stochastic simulation.
+        The propensities are evaluated for many states at once in one
+        batched call of the kernel.
+
+        :param variables: TabDict of the variable symbols indexed by name
+        :param channels: TabDict of the rate expressions of the channels
+                         indexed by the channel name
+        :param stoichiometry: (channels x variables) array of the changes of
+                              the copy numbers when a channel fires
+        :param parameters: TabDict of the parameter symbols indexed by name
+        :param backend: GCC or NUMPY
+        """
+        self.variables = variables
+        self.channels = list(channels)
+        self.expressions = channels
+        self.stoichiometry = np.asarray(stoichiometry, dtype=np.float64)
+        self.parameters = parameters
+        self._parameter_ix = None
+
+        sym_vars = list(symbols(list(variables) + list(parameters)))
+        self.function = make_function(sym_vars, channels.values(), simplify=True,
+                                      pool=pool, backend=backend)
+
+    def link_parameter_index(self, parameter_index):
+        """
+        Precompute the positions of the function parameters in the
+        canonical parameter vector of the model
+        """
+        self._parameter_ix = parameter_index.link(self.parameters)
+
+    def make_inputs(self, num_samples, parameters):
+        """
+        :param num_samples: number of states evaluated at once
+        :param parameters: parameter vector in canonical order
+        :return: (samples x inputs) buffer holding the parameter values
+        """
+        num_variables = len(self.variables)
+        inputs = np.empty((num_samples, num_variables + len(self.parameters)))
+        inputs[:, num_variables:] = parameters[self._parameter_ix]
+        return inputs
+
+    def batch(self, inputs, counts, volume):
+        """
+        Propensities of the channels for each row of the copy numbers, the
+        rates are evaluated at the concentrations counts/volume
+
+        :param inputs: buffer of make_inputs with at least as many rows as
+                       the counts
+        :param counts: (samples x variables) array of the copy numbers
+        :param volume: system size converting copy numbers to concentrations
+        :return: (samples x channels) array of the propensities
+        """
+        inputs = inputs[:len(counts)]
+        inputs[:, :len(self.variables)] = counts/volume
+
+        propensities = np.empty((len(counts), len(self.channels)))
+        self.function.batch(inputs, propensities)
+
+        # Rate laws can turn negative at zero copy numbers
+        np.maximum(propensities*volume, 0.0, out=propensities)
+        return propensities
+
+
+def make_propensity_fun(kinetic_model, pool=None):
+    """
+    Propensity function of a model for stochastic simulations. Each
+    reaction gives a forward and, if its backward rate is not zero, a
+    backward channel with the QSSA rates v_fwd and v_bwd of the mechanism.
+    The stoichiometry is the one of the mass balances (see get_stoichiometry).
+
+    :param kinetic_model: KineticModel
+    :return: PropensityFunction
+    """
+    if kinetic_model.compartments:
+        raise NotImplementedError('Stochastic simulations of models with '
+                                  'compartments are not supported')
+
+    variables = TabDict([(k, v.symbol) for k, v in kinetic_model.reactants.items()])
+    stoichiometry = get_stoichiometry(kinetic_model, variables).toarray()
+
+    if not np.all(np.mod(stoichiometry, 1) == 0):
+        raise ValueError('Stochastic simulations need integer stoichiometries')
+
+    channels = TabDict([])
+    channel_stoichiometry = []
+    for i, this_reaction in enumerate(kinetic_model.reactions.values()):
+        get_qssa_rate_expressions(this_reaction)
+        reaction_rates = this_reaction.mechanism.reaction_rates
+
+        for direction, rate, sign in [('forward', 'v_fwd', 1), ('backward', 'v_bwd', -1)]:
+            expression = sympify(reaction_rates[rate])
+            if expression.is_zero:
+                continue
+            channels['{}_{}'.format(this_reaction.name, direction)] = expression
+            channel_stoichiometry.append(sign*stoichiometry[:, i])
+
+    # Sorted such that the code is cached
+    variable_symbols = set(variables.values())
+    parameters = set().union(*[e.free_symbols for e in channels.values()]) - variable_symbols
+    parameters = TabDict([(str(p), p) for p in sorted(parameters, key=str)])
+
+    return PropensityFunction(variables, channels, np.array(channel_stoichiometry),
+                              parameters, pool=pool, backend=kinetic_model.backend)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from functools import partial
+
+import numpy as np
+
+from skimpy.core.solution import StochasticSolution
+from skimpy.utils.namespace import SSA, TAU_LEAPING
+
+
+def simulate_stochastic(propensity_fun, parameters, initial_counts, time_out,
+                        num_realizations, method=SSA, volume=1.0, seed=None,
+                        pool=None, chunk_size=256, **kwargs):
+    """
+    Simulate independent realizations of a stochastic model. The
+    realizations are split in chunks, each chunk is simulated with its own
+    random number stream spawned from the seed, thus the realizations do not
+    depend on the number of workers. Within a chunk all realizations advance
+    together and the propensities are evaluated in one batched call per step.
+
+    :param propensity_fun: PropensityFunction linked to a parameter index
+    :param parameters: parameter vector in canonical order
+    :param initial_counts: initial copy numbers of the variables
+    :param time_out: times at which the copy numbers are recorded
+    :param num_realizations: number of realizations
+    :param method: SSA (Gillespie direct method) or TAU_LEAPING
+    :param volume: system size converting copy numbers to concentrations
+    :param seed: seed of the random number streams
+    :param pool: optional executor simulating the chunks
+    :param chunk_size: number of realizations per chunk
+    :param kwargs: options of the method, see run_ssa and run_tau_leaping
+    :return: StochasticSolution of the concentrations
+    """
+    if method not in (SSA, TAU_LEAPING):
+        raise ValueError('Stochastic simulation method {} is not recognized'
+                         .format(method))
+
+    num_chunks = int(np.ceil(num_realizations/chunk_size))
+    sizes = np.diff(np.linspace(0, num_realizations, num_chunks + 1).astype(int))
+    seeds = np.random.SeedSequence(seed).spawn(num_chunks)
+
+    time_out = np.asarray(time_out, dtype=np.float64)
+    simulate = partial(simulate_chunk, propensity_fun, method, parameters,
+                       np.asarray(initial_counts, dtype=np.float64), time_out,
+                       volume, kwargs)
+    tasks = list(zip(sizes, seeds))
+    results = pool.map(simulate, tasks) if pool is not None else list(map(simulate, tasks))
+
+    species = np.concatenate(results)/volume
+    return StochasticSolution(time_out, list(propensity_fun.variables), species,
+                              method=method)
+
+
+def simulate_chunk(propensity_fun, method, parameters, initial_counts, time_out,
+                   volume, options, task):
+    """
+    :param task: tuple of the number of realizations and the SeedSequence
+    :return: (realizations x time x variables) array of the copy numbers
+    """
+    num_realizations, seed = task
+    rng = np.random.default_rng(seed)
+
+    run = run_ssa if method == SSA else run_tau_leaping
+    return run(propensity_fun, parameters, initial_counts, time_out, volume,
+               num_realizations, rng, **options)
+
+
+def run_ssa(propensity_fun, parameters, initial_counts, time_out, volume,
+            num_realizations, rng, max_steps=10**7):
+    """
+    Gillespie direct method, every step fires one channel in each running
+    realization
+
+    :param max_steps: maximum number of steps
+    :return: (realizations x time x variables) array of the copy numbers
+    """
+    num_time = len(time_out)
+    stoichiometry = propensity_fun.stoichiometry
+
+    counts = np.tile(initial_counts, (num_realizations, 1))
+    time = np.full(num_realizations, time_out[0])
+    trajectories = np.empty((num_realizations, num_time, len(initial_counts)))
+    next_output = np.zeros(num_realizations, dtype=int)
+    inputs = propensity_fun.make_inputs(num_realizations, parameters)
+
+    active = np.arange(num_realizations)
+    for _ in range(max_steps):
+        if not len(active):
+            return trajectories
+
+        these_counts = counts[active]
+        propensities = propensity_fun.batch(inputs, these_counts, volume)
+        total = propensities.sum(axis=1)
+
+        # Realizations without propensity keep their state
+        with np.errstate(divide='ignore'):
+            next_time = time[active] + rng.exponential(1.0, len(active))/total
+
+        # The state holds until the next event
+        last_output = np.searchsorted(time_out, next_time, side='left')
+        record_outputs(trajectories, active, next_output[active], last_output, these_counts)
+        next_output[active] = last_output
+
+        running = last_output < num_time
+        active = active[running]
+        these_counts = these_counts[running]
+        propensities = propensities[running]
+
+        threshold = rng.random(len(active))*total[running]
+        channels = (np.cumsum(propensities, axis=1) < threshold[:, np.newaxis]).sum(axis=1)
+        channels = np.minimum(channels, len(stoichiometry) - 1)
+
+        counts[active] = these_counts + stoichiometry[channels]
+        time[active] = next_time[running]
+
+    raise RuntimeError('The stochastic simulation exceeded {} steps'.format(max_steps))
+
+
+def run_tau_leaping(propensity_fun, parameters, initial_counts, time_out, volume,
+                    num_realizations, rng, epsilon=0.03, max_steps=10**7):
+    """
+    Tau-leaping with the step selection of Cao et al. 2006, such that the
+    expected change of the propensities within a leap is bounded by epsilon.
+    The leaps end at the output times, leaps to negative copy numbers are
+    rejected and repeated with half the step.
+
+    :param epsilon: bound of the relative change of the copy numbers
+    :param max_steps: maximum number of steps
+    :return: (realizations x time x variables) array of the copy numbers
+    """
+    num_time = len(time_out)
+    stoichiometry = propensity_fun.stoichiometry
+
+    counts = np.tile(initial_counts, (num_realizations, 1))
+    time = np.full(num_realizations, time_out[0])
+    trajectories = np.empty((num_realizations, num_time, len(initial_counts)))
+    trajectories[:, 0] = counts
+    next_output = np.ones(num_realizations, dtype=int)
+    step_scale = np.ones(num_realizations)
+    inputs = propensity_fun.make_inputs(num_realizations, parameters)
+
+    active = np.arange(num_realizations) if num_time > 1 else np.arange(0)
+    for _ in range(max_steps):
+        if not len(active):
+            return trajectories
+
+        these_counts = counts[active]
+        propensities = propensity_fun.batch(inputs, these_counts, volume)
+
+        # Mean and variance of the change of the copy numbers per time
+        mean = propensities.dot(stoichiometry)
+        variance = propensities.dot(stoichiometry**2)
+        bound = np.maximum(epsilon*these_counts, 1.0)
+        with np.errstate(divide='ignore'):
+            tau = np.minimum(bound/np.abs(mean), bound**2/variance).min(axis=1)
+        tau *= step_scale[active]
+
+        to_output = time_out[next_output[active]] - time[active]
+        tau = np.minimum(tau, to_output)
+
+        firings = rng.poisson(propensities*tau[:, np.newaxis])
+        new_counts = these_counts + firings.dot(stoichiometry)
+
+        accepted = (new_counts >= 0).all(axis=1)
+        step_scale[active] = np.where(accepted, 1.0, 0.5*step_scale[active])
+
+        rows = active[accepted]
+        counts[rows] = new_counts[accepted]
+        time[rows] += tau[accepted]
+
+        # Leaps reaching an output time end exactly on it
+        outputs = rows[tau[accepted] >= to_output[accepted]]
+        trajectories[outputs, next_output[outputs]] = counts[outputs]
+        time[outputs] = time_out[next_output[outputs]]
+        next_output[outputs] += 1
+
+        active = active[next_output[active] < num_time]
+
+    raise RuntimeError('The stochastic simulation exceeded {} steps'.format(max_steps))
+
+
+def record_outputs(trajectories, rows, first, last, states):
+    """
+    Write the states of the rows to their output times first to last - 1
+    """
+    num_outputs = last - first
+    recorded = num_outputs > 0
+    if not recorded.any():
+        return
+
+    rows, first, num_outputs, states = rows[recorded], first[recorded], \
+                                       num_outputs[recorded], states[recorded]
+
+    repeated = np.repeat(np.arange(len(rows)), num_outputs)
+    offsets = np.arange(num_outputs.sum()) \
+              - np.repeat(np.cumsum(num_outputs) - num_outputs, num_outputs)
+    trajectories[rows[repeated], first[repeated] + offsets] = states[repeated]
@@ -102,6 +102,21 @@ class Item(object):
         return repr
 
 
+def add_prefix(items, prefix):
+    """
+    Prefix the names and the symbols of items in one pass, the symbols are
+    derived from the current symbols instead of being formatted again from
+    the name and the suffix
+
+    :param items: iterable of Items
+    :param prefix: string prepended to the names
+    :return:
+    """
+    for the_item in items:
+        the_item.name = prefix + the_item.name
+        the_item._symbol = Symbol(prefix + the_item._symbol.name)
+
+
 class ItemSet(ABC, TabDict):
     def __init__(self, mechanism):
 
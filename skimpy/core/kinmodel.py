@@ -25,22 +25,78 @@ limitations under the License.
 
 """
 
+import time
+from weakref import WeakSet
+
+import numpy as np
+import pandas as pd
+from sympy import Basic
+from scipy.interpolate import CubicHermiteSpline
 from scikits.odes import ode
 from skimpy.analysis.ode.utils import make_ode_fun
 from skimpy.analysis.ode.utils import make_gamma_fun
+from skimpy.analysis.ode.utils import rate_expression_cache, rate_template_cache
 from skimpy.analysis.ode.symbolic_jacobian_fun import SymbolicJacobianFunction
+from skimpy.analysis.ode.sensitivity_fun import SensitivityFunction, AdjointFunction
+from skimpy.analysis.stochastic import make_propensity_fun, simulate_stochastic
 
-from skimpy.analysis.mca.make import make_mca_functions
+from skimpy.analysis.mca.make import make_mca_functions, elasticity_cache
 from skimpy.analysis.mca.prepare import prepare_mca
 from skimpy.analysis.mca import *
 from skimpy.analysis.mca.volume_ratio_function import VolumeRatioFunction
 from ..utils.logger import get_bistream_logger
 from .solution import ODESolution
+from .parameters import update_parameter_index
 
-from ..utils import TabDict, iterable_to_tabdict
+from ..utils import TabDict, iterable_to_tabdict, ObservedTabDict, ReadOnlyTabDict, \
+    get_structure_version
 from ..utils.namespace import *
 
-from multiprocessing import Pool
+from ..utils.compile_sympy import code_cache
+from ..utils.executor import Executor, make_executor
+from ..utils.profiling import profiled, EvaluationStatistics, SolverStatistics
+
+
+# Compiled functions of the model
+COMPILED_FUNCTIONS = ['ode_fun',
+                      'flux_fun',
+                      'independent_elasticity_fun',
+                      'dependent_elasticity_fun',
+                      'parameter_elasticities_fun',
+                      'displacement_function',
+                      'jacobian_fun',
+                      ]
+
+# Symbolic attributes of the compiled functions, they are not needed to
+# evaluate the functions
+SYMBOLIC_ATTRIBUTES = ['rates', 'rate_expressions', 'expressions', 'expr',
+                       'ode_expressions']
+
+# Symbolic attributes of the mechanisms built during the compilation
+MECHANISM_SYMBOLIC_ATTRIBUTES = ['expressions', 'reaction_rates', 'expression_parameters']
+
+# Caches of the expressions shared by all the models
+EXPRESSION_CACHES = [code_cache, rate_expression_cache, rate_template_cache,
+                     elasticity_cache]
+
+
+def get_key_names(key):
+    """
+    Names of the symbols a cache key refers to, the keys are expressions or
+    nested tuples of expressions and symbol names
+
+    :param key: cache key
+    :return: set of names
+    """
+    if isinstance(key, Basic):
+        return {str(x) for x in key.free_symbols}
+    elif isinstance(key, str):
+        return {key}
+    elif isinstance(key, tuple):
+        return set().union(*[get_key_names(x) for x in key])
+    else:
+        return set()
+
 
 class KineticModel(object):
     """
@@ -57,40 +113,79 @@ class KineticModel(object):
                  constraints=None,
                  name='Unnamed'):
         self.name = name
-        self.reactions = iterable_to_tabdict(reactions)
-        self.boundary_conditions = iterable_to_tabdict(boundary_conditions)
+        self.reactions = ObservedTabDict(iterable_to_tabdict(reactions))
+        self.boundary_conditions = ObservedTabDict(iterable_to_tabdict(boundary_conditions))
         self.constraints = iterable_to_tabdict(constraints)
         self.initial_conditions = iterable_to_tabdict([])
         self.logger = get_bistream_logger(name)
         self._simtype = None
         self._modified = True
         self._recompiled = False
+        self._frozen = False
+        # Backend of the compiled functions
+        self._backend = GCC
         # Add using add compartments!
-        self.compartments = iterable_to_tabdict([])
+        self.compartments = ObservedTabDict([])
+
+        # Registries for the reactants and parameters properties with the
+        # structure version they were built at
+        self._reactant_registry = None
+        self._parameter_registry = None
+        self._reactant_version = None
+        self._parameter_version = None
+
+        # Version of the structure of this model alone, it is only checked
+        # against the signature of the model when the global version changes
+        self._structure_version = 0
+        self._structure_signature = None
+        self._structure_checked = None
+
+        # Canonical parameter ordering shared by the compiled functions
+        self.parameter_index = None
+        # Functions linked to the index, they are linked again if it changes
+        self._linked_functions = WeakSet()
+
+        # Executor for the code generation, created on first use
+        self._executor = None
+
+        # Report of the phases of the last preparation or compilation
+        self.compile_report = None
 
         #self.parameters = TabDict()
 
     @property
     def reactants(self):
-        reactants = TabDict([])
-        for this_reaction in self.reactions.values():
-            this_rectants = TabDict([(v.name,v) for v in this_reaction.reactants.values()])
-            reactants.update(this_rectants)
-        return reactants
+        # The registry is extended by add_reaction and rebuilt lazily after
+        # any change of the reactions, modifiers or compartments
+        version = get_structure_version()
+        if self._reactant_registry is None or self._reactant_version != version:
+            reactants = TabDict([])
+            for this_reaction in self.reactions.values():
+                reactants.update(self._get_reaction_reactants(this_reaction))
+            self._reactant_registry = ReadOnlyTabDict(reactants)
+            self._reactant_version = version
+
+        return self._reactant_registry
 
     @property
     def parameters(self):
-        parameters = TabDict([])
-        for this_reaction in self.reactions.values():
-            reaction_params = TabDict({str(p.symbol): p for p in this_reaction.parameters.values()})
-            parameters.update(reaction_params)
+        # The registry is extended by add_reaction and add_compartment and
+        # rebuilt lazily after any change of the reactions, modifiers or
+        # compartments
+        version = get_structure_version()
+        if self._parameter_registry is None or self._parameter_version != version:
+            parameters = TabDict([])
+            for this_reaction in self.reactions.values():
+                parameters.update(self._get_item_parameters(this_reaction))
+
+            # Compartment parameters
+            for this_comp in self.compartments.values():
+                parameters.update(self._get_item_parameters(this_comp))
 
-        # Compartment parameters
-        for this_comp in self.compartments.values():
-            comp_params = TabDict({str(p.symbol): p for p in this_comp.parameters.values()})
-            parameters.update(comp_params)
+            self._parameter_registry = ReadOnlyTabDict(parameters)
+            self._parameter_version = version
 
-        return parameters
+        return self._parameter_registry
 
     @parameters.setter
     def parameters(self,value_dict):
@@ -99,15 +194,7 @@ class KineticModel(object):
         :param value_dict:
         :return: Nothing
         """
-        parameters = TabDict([])
-        for this_reaction in self.reactions.values():
-            reaction_params = TabDict({str(p.symbol): p for p in this_reaction.parameters.values()})
-            parameters.update(reaction_params)
-
-        # Compartment parameters
-        for this_comp in self.compartments.values():
-            comp_params = TabDict({str(p.symbol): p for p in this_comp.parameters.values()})
-            parameters.update(comp_params)
+        parameters = self.parameters
 
         for key,value in value_dict.items():
             if str(key) in parameters:
@@ -116,6 +203,190 @@ class KineticModel(object):
             # else:
             #     self.logger
 
+    @property
+    def structure_version(self):
+        """
+        Version of the structure of this model, it only increases when the
+        reactions, modifiers, compartments or boundary conditions of this
+        model change and not with changes of other models
+        """
+        version = get_structure_version()
+        if self._structure_checked != version:
+            signature = self._get_structure_signature()
+            if signature != self._structure_signature:
+                self._structure_signature = signature
+                self._structure_version += 1
+            self._structure_checked = version
+
+        return self._structure_version
+
+    def _get_structure_signature(self):
+        reactions = tuple((k, id(r), id(r.mechanism),
+                           id(r.mechanism.reactants),
+                           id(r.mechanism.parameters),
+                           tuple((m, id(v)) for m, v in r.modifiers.items()))
+                          for k, r in self.reactions.items())
+        compartments = tuple((k, id(v)) for k, v in self.compartments.items())
+        boundary_conditions = tuple((k, id(v)) for k, v
+                                    in self.boundary_conditions.items())
+        constraints = tuple((k, id(v)) for k, v in self.constraints.items())
+        return reactions, compartments, boundary_conditions, constraints
+
+    @staticmethod
+    def _get_reaction_reactants(reaction):
+        return TabDict([(v.name,v) for v in reaction.reactants.values()])
+
+    @staticmethod
+    def _get_item_parameters(item):
+        return TabDict({str(p.symbol): p for p in item.parameters.values()})
+
+    def link_parameter_index(self, *functions):
+        """
+        Define the canonical parameter ordering from the current parameters
+        and precompute the index map of each function into it. The index is
+        kept if the parameters did not change, otherwise all the functions
+        linked before are linked to the new index, see update_parameter_index.
+
+        :param functions: compiled functions with a link_parameter_index method
+        :return:
+        """
+        self.parameter_index = update_parameter_index(self.parameter_index,
+                                                      list(self.parameters.keys()),
+                                                      functions,
+                                                      self._linked_functions,
+                                                      logger=self.logger)
+
+    def get_parameter_vector(self, parameter_values=None, allow_missing=False):
+        """
+        Dense float64 vector of parameter values in the canonical ordering
+        of the compiled functions
+
+        :param parameter_values: ParameterValues, pd.Series or dict indexed
+                                 by str or Symbol, if None the current values
+                                 of the model parameters are used
+        :param allow_missing: set the missing parameters to nan instead of
+                              raising a KeyError
+        :return: np.array of float64
+        """
+        if self.parameter_index is None:
+            self.link_parameter_index()
+
+        if parameter_values is None:
+            parameter_values = {k: p.value for k, p in self.parameters.items()}
+
+        return self.parameter_index.to_vector(parameter_values,
+                                              allow_missing=allow_missing)
+
+    def get_parameter_array(self, parameter_population, allow_missing=False):
+        """
+        Dense (samples x parameters) float64 array of a parameter population
+        in the canonical ordering of the compiled functions
+
+        :param parameter_population: ParameterValuePopulation, pd.DataFrame or
+                                     list of parameter sets
+        :param allow_missing: set the missing parameters to nan instead of
+                              raising a KeyError
+        :return: np.array of float64
+        """
+        if self.parameter_index is None:
+            self.link_parameter_index()
+
+        return self.parameter_index.to_array(parameter_population,
+                                             allow_missing=allow_missing)
+
+    @property
+    def pool(self):
+        return self.get_executor()
+
+    @pool.setter
+    def pool(self, value):
+        self._executor = value
+
+    def get_executor(self, ncpu=None, executor=None):
+        """
+        Executor used to parallelize the code generation
+
+        :param ncpu: number of workers, if None the current setting is kept
+        :param executor: replace the executor by an Executor, a
+                         multiprocessing.Pool or one of 'serial', 'thread'
+                         and 'process'
+        :return: executor
+        """
+        if executor is not None:
+            self._executor = make_executor(executor, ncpu)
+        elif self._executor is None:
+            self._executor = make_executor(ncpu=ncpu)
+        elif ncpu is not None and isinstance(self._executor, Executor):
+            self._executor.ncpu = ncpu
+
+        return self._executor
+
+    def close(self):
+        """
+        Shut down the workers of the executor
+
+        :return:
+        """
+        if self._executor is not None:
+            self._executor.close()
+
+    def freeze(self, clear_caches=True):
+        """
+        Release the symbolic expressions of the model and its compiled
+        functions. Only the compiled kernels, the index metadata and the
+        numeric matrices are kept, thus a frozen model can be simulated and
+        analysed but not modified, recompiled or sampled.
+
+        :param clear_caches: also drop the entries of the shared expression
+                             caches that refer to the reactants or parameters
+                             of this model, the entries of other models with
+                             the same names are dropped as well
+        :return:
+        """
+        for name in COMPILED_FUNCTIONS:
+            function = getattr(self, name, None)
+            for attribute in SYMBOLIC_ATTRIBUTES:
+                if hasattr(function, attribute):
+                    setattr(function, attribute, None)
+
+        for this_reaction in self.reactions.values():
+            for attribute in MECHANISM_SYMBOLIC_ATTRIBUTES:
+                if hasattr(this_reaction.mechanism, attribute):
+                    setattr(this_reaction.mechanism, attribute, None)
+
+        if clear_caches:
+            names = set(self.reactants).union(self.parameters)
+            references_model = lambda key: not names.isdisjoint(get_key_names(key))
+            for cache in EXPRESSION_CACHES:
+                cache.evict(references_model)
+
+        self._frozen = True
+
+    def check_frozen(self, action):
+        """
+        Raise an error if the model is frozen
+
+        :param action: description of the action requiring the symbolic
+                       expressions
+        :return:
+        """
+        if self._frozen:
+            raise RuntimeError("The model {} is frozen, {} requires the symbolic "
+                               "expressions released by freeze"
+                               .format(self.name, action))
+
+    def update(self):
+        """
+        Discard the reactant and parameter registries, they are rebuilt on
+        the next access. Changes of the reactions, modifiers and compartments
+        are tracked, this is only needed when the reactants or parameters of
+        an item are edited in place.
+
+        :return:
+        """
+        self._reactant_registry = None
+        self._parameter_registry = None
+
     @property
     def moieties(self):
         ms = []
@@ -172,16 +443,41 @@ class KineticModel(object):
                     reaction.mechanism.reactants[k] = self.reactants[v.name]
 
 
+        # Registries that are up to date before adding the reaction are
+        # extended, the ordering is the same as for a rebuild as long as the
+        # reactions come first
+        version = get_structure_version()
+        extend_reactants = self._reactant_registry is not None \
+            and self._reactant_version == version
+        extend_parameters = self._parameter_registry is not None \
+            and self._parameter_version == version and not self.compartments
+
         self.add_to_tabdict(reaction, 'reactions')
 
+        version = get_structure_version()
+        if extend_reactants:
+            self._reactant_registry._extend(self._get_reaction_reactants(reaction))
+            self._reactant_version = version
+
+        if extend_parameters:
+            self._parameter_registry._extend(self._get_item_parameters(reaction))
+            self._parameter_version = version
+
     def add_compartment(self, compartment):
         """
 
         :param compartment:
         :return:
         """
+        extend_parameters = self._parameter_registry is not None \
+            and self._parameter_version == get_structure_version()
+
         self.add_to_tabdict(compartment, 'compartments')
 
+        if extend_parameters:
+            self._parameter_registry._extend(self._get_item_parameters(compartment))
+            self._parameter_version = get_structure_version()
+
 
     def add_constraint(self, constraint):
         constraint.link(self)
@@ -199,8 +495,13 @@ class KineticModel(object):
         boundary_condition.link(self)
         self.add_to_tabdict(boundary_condition, 'boundary_conditions')
 
+        # Boundary conditions change reactants into parameters
+        self.update()
+
     def add_to_tabdict(self, element, kind):
 
+        self.check_frozen('adding {}'.format(kind))
+
         the_tabdict = getattr(self, kind)
 
         # Add an enzyme to the model
@@ -225,6 +526,7 @@ class KineticModel(object):
             the_reaction = self.reactions[reaction_name]
             the_reaction.parametrize(the_params)
 
+        self._parameter_registry = None
         #self.update()
 
     def parametrize(self, param_dict):
@@ -250,6 +552,8 @@ class KineticModel(object):
                     if this_modifier_reactant.name in self.reactants:
                         this_modifier.reactants[this_keys] = self.reactants[this_modifier_reactant.name]
 
+        self.update()
+
 
     @property
     def sim_type(self):
@@ -257,9 +561,27 @@ class KineticModel(object):
 
     @sim_type.setter
     def sim_type(self, value):
+        self.check_frozen('changing the simulation type')
         self._simtype = value
         self._modified = True
 
+    @property
+    def backend(self):
+        return self._backend
+
+    @backend.setter
+    def backend(self, value):
+        """
+        Backend used to evaluate the functions compiled from now on, GCC
+        compiles shared objects and NUMPY generates vectorized functions
+        that do not require a compiler
+        """
+        if value not in (GCC, NUMPY):
+            raise ValueError('Backend {} is not recognized'.format(value))
+        self._backend = value
+        self._modified = True
+
+    @profiled
     def prepare(self, mca=True, ode=True, **kwargs):
         """
         Model preparation for different analysis types. The preparation is done before the compiling step
@@ -296,40 +618,133 @@ class KineticModel(object):
             pass
 
 
-    def compile_jacobian(self, type=NUMERICAL ,sim_type=QSSA, ncpu=1):
+    @profiled
+    def compile_jacobian(self, type=NUMERICAL ,sim_type=QSSA, ncpu=None, executor=None):
+
+        self.check_frozen('compiling')
 
         self.sim_type = sim_type
 
-        if not hasattr(self, 'pool'):
-            self.pool = Pool(ncpu)
+        pool = self.get_executor(ncpu, executor)
 
         if type == NUMERICAL:
-            self.compile_mca(parameter_list=[], sim_type=sim_type, ncpu=ncpu)
+            self.compile_mca(parameter_list=[], sim_type=sim_type)
 
         if type == SYMBOLIC:
-            self.compile_ode(sim_type=sim_type, ncpu=ncpu)
+            self.compile_ode(sim_type=sim_type)
             self.jacobian_fun = SymbolicJacobianFunction(self.ode_fun.variables,
                                                          self.ode_fun.expressions,
                                                          self.parameters,
-                                                         self.pool)
+                                                         pool,
+                                                         backend=self.backend)
+            self.link_parameter_index(self.jacobian_fun)
+
+    @profiled
+    def compile_sensitivities(self, parameter_list=None, ncpu=None, executor=None):
+        """
+        Compile the forward sensitivities of the compiled ode function, see
+        SensitivityFunction
+
+        :param parameter_list: names of the parameters, by default all
+                               parameters of the ode function
+        :param ncpu: number of workers for the code generation, if None the
+                     current setting of the executor is kept
+        :param executor: optional executor, see get_executor
+        :return:
+        """
+        self.check_frozen('compiling')
+
+        if not hasattr(self, 'ode_fun'):
+            raise RuntimeError("The ode function needs to be compiled with "
+                               "compile_ode before the sensitivities")
+
+        pool = self.get_executor(ncpu, executor)
+
+        if parameter_list is None:
+            parameter_list = list(self.ode_fun._parameters)
+
+        self.sensitivity_fun = SensitivityFunction(self.ode_fun, parameter_list,
+                                                   pool=pool, backend=self.backend)
+        self.link_parameter_index(self.sensitivity_fun)
+
+    @profiled
+    def compile_adjoint(self, ncpu=None, executor=None):
+        """
+        Compile the adjoint of the compiled ode function, see AdjointFunction
+
+        :param ncpu: number of workers for the code generation, if None the
+                     current setting of the executor is kept
+        :param executor: optional executor, see get_executor
+        :return:
+        """
+        self.check_frozen('compiling')
+
+        if not hasattr(self, 'ode_fun'):
+            raise RuntimeError("The ode function needs to be compiled with "
+                               "compile_ode before the adjoint")
+
+        pool = self.get_executor(ncpu, executor)
 
-    def compile_ode(self, sim_type=QSSA, ncpu=1,):
+        self.adjoint_fun = AdjointFunction(self.ode_fun, pool=pool, backend=self.backend)
+        self.link_parameter_index(self.adjoint_fun)
+
+    @profiled
+    def compile_propensities(self, ncpu=None, executor=None):
+        """
+        Compile the propensities of the stochastic simulations, see
+        make_propensity_fun
+
+        :param ncpu: number of workers for the code generation, if None the
+                     current setting of the executor is kept
+        :param executor: optional executor, see get_executor
+        :return:
+        """
+        self.check_frozen('compiling')
+
+        pool = self.get_executor(ncpu, executor)
+
+        self.propensity_fun = make_propensity_fun(self, pool=pool)
+        self.link_parameter_index(self.propensity_fun)
+
+    @profiled
+    def compile_ode(self, sim_type=QSSA, ncpu=None, executor=None, codegen=INLINED,
+                    custom_ode_terms=None):
+        """
+        Compile the ODE function
+
+        :param sim_type:
+        :param ncpu: number of workers for the code generation, if None the
+                     current setting of the executor is kept
+        :param executor: optional executor, see get_executor
+        :param codegen: INLINED compiles the expression of every reaction,
+                        TEMPLATED compiles one rate function per mechanism
+                        that is evaluated for all its reactions
+        :param custom_ode_terms: optional dict of sympy expressions added to
+                                 the mass balances of the variables given as
+                                 keys. The terms are compiled with the ode
+                                 function and can depend on the variables, the
+                                 parameters and the time Symbol(TIME).
+        :return:
+        """
 
         # For security
         # self.update()
 
+        self.check_frozen('compiling')
+
         self.sim_type = sim_type
 
-        if not hasattr(self, 'pool'):
-            self.pool = Pool(ncpu)
+        pool = self.get_executor(ncpu, executor)
 
         # Recompile only if modified or simulation
         if self._modified or self.sim_type != sim_type:
             # Compile ode function
-            ode_fun, variables = make_ode_fun(self, sim_type, pool=self.pool)
+            ode_fun, variables = make_ode_fun(self, sim_type, pool=pool, codegen=codegen,
+                                              custom_ode_terms=custom_ode_terms)
             # TODO define the init properly
             self.ode_fun = ode_fun
             self.variables = variables
+            self.link_parameter_index(self.ode_fun)
 
             self._modified = False
             self._recompiled = True
@@ -340,7 +755,9 @@ class KineticModel(object):
             # serialization)
             self.initial_conditions.update(old_initial_conditions)
 
-    def solve_ode(self, time_out, solver_type='cvode', **kwargs):
+    def solve_ode(self, time_out, solver_type='cvode', parameters=None,
+                  statistics=False, sink=None, sample_id=None, sensitivities=False,
+                  **kwargs):
         """
 
         The solver types are from ::scikits.odes::, and can be found at
@@ -349,12 +766,29 @@ class KineticModel(object):
         :param time_out: The times at which the solution is evaluated
         :type time_out:  list(float) or similar
         :param solver_type: must be among ['cvode','ida','dopri5','dop853']
+        :param parameters: optional parameter vector in canonical order
+                           (see get_parameter_vector), if None the current
+                           values of the model parameters are used
+        :param statistics: if True the calls of the ode function are
+                           counted and timed, the SolverStatistics are
+                           attached to the solution
+        :param sink: optional ODESolutionWriter the solution is appended to
+        :param sample_id: id of the solution in the sink
+        :param sensitivities: if True the forward sensitivities to the
+                              parameters of the compiled sensitivity function,
+                              or of all parameters if none is compiled, are
+                              integrated with the variables. A list of
+                              parameter names selects the parameters. The
+                              sensitivities are attached to the solution.
         :param kwargs:
         :return:
         """
         extra_options = {'old_api': False}
         kwargs.update(extra_options)
 
+        if sensitivities and statistics:
+            raise ValueError("Statistics are not collected for sensitivities")
+
         # Choose a solver
         if not hasattr(self, 'solver')\
            or self._recompiled:
@@ -366,25 +800,248 @@ class KineticModel(object):
                                       for variable in self.variables]
 
         #Update fixed parameters
-        self.ode_fun.get_params()
+        self.ode_fun.get_params(parameters)
 
         # #if parameters are empty try to fetch from model
         # if not self.ode_fun._parameter_values:
         #     self.ode_fun.parameter_values = {v.symbol:v.value
         #                                      for k,v in self.parameters.items()}
 
-        # solve the ode
-        solution = self.solver.solve(time_out, ordered_initial_conditions)
+        if sensitivities:
+            solution = self._solve_ode_with_sensitivities(time_out, solver_type,
+                                                          parameters, sensitivities,
+                                                          kwargs)
+        elif not statistics:
+            # solve the ode
+            solution = self.solver.solve(time_out, ordered_initial_conditions)
+            solution = ODESolution(self, solution)
+        else:
+            solution = self._solve_ode_with_statistics(time_out,
+                                                       ordered_initial_conditions)
+
+        if sink is not None:
+            # The fluxes written by the sink use the same parameters
+            if parameters is None:
+                parameters = {k: v.value for k, v in self.parameters.items()}
+            sink.append(solution, sample_id=sample_id, parameters=parameters)
 
-        return ODESolution(self, solution)
+        return solution
 
-    def compile_mca(self, parameter_list=[], mca_type=NET, sim_type=QSSA, ncpu=1):
+    def solve_adjoint(self, experiment, parameters=None, t_start=0.0, num_checkpoints=10,
+                      quadrature_points=5, solver_type='cvode', **kwargs):
+        """
+        Loss of an experiment and its gradient by all parameters at the cost
+        of about one forward and one backward solve. The forward trajectory
+        is only stored at checkpoints, the trajectory between two checkpoints
+        is recomputed for the backward solve of the adjoint over the segment
+        and the gradient is integrated over the segment with Gauss-Legendre
+        quadrature.
+
+        :param experiment: TimeCourseExperiment or an object with the same
+                           time, loss and loss_gradient
+        :param parameters: optional parameter vector in canonical order
+                           (see get_parameter_vector), if None the current
+                           values of the model parameters are used
+        :param t_start: time of the initial conditions
+        :param num_checkpoints: number of uniformly spaced checkpoints in
+                                addition to the time points of the experiment
+        :param quadrature_points: number of quadrature points per segment
+        :param solver_type: see solve_ode
+        :param kwargs: options of the solvers
+        :return: tuple of the loss and the pd.Series of the gradient indexed
+                 by the parameters in canonical order
+        """
+        extra_options = {'old_api': False}
+        kwargs.update(extra_options)
+
+        adjoint_fun = getattr(self, 'adjoint_fun', None)
+        if adjoint_fun is None or adjoint_fun.ode_fun is not self.ode_fun:
+            self.compile_adjoint()
+            adjoint_fun = self.adjoint_fun
+
+        if parameters is None:
+            parameters = self.get_parameter_vector()
+        adjoint_fun.get_params(parameters)
+
+        names = list(self.variables)
+        observation_time = experiment.time
+        if observation_time[0] < t_start:
+            raise ValueError("The experiment starts before t_start")
+
+        checkpoints = np.unique(np.concatenate([
+            [t_start], observation_time,
+            np.linspace(t_start, observation_time[-1], num_checkpoints + 1)]))
+
+        # Forward solve storing the checkpoints
+        forward_solver = ode(solver_type, self.ode_fun, **kwargs)
+        initial_conditions = np.array([self.initial_conditions[variable]
+                                       for variable in names], dtype=np.float64)
+        states = np.array(forward_solver.solve(checkpoints, initial_conditions).values.y)
+        if len(states) < len(checkpoints):
+            raise RuntimeError("The forward integration stopped at t = {}"
+                               .format(checkpoints[len(states) - 1]))
+
+        observation_ix = np.searchsorted(checkpoints, observation_time)
+        loss = experiment.loss(states[observation_ix], names)
+
+        # The adjoint jumps by the derivatives of the loss at the observations
+        jumps = np.zeros(states.shape)
+        np.add.at(jumps, observation_ix, experiment.loss_gradient(states[observation_ix], names))
+
+        adjoint_kwargs = dict(kwargs)
+        if solver_type == 'cvode' and 'jacfn' not in kwargs:
+            adjoint_kwargs['jacfn'] = adjoint_fun.jacobian
+        adjoint_solver = ode(solver_type, adjoint_fun, **adjoint_kwargs)
+
+        nodes, weights = np.polynomial.legendre.leggauss(quadrature_points)
+        rates = np.zeros(len(names))
+        gradient = np.zeros(len(adjoint_fun.sensitivity_parameters))
+
+        adjoint = jumps[-1]
+        for k in range(len(checkpoints) - 1, 0, -1):
+            start, end = checkpoints[k - 1], checkpoints[k]
+            segment_time = np.concatenate([[start], start + (end - start)*(nodes + 1)/2, [end]])
+
+            # Recompute the trajectory of the segment from its checkpoint
+            segment = np.array(forward_solver.solve(segment_time, states[k - 1]).values.y)
+            if len(segment) < len(segment_time):
+                raise RuntimeError("The forward integration stopped in the "
+                                   "segment [{}, {}]".format(start, end))
+
+            derivatives = np.zeros(segment.shape)
+            for i, x in enumerate(segment):
+                self.ode_fun(segment_time[i], x, rates)
+                derivatives[i] = rates
+            adjoint_fun.set_trajectory(CubicHermiteSpline(segment_time, segment, derivatives))
+
+            # The adjoint is solved forward in the reversed time
+            solution = adjoint_solver.solve(-segment_time[::-1], adjoint)
+            adjoints = np.array(solution.values.y)
+            if len(adjoints) < len(segment_time):
+                raise RuntimeError("The adjoint integration stopped in the "
+                                   "segment [{}, {}]".format(start, end))
+            adjoints = adjoints[::-1]
+
+            for i, w in enumerate(weights):
+                gradient += 0.5*(end - start)*w \
+                            *adjoint_fun.gradient_density(segment[i + 1], adjoints[i + 1])
+
+            adjoint = adjoints[0] + jumps[k - 1]
+
+        full_gradient = np.zeros(len(self.parameter_index))
+        full_gradient[adjoint_fun._parameter_ix] = gradient
+
+        return loss, pd.Series(full_gradient, index=self.parameter_index.names)
+
+    def _solve_ode_with_sensitivities(self, time_out, solver_type, parameters,
+                                      sensitivities, kwargs):
+        parameter_list = None if sensitivities is True \
+            else [str(p) for p in sensitivities]
+
+        # Recompile if the ode function changed or other parameters are selected
+        sensitivity_fun = getattr(self, 'sensitivity_fun', None)
+        if sensitivity_fun is None \
+                or sensitivity_fun.ode_fun is not self.ode_fun \
+                or (parameter_list is not None
+                    and sensitivity_fun.sensitivity_parameters != parameter_list):
+            self.compile_sensitivities(parameter_list)
+            sensitivity_fun = self.sensitivity_fun
+
+        # The Krylov solver only needs the products with the sparse jacobian
+        # instead of a dense matrix of all the states
+        if solver_type == 'cvode' and 'jacfn' not in kwargs \
+                and 'linsolver' not in kwargs:
+            kwargs = dict(kwargs, linsolver='spgmr',
+                          jac_times_vecfn=sensitivity_fun.jacobian_times_vector)
+
+        sensitivity_fun.get_params(parameters)
+
+        # The initial conditions do not depend on the parameters
+        initial_conditions = np.zeros(sensitivity_fun.num_states)
+        initial_conditions[:len(self.variables)] = [self.initial_conditions[variable]
+                                                    for variable in self.variables]
+
+        solver = ode(solver_type, sensitivity_fun, **kwargs)
+        solution = solver.solve(time_out, initial_conditions)
+
+        return ODESolution(self, solution,
+                           sensitivity_parameters=sensitivity_fun.sensitivity_parameters)
+
+    def _solve_ode_with_statistics(self, time_out, ordered_initial_conditions):
+        self.ode_fun.statistics = EvaluationStatistics()
+
+        try:
+            start = time.perf_counter()
+            solution = self.solver.solve(time_out, ordered_initial_conditions)
+            wall_time = time.perf_counter() - start
+        finally:
+            rhs_statistics = self.ode_fun.statistics
+            self.ode_fun.statistics = None
+
+        # Only some solvers report statistics, the jacobian evaluations of
+        # the solver are reported as NumJacEvals
+        solver_statistics = self.solver.get_info() \
+            if hasattr(self.solver, 'get_info') else None
+
+        solver_statistics = SolverStatistics(rhs_statistics,
+                                             solver=solver_statistics,
+                                             wall_time=wall_time)
+
+        return ODESolution(self, solution, statistics=solver_statistics)
+
+    def solve_stochastic(self, time_out, num_realizations, method=SSA, volume=1.0,
+                         seed=None, parameters=None, ncpu=None, executor=None,
+                         chunk_size=256, **kwargs):
+        """
+        Simulate realizations of the chemical master equation of the model
+        with the Gillespie direct method or with tau-leaping. The propensities
+        are compiled on the first call, call compile_propensities again after
+        modifying the model.
+
+        :param time_out: times at which the realizations are recorded
+        :param num_realizations: number of realizations
+        :param method: SSA or TAU_LEAPING
+        :param volume: system size, the initial copy numbers are the rounded
+                       initial conditions times the volume and the results
+                       are concentrations
+        :param seed: seed of the random number streams, the realizations
+                     only depend on the seed and the chunk size
+        :param parameters: optional parameter vector in canonical order
+        :param ncpu: number of workers simulating the chunks of realizations
+        :param executor: optional executor, see get_executor
+        :param chunk_size: number of realizations simulated together
+        :param kwargs: options of the method, e.g. epsilon for TAU_LEAPING
+        :return: StochasticSolution
+        """
+        if getattr(self, 'propensity_fun', None) is None:
+            self.compile_propensities()
+
+        if parameters is None:
+            parameters = self.get_parameter_vector()
+
+        initial_counts = [np.round(self.initial_conditions.get(k, 0.0)*volume)
+                          for k in self.propensity_fun.variables]
+
+        pool = self.get_executor(ncpu, executor)
+
+        return simulate_stochastic(self.propensity_fun, parameters, initial_counts,
+                                   time_out, num_realizations, method=method,
+                                   volume=volume, seed=seed, pool=pool,
+                                   chunk_size=chunk_size, **kwargs)
+
+    @profiled
+    def compile_mca(self, parameter_list=[], mca_type=NET, sim_type=QSSA, ncpu=None, executor=None):
             """
             Compile MCA expressions: elasticities, jacobian
             and control coeffcients
+
+            :param ncpu: number of workers for the code generation, if None the
+                         current setting of the executor is kept
+            :param executor: optional executor, see get_executor
             """
-            if not hasattr(self, 'pool'):
-                self.pool = Pool(ncpu)
+            self.check_frozen('compiling')
+
+            self.get_executor(ncpu, executor)
 
             # Recompile only if modified or simulation
             if self._modified or self.sim_type != sim_type:
@@ -408,37 +1065,52 @@ class KineticModel(object):
                 else:
                     self.displacement_function = None
 
-                # Build functions for stability and control coefficient's
-                self.jacobian_fun = JacobianFunction(
-                    self.reduced_stoichiometry,
-                    self.independent_elasticity_fun,
-                    self.dependent_elasticity_fun,
-                    self.volume_ratio_func,
-                    self.conservation_relation,
-                    self.independent_variables_ix,
-                    self.dependent_variables_ix)
-
-                self.concentration_control_fun = ConcentrationControlFunction(
-                    self,
-                    self.reduced_stoichiometry,
-                    self.independent_elasticity_fun,
-                    self.dependent_elasticity_fun,
-                    self.parameter_elasticities_fun,
-                    self.volume_ratio_func,
-                    self.conservation_relation,
-                    self.independent_variables_ix,
-                    self.dependent_variables_ix,
-                    displacement_function=self.displacement_function,
-                    mca_type=mca_type)
-
-                self.flux_control_fun = FluxControlFunction(
-                    self,
-                    self.reduced_stoichiometry,
-                    self.independent_elasticity_fun,
-                    self.dependent_elasticity_fun,
-                    self.parameter_elasticities_fun,
-                    self.conservation_relation,
-                    self.independent_variables_ix,
-                    self.dependent_variables_ix,
-                    self.concentration_control_fun,
-                    mca_type=mca_type)
+                self.link_mca_functions(mca_type=mca_type)
+
+    def link_mca_functions(self, mca_type=NET):
+        """
+        Link the compiled elasticity functions to the parameter index and
+        build the jacobian and control coefficient functions from them
+
+        :param mca_type: NET or SPLIT
+        """
+        self.link_parameter_index(self.independent_elasticity_fun,
+                                  self.dependent_elasticity_fun,
+                                  self.parameter_elasticities_fun,
+                                  self.displacement_function,
+                                  self.volume_ratio_func)
+
+        # Build functions for stability and control coefficient's
+        self.jacobian_fun = JacobianFunction(
+            self.reduced_stoichiometry,
+            self.independent_elasticity_fun,
+            self.dependent_elasticity_fun,
+            self.volume_ratio_func,
+            self.conservation_relation,
+            self.independent_variables_ix,
+            self.dependent_variables_ix)
+
+        self.concentration_control_fun = ConcentrationControlFunction(
+            self,
+            self.reduced_stoichiometry,
+            self.independent_elasticity_fun,
+            self.dependent_elasticity_fun,
+            self.parameter_elasticities_fun,
+            self.volume_ratio_func,
+            self.conservation_relation,
+            self.independent_variables_ix,
+            self.dependent_variables_ix,
+            displacement_function=self.displacement_function,
+            mca_type=mca_type)
+
+        self.flux_control_fun = FluxControlFunction(
+            self,
+            self.reduced_stoichiometry,
+            self.independent_elasticity_fun,
+            self.dependent_elasticity_fun,
+            self.parameter_elasticities_fun,
+            self.conservation_relation,
+            self.independent_variables_ix,
+            self.dependent_variables_ix,
+            self.concentration_control_fun,
+            mca_type=mca_type)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIE CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from sympy import Piecewise, Symbol, sympify, interpolating_spline
+
+from skimpy.core.itemsets import Reactant
+from skimpy.utils.namespace import *
+
+
+def make_feed_profile(profile, time, values):
+    """
+    Feed profile as sympy expression of the time Symbol(TIME), such that it
+    is compiled with the ode function. Before the first and after the last
+    time point the profile keeps the first and last value.
+
+    :param profile: CONSTANT, PIECEWISE (constant between the time points),
+                    LINEAR or SPLINE (cubic interpolation)
+    :param time: list of time points
+    :param values: list of the values at the time points
+    :return: sympy expression
+    """
+    t = Symbol(TIME)
+    time = [sympify(x) for x in time]
+    values = [sympify(x) for x in values]
+
+    if len(time) != len(values) or not values:
+        raise ValueError('The profile needs one value per time point')
+
+    if profile == CONSTANT or len(values) == 1:
+        return values[0]
+
+    elif profile == PIECEWISE:
+        pieces = [(v, t < x) for v, x in zip(values[:-1], time[1:])]
+
+    elif profile in (LINEAR, SPLINE):
+        degree = 1 if profile == LINEAR else min(3, len(values) - 1)
+        spline = interpolating_spline(degree, t, time, values)
+        # The intervals of the spline are ordered, only their upper bound is needed
+        pieces = [(values[0], t < time[0])] \
+                 + [(e, t <= c.as_set().sup) for e, c in spline.args]
+
+    else:
+        raise ValueError('Feed profile {} is not recognized'.format(profile))
+
+    return Piecewise(*(pieces + [(values[-1], True)]))
+
+
+class ReactorOperation(object):
+    """
+    Operation mode of a reactor, the feed and the dilution are added to the
+    mass balances as custom ode terms and compiled with the ode function
+    """
+    mode = BATCH
+
+    def __init__(self, feed=None):
+        """
+        :param feed: dict of the feed concentrations of the medium
+        """
+        self.feed = dict() if feed is None else dict(feed)
+
+    @property
+    def custom_variables(self):
+        return []
+
+    def get_ode_terms(self, reactor):
+        """
+        :return: dict of the terms indexed by the variable names
+        """
+        return dict()
+
+    def get_substitutions(self, reactor):
+        """
+        :return: dict of the parameters that become variables
+        """
+        return dict()
+
+    def check_feed(self, reactor):
+        for name in self.feed:
+            if name not in reactor.medium:
+                raise ValueError('Feed of {} which is not in the medium'.format(name))
+
+
+class Chemostat(ReactorOperation):
+    """
+    Continuous operation at constant volume, the feed replaces the
+    medium and washes out the cells at the dilution rate
+    """
+    mode = CHEMOSTAT
+
+    def __init__(self, dilution_rate, feed=None):
+        """
+        :param dilution_rate: number or expression of Symbol(TIME), e.g.
+                              from make_feed_profile
+        :param feed: dict of the feed concentrations of the medium
+        """
+        ReactorOperation.__init__(self, feed)
+        self.dilution_rate = dilution_rate
+
+    def get_ode_terms(self, reactor):
+        self.check_feed(reactor)
+        dilution_rate = sympify(self.dilution_rate)
+
+        terms = dict()
+        for name, the_reactant in reactor.medium.items():
+            feed = sympify(self.feed.get(name, 0.0))
+            terms[name] = dilution_rate*(feed - the_reactant.symbol)
+
+        for name, biomass in reactor.biomass_variables.items():
+            terms[name] = -dilution_rate*biomass.symbol
+
+        return terms
+
+
+class FedBatch(ReactorOperation):
+    """
+    Fed-batch operation, the reactor volume is a variable increased by the
+    feed rate and the medium is diluted by the feed. The biomass variables
+    are cell numbers and are not diluted. The medium volume parameters of the
+    models are replaced by the volume variable.
+    """
+    mode = FED_BATCH
+
+    def __init__(self, feed_rate, feed=None, volume='volume'):
+        """
+        :param feed_rate: volume per time as number or expression of
+                          Symbol(TIME), e.g. from make_feed_profile
+        :param feed: dict of the feed concentrations of the medium
+        :param volume: name of the volume variable
+        """
+        ReactorOperation.__init__(self, feed)
+        self.feed_rate = feed_rate
+        self.volume = Reactant(volume)
+
+    @property
+    def custom_variables(self):
+        return [self.volume]
+
+    def get_ode_terms(self, reactor):
+        self.check_feed(reactor)
+        feed_rate = sympify(self.feed_rate)
+        volume = self.volume.symbol
+
+        terms = {self.volume.name: feed_rate}
+        for name, the_reactant in reactor.medium.items():
+            feed = sympify(self.feed.get(name, 0.0))
+            terms[name] = feed_rate/volume*(feed - the_reactant.symbol)
+
+        return terms
+
+    def get_substitutions(self, reactor):
+        medium_compartment = reactor.extracellular_compartment
+        return {model.compartments[medium_compartment].parameters.volume.symbol:
+                self.volume.symbol
+                for model in reactor.models.values()}
@@ -253,4 +253,166 @@ def concat_populations(values, kmodel=None, index=None):
     data = []
     for v in values:
         data.extend(v._data)
-    return ParameterValuePopulation(data, kmodel=kmodel, index=index)
\ No newline at end of file
+    return ParameterValuePopulation(data, kmodel=kmodel, index=index)
+
+class ParameterIndex(object):
+    """
+    Canonical ordering of the parameters of a compiled kinetic model. All
+    compiled functions accept a contiguous float64 vector in this order and
+    gather their own subset with a precomputed index array.
+    """
+    def __init__(self, parameter_names):
+        """
+
+        :param parameter_names: iterable of parameter names (str or Symbol)
+        """
+        self.names = [str(p) for p in parameter_names]
+        self._index = {p: i for i, p in enumerate(self.names)}
+        # Parameters read by the linked functions, see link
+        self._required = np.zeros(len(self.names), dtype=bool)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, item):
+        return str(item) in self._index
+
+    def get_index(self, parameters):
+        """
+        Positions of a subset of parameters in the canonical vector
+
+        :param parameters: iterable of parameter names (str or Symbol)
+        :return: np.array of int
+        """
+        try:
+            return np.array([self._index[str(p)] for p in parameters],
+                            dtype=np.int64)
+        except KeyError as e:
+            raise KeyError("Parameter {} is not in the parameter index of "
+                           "the model".format(e.args[0]))
+
+    def link(self, parameters):
+        """
+        Positions of the parameters read by a compiled function, the values
+        of these parameters are required by to_vector and to_array
+
+        :param parameters: iterable of parameter names (str or Symbol)
+        :return: np.array of int
+        """
+        index = self.get_index(parameters)
+        self._required[index] = True
+        return index
+
+    def check_missing(self, values):
+        """
+        Raise a KeyError naming the parameters read by the linked functions
+        that are nan in a vector or in any row of an array
+
+        :param values: vector or (samples x parameters) array
+        """
+        isnan = np.isnan(values).reshape(-1, len(self)).any(axis=0)
+        missing = [p for p, m in zip(self.names, isnan & self._required) if m]
+        if missing:
+            raise KeyError("No values for the parameters {}".format(missing))
+
+    def to_vector(self, parameter_values, allow_missing=False):
+        """
+        Gather parameter values into a contiguous float64 vector
+
+        :param parameter_values: ParameterValues, pd.Series, dict indexed by
+                                 str or Symbol or an array already in
+                                 canonical order
+        :param allow_missing: set the parameters that are missing or without
+                              value to nan instead of raising a KeyError, the
+                              parameters no linked function reads are always
+                              set to nan
+        :return: np.array of float64
+        """
+        if isinstance(parameter_values, np.ndarray):
+            if parameter_values.shape != (len(self),):
+                raise ValueError("Expected a parameter vector of length {}, "
+                                 "got shape {}".format(len(self),
+                                                       parameter_values.shape))
+            return np.ascontiguousarray(parameter_values, dtype=np.float64)
+
+        if isinstance(parameter_values, ParameterValues):
+            values = parameter_values._parameter_values
+        else:
+            values = {str(k): v for k, v in parameter_values.items()}
+
+        vector = np.full(len(self), np.nan)
+        for i, p in enumerate(self.names):
+            v = values.get(p)
+            if v is not None:
+                vector[i] = v
+
+        if not allow_missing:
+            self.check_missing(vector)
+
+        return vector
+
+    def to_array(self, parameter_population, allow_missing=False):
+        """
+        Gather a population of parameter sets into a (samples x parameters)
+        float64 array in canonical order
+
+        :param parameter_population: ParameterValuePopulation, pd.DataFrame
+                                     or list of parameter sets
+        :param allow_missing: see to_vector
+        :return: np.array of float64
+        """
+        if isinstance(parameter_population, ParameterValuePopulation):
+            parameter_population = parameter_population._dataframe(dropna=False)
+
+        if isinstance(parameter_population, pd.DataFrame):
+            df = parameter_population.rename(columns=str)
+            array = np.ascontiguousarray(df.reindex(columns=self.names).values,
+                                         dtype=np.float64)
+            if not allow_missing:
+                self.check_missing(array)
+            return array
+
+        return np.array([self.to_vector(p, allow_missing=allow_missing)
+                         for p in parameter_population],
+                        dtype=np.float64).reshape(-1, len(self))
+
+
+def update_parameter_index(parameter_index, parameter_names, functions,
+                           linked_functions, logger=None):
+    """
+    Link compiled functions to the canonical parameter ordering. If the
+    parameter names changed a new index is created and all the functions
+    linked before are linked again, such that they read the new vectors
+    correctly. Functions with parameters that are no longer in the index
+    are dropped from the linked functions with a warning.
+
+    :param parameter_index: current ParameterIndex or None
+    :param parameter_names: current parameter names
+    :param functions: functions to link, None entries are skipped
+    :param linked_functions: WeakSet of the functions linked before, the
+                             functions are added to it
+    :param logger: optional logger of the warnings
+    :return: ParameterIndex
+    """
+    functions = [f for f in functions if f is not None]
+
+    if parameter_index is None or parameter_index.names != parameter_names:
+        parameter_index = ParameterIndex(parameter_names)
+
+        for this_function in list(linked_functions):
+            if any(this_function is f for f in functions):
+                continue
+            try:
+                this_function.link_parameter_index(parameter_index)
+            except KeyError as e:
+                linked_functions.discard(this_function)
+                if logger is not None:
+                    logger.warning('{} is no longer linked to the parameters: {}'
+                                   .format(this_function.__class__.__name__,
+                                           e.args[0]))
+
+    for this_function in functions:
+        this_function.link_parameter_index(parameter_index)
+        linked_functions.add(this_function)
+
+    return parameter_index
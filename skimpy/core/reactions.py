@@ -25,7 +25,7 @@ limitations under the License.
 
 """
 
-from skimpy.utils.tabdict import TabDict
+from skimpy.utils.tabdict import TabDict, ObservedTabDict, bump_structure_version
 from skimpy.utils.namespace import *
 
 
@@ -48,7 +48,8 @@ class Reaction(object):
                                        reactants=reactants,
                                        parameters=parameters,
                                        enzyme=enzyme)
-        self.modifiers = TabDict([])
+        # Changes of the modifiers invalidate the registries of the models
+        self.modifiers = ObservedTabDict([])
 
     # Hooks to the mechanism attributes for convenience
     @property
@@ -72,6 +73,7 @@ class Reaction(object):
     @reactants.setter
     def reactants(self, value):
         self.mechanism.reactants = value
+        bump_structure_version()
 
     @property
     def reactant_stoichiometry(self):
@@ -112,6 +114,7 @@ class Reaction(object):
         for name, p in value.items():
             p.suffix = self.name
         self.mechanism.parameters = value
+        bump_structure_version()
 
     @property
     def rates(self):
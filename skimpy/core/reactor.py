@@ -27,21 +27,31 @@ limitations under the License.
 
 from copy import copy
 from abc import ABC
+from functools import partial
+from itertools import product
+from weakref import WeakSet
+
+import numpy as np
 from scikits.odes import ode
 
-from skimpy.core.itemsets import Reactant
+from skimpy.core.itemsets import Reactant, add_prefix
 from skimpy.utils.namespace import *
 from skimpy.utils.medium import get_medium
 
 from skimpy.utils import TabDict, iterable_to_tabdict
-from skimpy.analysis.ode.utils import get_expressions_from_model, make_expressions
+from skimpy.utils.compile_sympy import make_function
+from skimpy.analysis.ode.utils import get_expressions_from_model, make_expressions, \
+    add_custom_ode_terms
 from skimpy.analysis.ode.ode_fun import ODEFunction
+from skimpy.analysis.ode.replicated_ode_fun import ReplicatedODEFunction, StrainKernel, \
+    STRAIN_BIOMASS, STRAIN_BIOMASS_SCALING, STRAIN_RATE
 
-from skimpy.core.solution import ODESolution
+from skimpy.core.parameters import update_parameter_index
+from skimpy.core.solution import ODESolution, ODESolutionPopulation
 
-from multiprocessing.pool import Pool
+from skimpy.utils.executor import Executor, make_executor
 
-from sympy import exp, Symbol
+from sympy import exp, Symbol, sympify
 
 class Reactor(ABC):
     """
@@ -68,6 +78,7 @@ class Reactor(ABC):
         models = [copy(m) for m in models]
         for the_model in models:
             the_model.boundary_conditions.clear()
+            the_model.update()
 
         medium = []
         for model in models:
@@ -86,19 +97,16 @@ class Reactor(ABC):
 
         #Generate unique model annotation and remove all boundary conditions
         for the_model in models:
-            reactants = the_model.reactants
-            for the_reactant in reactants.values():
-                if the_reactant.name not in self.medium:
-                    the_reactant.name = the_model.name + '_' + the_reactant.name
-                    the_reactant._generate_symbol()
-
-            parameters = the_model.parameters
-            for the_parameter in parameters.values():
-                the_parameter.name = the_model.name + '_' + the_parameter.name
-                the_parameter._generate_symbol()
+            prefix = the_model.name + '_'
+            add_prefix([r for r in the_model.reactants.values()
+                        if r.name not in self.medium], prefix)
+            add_prefix(the_model.parameters.values(), prefix)
 
             for the_reaction in the_model.reactions.values():
-                the_reaction.name = the_model.name + '_' + the_reaction.name
+                the_reaction.name = prefix + the_reaction.name
+
+            # The registries of the model are indexed by the old names
+            the_model.update()
 
         self.models = iterable_to_tabdict(models)
 
@@ -108,6 +116,52 @@ class Reactor(ABC):
         self._modified = True
         self.custom_variables = iterable_to_tabdict(custom_variables)
 
+        # Batch operation if None, see set_operation
+        self.operation = None
+
+        # Executor for the code generation, created on first use
+        self._executor = None
+
+        # Canonical parameter ordering, see link_parameter_index
+        self.parameter_index = None
+        self._linked_functions = WeakSet()
+
+    @property
+    def pool(self):
+        return self.get_executor()
+
+    @pool.setter
+    def pool(self, value):
+        self._executor = value
+
+    def get_executor(self, ncpu=None, executor=None):
+        """
+        Executor used to parallelize the code generation
+
+        :param ncpu: number of workers, if None the current setting is kept
+        :param executor: replace the executor by an Executor, a
+                         multiprocessing.Pool or one of 'serial', 'thread'
+                         and 'process'
+        :return: executor
+        """
+        if executor is not None:
+            self._executor = make_executor(executor, ncpu)
+        elif self._executor is None:
+            self._executor = make_executor(ncpu=ncpu)
+        elif ncpu is not None and isinstance(self._executor, Executor):
+            self._executor.ncpu = ncpu
+
+        return self._executor
+
+    def close(self):
+        """
+        Shut down the workers of the executor
+
+        :return:
+        """
+        if self._executor is not None:
+            self._executor.close()
+
     @property
     def variables(self):
         variables = copy(self.biomass_variables)
@@ -152,6 +206,83 @@ class Reactor(ABC):
             if model_name+'_'+str(key) in parameters.keys():
                 parameters[model_name+'_'+str(key)].value = value
 
+    @property
+    def strain_names(self):
+        return list(self.models.keys())
+
+    def get_strain_parameters(self, strain):
+        """
+        :param strain: name of a strain
+        :return: TabDict of the reactor parameter names indexed by the
+                 parameter names of the strain model
+        """
+        prefix = strain + '_'
+        names = [str(p.symbol) for p in self.models[strain].parameters.values()]
+        return TabDict([(k[len(prefix):], k) for k in names])
+
+    def link_parameter_index(self, *functions):
+        """
+        Define the canonical ordering of the reactor parameters and link the
+        ode function to it, such that it can be evaluated with parameter
+        vectors (see get_parameter_vector). Functions linked before are
+        linked again if the ordering changes, see update_parameter_index.
+
+        :param functions: other functions with a link_parameter_index method
+        :return:
+        """
+        self.parameter_index = update_parameter_index(self.parameter_index,
+                                                      list(self.parameters.keys()),
+                                                      (self.ode_fun,) + functions,
+                                                      self._linked_functions)
+
+    def get_parameter_vector(self, allow_missing=False):
+        """
+        :param allow_missing: set the parameters without value to nan instead
+                              of raising a KeyError
+        :return: np.array of the current parameter values in canonical order
+        """
+        return self.parameter_index.to_vector({k: p.value
+                                               for k, p in self.parameters.items()},
+                                              allow_missing=allow_missing)
+
+    def get_parameter_array(self, parameter_populations, index, allow_missing=False):
+        """
+        Dense (combinations x parameters) array of the reactor parameters for
+        combinations of strain parameter sets. Parameters missing from a
+        population and the parameters of the strains without population
+        keep their current value.
+
+        :param parameter_populations: dict of ParameterValuePopulation
+                                      indexed by the strain name
+        :param index: list of tuples with a sample id per population
+        :param allow_missing: set the parameters without value in both the
+                              populations and the reactor to nan instead of
+                              raising a KeyError
+        :return: np.array of float64
+        """
+        parameters = np.tile(self.get_parameter_vector(allow_missing=True), (len(index), 1))
+
+        for i, (strain, population) in enumerate(parameter_populations.items()):
+            if strain not in self.strain_names:
+                raise ValueError('Strain {} is not in the reactor'.format(strain))
+
+            names = self.get_strain_parameters(strain)
+            columns = self.parameter_index.get_index(names.values())
+
+            # Rows follow the index of the population
+            rows = {k: j for j, k in enumerate(population._index)}
+            values = population._dataframe(dropna=False).rename(columns=str)
+            values = values.reindex(columns=list(names)).values
+            values = values[[rows[this_index[i]] for this_index in index]]
+
+            current = parameters[:, columns]
+            parameters[:, columns] = np.where(np.isnan(values), current, values)
+
+        if not allow_missing:
+            self.parameter_index.check_missing(parameters)
+
+        return parameters
+
 
     def add_boundary_condition(self, boundary_condition):
         """
@@ -167,6 +298,41 @@ class Reactor(ABC):
 
         # HOTFIX to be done better
         boundary_condition.reactant.type = VARIABLE
+        for the_model in self.models.values():
+            the_model.update()
+
+    def set_operation(self, operation):
+        """
+        Set the operation mode of the reactor, e.g. a Chemostat or a FedBatch.
+        The feed and dilution terms are compiled with the ode function.
+
+        :param operation: ReactorOperation or None for a batch reactor
+        :return:
+        """
+        if self.operation is not None:
+            for the_variable in self.operation.custom_variables:
+                self.custom_variables.pop(the_variable.name)
+
+        if operation is not None:
+            for the_variable in operation.custom_variables:
+                self.add_to_tabdict(the_variable, 'custom_variables')
+
+        self.operation = operation
+        self._modified = True
+
+    def get_custom_ode_terms(self, custom_ode_terms=None):
+        """
+        :param custom_ode_terms: dict of custom terms indexed by variable name
+        :return: dict of the custom terms and the terms of the operation
+        """
+        terms = dict() if custom_ode_terms is None \
+            else {str(k): v for k, v in custom_ode_terms.items()}
+
+        if self.operation is not None:
+            for k, v in self.operation.get_ode_terms(self).items():
+                terms[k] = terms[k] + v if k in terms else v
+
+        return terms
 
     def add_to_tabdict(self, element, kind):
 
@@ -184,23 +350,36 @@ class Reactor(ABC):
         #     self.metabolites.append(this_metabolite)
         self._modified = True
 
-    def compile_ode(self, sim_type=QSSA, ncpu=1, add_dilution=False, custom_ode_update=None):
+    def compile_ode(self, sim_type=QSSA, ncpu=None, add_dilution=False, custom_ode_update=None,
+                    executor=None, custom_ode_terms=None):
         """
 
         :param sim_type:
-        :param ncpu:
+        :param ncpu: number of workers for the code generation, if None the
+                     current setting of the executor is kept
+        :param custom_ode_update: python callback modifying ydot after every
+                                  evaluation, prefer custom_ode_terms
+        :param executor: optional executor, see get_executor
+        :param custom_ode_terms: optional dict of sympy expressions added to
+                                 the mass balances of the variables given as
+                                 keys, e.g. feeds or control laws. The terms
+                                 are compiled with the ode function and can
+                                 depend on the variables, the parameters and
+                                 the time Symbol(TIME). The terms of the
+                                 operation mode are added.
         :return:
         """
         self.sim_type = sim_type
-        if not hasattr(self, 'pool'):
-            self.pool = Pool(ncpu)
+        pool = self.get_executor(ncpu, executor)
 
         # Recompile only if modified or simulation
         if self._modified or self.sim_type != sim_type:
             # Compile ode function
-            ode_fun, variables = make_reactor_ode_fun(self, sim_type, pool=self.pool,
-                                                      add_dilution=add_dilution,
-                                                      custom_ode_update=custom_ode_update)
+            custom_ode_terms = self.get_custom_ode_terms(custom_ode_terms)
+            ode_fun, variables = self._make_ode_fun(sim_type, pool=pool,
+                                                    add_dilution=add_dilution,
+                                                    custom_ode_update=custom_ode_update,
+                                                    custom_ode_terms=custom_ode_terms)
             # TODO define the init properly
             self.ode_fun = ode_fun
             self._modified = False
@@ -212,6 +391,9 @@ class Reactor(ABC):
             # serialization)
             self.initial_conditions.update(old_initial_conditions)
 
+    def _make_ode_fun(self, sim_type, **kwargs):
+        return make_reactor_ode_fun(self, sim_type, **kwargs)
+
     def initialize(self, value_dict, model_name):
         """
         Set the initial conditions for a single strain (excluding medium)
@@ -253,15 +435,275 @@ class Reactor(ABC):
 
         return ODESolution(self, solution)
 
+    def solve_ode_population(self, time_out, parameter_populations, index=None,
+                             solver_type='cvode', ncpu=None, executor=None,
+                             chunks_per_worker=4, sink=None, **kwargs):
+        """
+        Simulate the reactor for combinations of strain parameter sets, e.g.
+        drawn from ORACLE populations. The combinations are split in chunks
+        solved by the workers of the executor, the compiled ode function is
+        sent to each worker once per chunk and evaluated with the parameter
+        vectors of the combinations, no reparametrization of the strain
+        models is needed.
+
+        :param time_out: The times at which the solutions are evaluated
+        :param parameter_populations: dict of ParameterValuePopulation
+                                      indexed by the strain name
+        :param index: optional list of tuples with a sample id per
+                      population in the order of parameter_populations, by
+                      default all combinations of the samples
+        :param solver_type: see solve_ode
+        :param ncpu: number of workers, if None the current setting of the
+                     executor is kept
+        :param executor: optional executor, see get_executor
+        :param chunks_per_worker: number of chunks per worker, more chunks
+                                  balance the load of stiff combinations
+        :param sink: optional ODESolutionWriter each chunk is appended to as
+                     it is done, instead of returning the whole population.
+                     The fluxes of the sink are computed with the parameter
+                     vectors of the combinations, see link_parameter_index
+        :param kwargs: options of the solver
+        :return: ODESolutionPopulation indexed by the tuples of sample ids,
+                 None if a sink is given
+        """
+        if index is None:
+            index = list(product(*[list(p._index) for p in parameter_populations.values()]))
+        else:
+            index = [tuple(i) for i in index]
+
+        self.link_parameter_index()
+        parameters = self.get_parameter_array(parameter_populations, index)
+
+        ordered_initial_conditions = np.array([self.initial_conditions[variable]
+                                               for variable in self.variables],
+                                              dtype=np.float64)
+
+        kwargs.update({'old_api': False})
+        pool = self.get_executor(ncpu, executor)
+        num_workers = getattr(pool, 'ncpu', None) or 1
+        num_chunks = max(1, min(len(index), num_workers*chunks_per_worker))
+
+        solve_chunk = partial(solve_ode_chunk, self.ode_fun, solver_type, kwargs,
+                              np.asarray(time_out), ordered_initial_conditions)
+        chunks = np.array_split(parameters, num_chunks)
+
+        if sink is not None:
+            # Executors given as plain pools may only have a map method
+            imap = getattr(pool, 'imap', pool.map)
+            start = 0
+            for (species, lengths), chunk in zip(imap(solve_chunk, chunks), chunks):
+                stop = start + len(chunk)
+                block = ODESolutionPopulation.from_arrays(time_out, species,
+                                                          list(self.ode_fun.variables),
+                                                          index=index[start:stop],
+                                                          lengths=lengths)
+                sink.append(block, parameters=list(chunk))
+                start = stop
+            return None
+
+        results = pool.map(solve_chunk, chunks)
+
+        species = np.concatenate([s for s, _ in results])
+        lengths = np.concatenate([l for _, l in results])
+
+        return ODESolutionPopulation.from_arrays(time_out, species, list(self.ode_fun.variables),
+                                                 index=index, lengths=lengths)
+
+
+class ReplicatedReactor(Reactor):
+    """
+    Reactor compiling each distinct strain model only once. Strains sharing
+    a model object share its compiled kernel and only differ by their
+    parameters, the kernel is evaluated for all of them in one batched call.
+    Thus adding strains of an already compiled model costs no compilation.
+
+    The strain models are neither copied nor renamed, the intracellular
+    variables and the parameters of a strain are named strain_reactant and
+    strain_parameter in the reactor.
+    """
+    def __init__(self,
+                 strains,
+                 biomass_reactions,
+                 biomass_scaling,
+                 boundary_conditions=None,
+                 extracellular_compartment='e',
+                 ):
+        """
+
+        :param strains: dict of the strain models indexed by the strain name
+        :param biomass_reactions: dict of the biomass reaction of each strain
+        :param biomass_scaling: dict of the biomass scaling of each strain
+        :param boundary_conditions:
+        :param extracellular_compartment:
+        """
+        self.extracellular_compartment = extracellular_compartment
+
+        self.strains = TabDict([])
+        self.strain_parameters = TabDict([])
+        self.models = TabDict([])
+        self.medium = TabDict([])
+        self.biomass_variables = TabDict([])
+        self.biomass_reactions = dict()
+        self.biomass_scaling = dict()
+
+        # Compiled kernels indexed by the model, its own structure version and
+        # the compile options
+        self.strain_kernels = dict()
+        self.backend = GCC
+
+        # Structure versions of the strain models the ode function was
+        # compiled at, the shared models can change after the compilation
+        self._compiled_versions = dict()
+
+        self.boundary_conditions = iterable_to_tabdict(boundary_conditions)
+        self.initial_conditions = iterable_to_tabdict([])
+        self.custom_variables = iterable_to_tabdict([])
+
+        # Batch operation if None, only modes without custom variables
+        self.operation = None
+
+        # Executor for the code generation, created on first use
+        self._executor = None
+
+        # Canonical parameter ordering, see link_parameter_index
+        self.parameter_index = None
+        self._linked_functions = WeakSet()
+
+        for name, model in strains.items():
+            self.add_strain(name, model, biomass_reactions[name], biomass_scaling[name])
+
+    def add_strain(self, name, model, biomass_reaction, biomass_scaling):
+        """
+        Add a strain to the reactor, the parameters of the strain are
+        initialized with the current values of the model parameters
+
+        :param name: name of the strain
+        :param model: KineticModel of the strain
+        :param biomass_reaction: biomass reaction of the model
+        :param biomass_scaling:
+        :return:
+        """
+        if name in self.strains:
+            raise ValueError('Strain {} already exists in the reactor'.format(name))
+
+        if not any(model is m for m in self.models.values()):
+            if model.name in self.models:
+                raise ValueError('Distinct strain models need distinct names, '
+                                 '{} is already used'.format(model.name))
+
+            model.boundary_conditions.clear()
+            model.update()
+            self.models[model.name] = model
+
+            for the_reactant in get_medium(model, extracellular_compartment=
+                                           self.extracellular_compartment):
+                if the_reactant.name not in self.medium:
+                    self.medium[the_reactant.name] = the_reactant
+        else:
+            for other, other_model in self.strains.items():
+                if other_model is model \
+                        and self.biomass_reactions[other].name != biomass_reaction.name:
+                    raise ValueError('Strains of the same model need the same '
+                                     'biomass reaction')
+
+        self.strains[name] = model
+        self.strain_parameters[name] = TabDict([(str(p.symbol), p.value)
+                                                for p in model.parameters.values()])
+        self.biomass_reactions[name] = biomass_reaction
+        self.biomass_scaling[name] = biomass_scaling
+
+        biomass = Reactant('biomass_{}'.format(name), model=model)
+        self.biomass_variables[biomass.name] = biomass
+
+        self._modified = True
+
+    @property
+    def variables(self):
+        variables = copy(self.biomass_variables)
+        variables.update(self.medium)
+        for strain, this_model in self.strains.items():
+            variables.update(TabDict([('{}_{}'.format(strain, k), v)
+                                      for k, v in this_model.reactants.items()
+                                      if k not in self.medium]))
+        return variables
+
+    @property
+    def parameters(self):
+        """
+        :return: TabDict of the parameter values indexed by strain_parameter
+        """
+        return TabDict([('{}_{}'.format(strain, k), v)
+                        for strain, values in self.strain_parameters.items()
+                        for k, v in values.items()])
+
+    def parametrize(self, value_dict, model_name):
+        """
+        Set the parameters of a strain, no recompilation is needed
+        :param value_dict:
+        :param model_name: name of the strain
+        :return:
+        """
+        values = self.strain_parameters[model_name]
+        for key, value in value_dict.items():
+            if str(key) in values:
+                values[str(key)] = value
+
+    @property
+    def strain_names(self):
+        return list(self.strains.keys())
+
+    def get_strain_parameters(self, strain):
+        return TabDict([(k, '{}_{}'.format(strain, k))
+                        for k in self.strain_parameters[strain]])
+
+    def update_strain_parameters(self, model):
+        """
+        Follow the parameters of a strain model after a structural change,
+        the new parameters are initialized with the current values of the
+        model parameters and the removed ones are dropped
+        :param model: KineticModel of the strains
+        :return:
+        """
+        for strain, this_model in self.strains.items():
+            if this_model is model:
+                values = self.strain_parameters[strain]
+                self.strain_parameters[strain] = TabDict(
+                    [(str(p.symbol), values.get(str(p.symbol), p.value))
+                     for p in model.parameters.values()])
+
+    def get_parameter_vector(self, allow_missing=False):
+        return self.parameter_index.to_vector(self.parameters,
+                                              allow_missing=allow_missing)
+
+    def set_operation(self, operation):
+        if operation is not None and operation.custom_variables:
+            raise NotImplementedError('The replicated reactor only supports '
+                                      'operation modes at constant volume')
+        Reactor.set_operation(self, operation)
+
+    def compile_ode(self, *args, **kwargs):
+        # Structural changes of the shared strain models are not seen by the
+        # reactor, they change the structure versions of the models
+        versions = {k: v.structure_version for k, v in self.models.items()}
+        if self._compiled_versions != versions:
+            self._modified = True
+        Reactor.compile_ode(self, *args, **kwargs)
+        self._compiled_versions = versions
+
+    def _make_ode_fun(self, sim_type, **kwargs):
+        return make_replicated_reactor_ode_fun(self, sim_type, **kwargs)
+
 
 def make_reactor_ode_fun(reactor, sim_type, pool=None, add_dilution=False,
-                         custom_ode_update=None):
+                         custom_ode_update=None, custom_ode_terms=None):
     """
     This function generates the symbolic expressions for a reactor model
 
     :param reactor:
     :param sim_type:
     :param pool:
+    :param custom_ode_terms: optional dict of sympy expressions indexed by
+                             variable name, see add_custom_ode_terms
     :return:
     """
 
@@ -346,6 +788,17 @@ def make_reactor_ode_fun(reactor, sim_type, pool=None, add_dilution=False,
         for this_constraint in model.constraints.values():
             this_constraint(expr)
 
+    with_time = add_custom_ode_terms(expr, custom_ode_terms, variables,
+                                     parameters_list, reactor.parameters)
+
+    # Parameters that become variables in the operation mode, e.g. the volume
+    if reactor.operation is not None:
+        substitutions = reactor.operation.get_substitutions(reactor)
+        for k in expr:
+            expr[k] = sympify(expr[k]).xreplace(substitutions)
+        for this_parameter in substitutions:
+            parameters_list.pop(str(this_parameter), None)
+
     # Apply boundary conditions. Boundaries are modifiers that act on
     # expressions
 
@@ -354,7 +807,173 @@ def make_reactor_ode_fun(reactor, sim_type, pool=None, add_dilution=False,
 
     # Make vector function from expressions
     ode_fun = ODEFunction(reactor, variables, expr, parameters_list, pool=pool,
+                          with_time=with_time,
                           custom_ode_update=custom_ode_update)
 
     return ode_fun, variables
 
+
+def make_replicated_reactor_ode_fun(reactor, sim_type, pool=None, add_dilution=False,
+                                    custom_ode_update=None, custom_ode_terms=None):
+    """
+    Ode function of a ReplicatedReactor, the kernels of the strain models
+    that were compiled before with the same options and that did not change
+    since are reused
+
+    :param reactor: ReplicatedReactor
+    :param sim_type:
+    :param pool:
+    :param custom_ode_terms: optional dict of sympy expressions indexed by
+                             the name of a medium or biomass variable, see
+                             add_custom_ode_terms
+    :return:
+    """
+    kernels = []
+    for model in reactor.models.values():
+        strains = [k for k, v in reactor.strains.items() if v is model]
+        biomass_reaction = reactor.biomass_reactions[strains[0]]
+
+        key = (id(model), model.structure_version, sim_type, add_dilution,
+               reactor.backend, biomass_reaction.name)
+        if key not in reactor.strain_kernels:
+            # Drop the kernels of earlier versions of the model
+            for other in [k for k in reactor.strain_kernels
+                          if k[0] == key[0] and k[1] != key[1]]:
+                del reactor.strain_kernels[other]
+
+            reactor.strain_kernels[key] = make_strain_kernel(
+                model, biomass_reaction, sim_type,
+                extracellular_compartment=reactor.extracellular_compartment,
+                pool=pool, add_dilution=add_dilution, backend=reactor.backend)
+            reactor.update_strain_parameters(model)
+
+        kernels.append((reactor.strain_kernels[key], strains))
+
+    variables = reactor.variables
+    exchange_variables = TabDict([(k, variables[k].symbol)
+                                  for k in list(reactor.biomass_variables)
+                                  + list(reactor.medium)])
+    variables = TabDict([(k, exchange_variables[k]) if k in exchange_variables
+                         else (k, Symbol(k)) for k in variables])
+
+    # The medium and biomass variables change with the summed strain rates
+    expr = TabDict([(v, Symbol(STRAIN_RATE.format(k)))
+                    for k, v in exchange_variables.items()])
+
+    if custom_ode_terms is not None:
+        for name in custom_ode_terms:
+            if str(name) in variables and str(name) not in exchange_variables:
+                raise NotImplementedError('Custom terms of the replicated reactor '
+                                          'are limited to the medium and the biomass')
+
+    exchange_parameters = TabDict([])
+    add_custom_ode_terms(expr, custom_ode_terms, exchange_variables,
+                         exchange_parameters, reactor.parameters)
+
+    # Apply boundary conditions. Boundaries are modifiers that act on
+    # expressions
+    for this_boundary_condition in reactor.boundary_conditions.values():
+        reactant = getattr(this_boundary_condition, 'reactant', None)
+        if reactant is not None and reactant.symbol not in expr:
+            raise NotImplementedError('Boundary conditions of the replicated reactor '
+                                      'are limited to the medium')
+        this_boundary_condition(expr)
+
+    exchange_expressions = TabDict([(k, expr[v]) for k, v in exchange_variables.items()])
+
+    ode_fun = ReplicatedODEFunction(reactor, variables, kernels, exchange_expressions,
+                                    exchange_parameters,
+                                    custom_ode_update=custom_ode_update,
+                                    backend=reactor.backend)
+
+    return ode_fun, variables
+
+
+def make_strain_kernel(model, biomass_reaction, sim_type, extracellular_compartment='e',
+                       pool=None, add_dilution=False, backend=GCC):
+    """
+    Compile the mass balances of a strain model in its own names, the biomass
+    and the biomass scaling are the placeholders STRAIN_BIOMASS and
+    STRAIN_BIOMASS_SCALING
+
+    :param model: KineticModel of the strain
+    :param biomass_reaction: biomass reaction of the model
+    :param sim_type:
+    :return: StrainKernel
+    """
+    medium = iterable_to_tabdict(get_medium(model, extracellular_compartment=
+                                            extracellular_compartment))
+    medium_symbols = [m.symbol for m in medium.values()]
+
+    biomass = Symbol(STRAIN_BIOMASS)
+    biomass_scaling = Symbol(STRAIN_BIOMASS_SCALING)
+
+    medium_parameters = model.compartments[extracellular_compartment].parameters
+    volume_scaling_medium = medium_parameters.cell_volume.symbol / \
+                            medium_parameters.volume.symbol
+
+    all_data = get_expressions_from_model(model, sim_type,
+                                          medium_symbols=medium_symbols,
+                                          biomass_symbol=biomass*volume_scaling_medium)
+    all_expr, _, all_parameters = list(zip(*all_data))
+
+    # Keep the order of the parameters such that the code is cached
+    parameters = iterable_to_tabdict([p for these_parameters in all_parameters
+                                      for p in these_parameters], use_name=False)
+    for comp in model.compartments.values():
+        parameters.update(TabDict([(str(v.symbol), v.symbol)
+                                   for v in comp.parameters.values()]))
+
+    variables = TabDict([(STRAIN_BIOMASS, biomass)]
+                        + [(k, v.symbol) for k, v in model.reactants.items()])
+
+    volume_ratios = TabDict([(k, 1.0) if k in medium or k == STRAIN_BIOMASS
+                             else (k, model.reactants[k].compartment.parameters.cell_volume.symbol /
+                                   model.reactants[k].compartment.parameters.volume.symbol)
+                             for k in variables])
+
+    expr = make_expressions(variables, all_expr, volume_ratios=volume_ratios, pool=pool)
+
+    growth_rate_expression = biomass_reaction.mechanism.reaction_rates['v_net']
+    if add_dilution:
+        # Dilution for intracellular metabolites
+        for k, v in model.reactants.items():
+            if k not in medium:
+                expr[v.symbol] -= v.symbol*growth_rate_expression/biomass_scaling
+
+    expr[biomass] += biomass*growth_rate_expression/biomass_scaling
+
+    for this_constraint in model.constraints.values():
+        this_constraint(expr)
+
+    symbols = list(variables.values()) + list(parameters.values()) + [biomass_scaling]
+    function = make_function(symbols, [expr[v] for v in variables.values()],
+                             simplify=True, pool=pool, backend=backend)
+
+    return StrainKernel(function, list(variables), list(parameters))
+
+
+def solve_ode_chunk(ode_fun, solver_type, solver_options, time_out,
+                    initial_conditions, parameters):
+    """
+    Solve the ode for each parameter vector of a chunk, the worker evaluates
+    its own copy of the ode function
+
+    :param ode_fun: ODEFunction linked to a parameter index
+    :param parameters: (samples x parameters) array
+    :return: tuple of the (samples x time x variables) array, nan padded if
+             the integration stopped early, and the number of time points of
+             each solution
+    """
+    ode_fun = copy(ode_fun)
+    solver = ode(solver_type, ode_fun, **solver_options)
+
+    species = np.full((len(parameters), len(time_out), len(initial_conditions)), np.nan)
+    lengths = np.zeros(len(parameters), dtype=int)
+    for i, this_parameters in enumerate(parameters):
+        ode_fun.get_params(this_parameters)
+        solution = np.array(solver.solve(time_out, initial_conditions).values.y)
+        species[i, :len(solution)] = solution
+        lengths[i] = len(solution)
+
+    return species, lengths
@@ -27,28 +27,71 @@ limitations under the License.
 
 import numpy as np
 from ..viz.plotting import timetrace_plot, plot_population_per_variable
-from ..utils import TabDict,iterable_to_tabdict
+from ..utils import TabDict
 
 from copy import deepcopy
 
+import h5py
 import pandas as pd
 
 # Class for ode solutions
 class ODESolution:
-    def __init__(self, model, solution):
+    def __init__(self, model, solution, statistics=None, sensitivity_parameters=None):
+        """
+        :param sensitivity_parameters: parameters of the forward sensitivities
+                                       integrated after the variables, see
+                                       SensitivityFunction
+        """
         self.ode_solution = solution
+        # SolverStatistics if requested in solve_ode
+        self.statistics = statistics
 
         self.time    = np.array(solution.values.t)
 
         self.species = np.array(solution.values.y)
         self.names = [x for x in model.ode_fun.variables]
 
-        # TODO: Cleanup this
-        concentrations = iterable_to_tabdict([])
-        for this_species, this_name in zip(self.species.T, self.names):
-            concentrations[this_name] = this_species
+        # (time x variables x parameters) array of the sensitivities
+        self.sensitivity_parameters = sensitivity_parameters
+        self.sensitivities = None
+        if sensitivity_parameters is not None:
+            num_variables = len(self.names)
+            self.sensitivities = self.species[:, num_variables:].reshape(
+                len(self.time), num_variables, len(sensitivity_parameters))
+            self.species = self.species[:, :num_variables]
 
-        self.concentrations = pd.DataFrame.from_dict(concentrations, orient='columns')
+        self._concentrations = None
+
+    @property
+    def concentrations(self):
+        # The data frame is built on demand, it shares the species array
+        if self._concentrations is None:
+            self._concentrations = pd.DataFrame(self.species, columns=self.names)
+        return self._concentrations
+
+    def get_sensitivities(self, name):
+        """
+        :param name: name of a variable
+        :return: pd.DataFrame (time x parameters) of the sensitivities of the
+                 variable
+        """
+        if self.sensitivities is None:
+            raise ValueError("The solution has no sensitivities, see "
+                             "KineticModel.solve_ode")
+
+        return pd.DataFrame(self.sensitivities[:, self.names.index(name)],
+                            index=self.time, columns=self.sensitivity_parameters)
+
+    def fluxes(self, flux_fun, parameters=None):
+        """
+        Fluxes along the trajectory evaluated in one batched call
+
+        :param flux_fun: FluxFunction or GammaFunction (see make_flux_fun)
+        :param parameters: parameters of the flux function, see FluxFunction.batch
+        :return: pd.DataFrame (time x reactions)
+        """
+        fluxes = flux_fun.batch(self.concentrations, parameters)
+        return pd.DataFrame(fluxes, columns=flux_fun.reactions)
 
     def plot(self, filename='', **kwargs):
         timetrace_plot(self.time, self.species, filename, legend=self.names, **kwargs)
@@ -58,29 +101,367 @@ class ODESolution:
 
 
 class ODESolutionPopulation:
-
+    """
+    Population of ode solutions stored in one contiguous (sample x time x
+    species) array. The solutions share the time points, solutions that
+    stopped early are padded with nan. The long data frame used for plotting
+    is only built on demand.
+    """
     def __init__(self, list_of_solutions, index=None):
+        """
+        :param list_of_solutions: list of ODESolution
+        :param index: optional ids of the solutions, by default their position
+        """
+        names = list_of_solutions[0].names
+        time = max((s.time for s in list_of_solutions), key=len)
+
+        species = np.full((len(list_of_solutions), len(time), len(names)), np.nan)
+        lengths = np.zeros(len(list_of_solutions), dtype=int)
+        for i, this_solution in enumerate(list_of_solutions):
+            this_length = len(this_solution.time)
+            if this_solution.names != names \
+                    or not np.array_equal(this_solution.time, time[:this_length]):
+                raise ValueError("The solutions need the same variables and time points")
+            species[i, :this_length] = this_solution.species
+            lengths[i] = this_length
+
+        self._set_data(time, species, names, index, lengths)
+
+    @classmethod
+    def from_arrays(cls, time, species, names, index=None, lengths=None):
+        """
+        Population from the arrays without copying them
+
+        :param time: array of the time points
+        :param species: (sample x time x species) array
+        :param names: names of the species
+        :param index: optional ids of the solutions
+        :param lengths: optional number of valid time points per solution
+        :return: ODESolutionPopulation
+        """
+        population = cls.__new__(cls)
+        population._set_data(np.asarray(time), np.asarray(species), list(names),
+                             index, lengths)
+        return population
+
+    def _set_data(self, time, species, names, index, lengths):
+        if species.shape != (species.shape[0], len(time), len(names)):
+            raise ValueError("The species array needs the shape "
+                             "(sample x time x species)")
+
+        self.time = time
+        self.species = species
+        self.names = names
+        self.index = list(range(species.shape[0])) if index is None else list(index)
+        self.lengths = np.full(species.shape[0], len(time), dtype=int) \
+            if lengths is None else np.asarray(lengths)
+
+        self._name_ix = {k: i for i, k in enumerate(names)}
+        self._sample_ix = {k: i for i, k in enumerate(self.index)}
+
+    def __len__(self):
+        return self.species.shape[0]
+
+    def get_variable(self, name):
+        """
+        :param name: name of a species
+        :return: view (sample x time) of the trajectories of the species
+        """
+        return self.species[:, :, self._name_ix[name]]
+
+    def get_sample(self, sample_id):
+        """
+        :param sample_id: id of a solution
+        :return: view (time x species) of the solution
+        """
+        return self.species[self._sample_ix[sample_id]]
 
-        sol_cols = list(list_of_solutions[0].concentrations.keys())
-        self.data = pd.DataFrame(columns=['solution_id', 'time']+sol_cols)
+    def to_frame(self):
+        """
+        Long data frame with the columns solution_id, time and the species
 
-        temp = []
-        if index is None:
-            for e, td in enumerate(list_of_solutions):
-                new_block = pd.DataFrame.from_dict(td.concentrations.copy())
-                new_block['time'] = td.time
-                new_block['solution_id'] = e
-                temp.append(new_block)
+        :return: pd.DataFrame
+        """
+        num_samples, num_time, num_species = self.species.shape
 
-        else:
-            for e, td in zip(index,list_of_solutions):
-                new_block = pd.DataFrame.from_dict(td.concentrations.copy())
-                new_block['time'] = td.time
-                new_block['solution_id'] = e
-                temp.append(new_block)
+        data = pd.DataFrame(self.species.reshape(num_samples*num_time, num_species),
+                            columns=self.names)
+        data.insert(0, 'time', np.tile(self.time, num_samples))
+        # Tuples of sample ids are kept as ids
+        index = pd.Series(self.index, dtype=object).values
+        data.insert(0, 'solution_id', np.repeat(index, num_time))
 
-        self.data = pd.concat(temp, axis = 0)
+        # Drop the padding of the solutions that stopped early
+        valid = (np.arange(num_time)[np.newaxis, :] < self.lengths[:, np.newaxis]).ravel()
+        if not valid.all():
+            data = data[valid]
+
+        return data
+
+    @property
+    def data(self):
+        return self.to_frame()
 
     def plot(self, filename, variables=None, **kwargs):
         plot_population_per_variable(self.data, filename, variables=variables, **kwargs)
 
+    def save(self, filename, **kwargs):
+        """
+        Saves the population as chunked hdf5 file, see ODESolutionWriter
+
+        :param filename: string XXX.h5 / XXX.hdf5
+        """
+        with ODESolutionWriter(filename, self.names, self.time, **kwargs) as writer:
+            writer.append(self)
+
+
+class StochasticSolution:
+    """
+    Realizations of a stochastic simulation and their mean and standard
+    deviation over time. The realizations are kept as ODESolutionPopulation.
+    """
+    def __init__(self, time, names, species, method=None):
+        """
+        :param time: array of the time points
+        :param names: names of the species
+        :param species: (realization x time x species) array
+        :param method: simulation method, SSA or TAU_LEAPING
+        """
+        self.realizations = ODESolutionPopulation.from_arrays(time, species, names)
+        self.time = self.realizations.time
+        self.names = self.realizations.names
+        self.method = method
+
+        ddof = 1 if len(species) > 1 else 0
+        self.mean = pd.DataFrame(species.mean(axis=0), index=self.time, columns=self.names)
+        self.std = pd.DataFrame(species.std(axis=0, ddof=ddof), index=self.time,
+                                columns=self.names)
+
+    def __len__(self):
+        return len(self.realizations)
+
+    def quantile(self, q):
+        """
+        :param q: quantile between 0 and 1
+        :return: pd.DataFrame (time x species) of the quantile over the
+                 realizations
+        """
+        return pd.DataFrame(np.quantile(self.realizations.species, q, axis=0),
+                            index=self.time, columns=self.names)
+
+    def plot(self, filename='', **kwargs):
+        timetrace_plot(self.time, self.mean.values, filename, legend=self.names, **kwargs)
+
+
+class ODESolutionWriter:
+    """
+    Output sink appending ode solutions to a chunked and compressed hdf5
+    file with the datasets species (sample x time x species), time, names,
+    index and lengths. If a flux function is given the fluxes recomputed from
+    the trajectories are written as fluxes (sample x time x reaction).
+    Only the appended block is held in memory and the file is only open
+    while a block is appended, such that process workers started meanwhile
+    do not hold it.
+    """
+    def __init__(self, filename, names, time, flux_fun=None, parameters=None,
+                 chunk_samples=1, chunk_species=64, chunk_bytes=2**20,
+                 compression='gzip', compression_opts=4):
+        """
+        :param filename: string XXX.h5 / XXX.hdf5, an existing file is overwritten
+        :param names: names of the species in the order of the solutions
+        :param time: time points shared by the solutions
+        :param flux_fun: optional FluxFunction (see make_flux_fun)
+        :param parameters: parameters of the flux function for the solutions
+                           appended without parameters
+        :param chunk_samples: number of samples per chunk, a single solution
+                              appended to a larger chunk rewrites the chunk
+        :param chunk_species: number of species per chunk, reading a single
+                              species only reads the chunks containing it
+        :param chunk_bytes: maximal size of a chunk, the time axis is split
+                            such that the chunks fit in the chunk cache of
+                            h5py (1 MB by default)
+        """
+        self.filename = filename
+        self.names = list(names)
+        self.time = np.array(time)
+        self.flux_fun = flux_fun
+        self.parameters = parameters
+        self.num_samples = 0
+        self.flux_names = None if flux_fun is None else list(flux_fun.reactions)
+
+        with h5py.File(filename, 'w') as fid:
+            self._create_datasets(fid, chunk_samples, chunk_species, chunk_bytes,
+                                  compression, compression_opts)
+
+    def _create_datasets(self, fid, chunk_samples, chunk_species, chunk_bytes,
+                         compression, compression_opts):
+        string_dt = h5py.special_dtype(vlen=str)
+
+        fid.create_dataset('time', data=self.time)
+        fid.create_dataset('names', data=np.array(self.names, dtype=object),
+                           dtype=string_dt)
+        fid.create_dataset('index', shape=(0,), maxshape=(None,),
+                           dtype=string_dt, chunks=(max(chunk_samples, 16),))
+        fid.create_dataset('lengths', shape=(0,), maxshape=(None,),
+                           dtype=int, chunks=(max(chunk_samples, 16),))
+
+        options = dict(compression=compression, compression_opts=compression_opts,
+                       shuffle=True, fillvalue=np.nan)
+
+        def make_chunks(num_columns):
+            columns = max(min(chunk_species, num_columns), 1)
+            num_time = max(chunk_bytes // (8*chunk_samples*columns), 1)
+            return chunk_samples, max(min(num_time, len(self.time)), 1), columns
+
+        fid.create_dataset('species', shape=(0, len(self.time), len(self.names)),
+                           maxshape=(None, len(self.time), len(self.names)),
+                           dtype=np.float64, chunks=make_chunks(len(self.names)),
+                           **options)
+
+        if self.flux_names is not None:
+            fid.create_dataset('flux_names',
+                               data=np.array(self.flux_names, dtype=object),
+                               dtype=string_dt)
+            fid.create_dataset('fluxes', shape=(0, len(self.time), len(self.flux_names)),
+                               maxshape=(None, len(self.time), len(self.flux_names)),
+                               dtype=np.float64, chunks=make_chunks(len(self.flux_names)),
+                               **options)
+
+    def append(self, solution, sample_id=None, parameters=None):
+        """
+        Append an ODESolution or a whole ODESolutionPopulation
+
+        :param solution: ODESolution or ODESolutionPopulation
+        :param sample_id: id of an ODESolution, by default its position
+        :param parameters: parameters of the flux function, for a population
+                           a list with the parameters of each sample
+        """
+        if isinstance(solution, ODESolutionPopulation):
+            if parameters is None:
+                parameters = [None]*len(solution)
+            self._append_block(solution.names, solution.species, solution.lengths,
+                               solution.index, parameters)
+            return
+
+        num_time = len(solution.time)
+        if num_time > len(self.time) \
+                or not np.array_equal(solution.time, self.time[:num_time]):
+            raise ValueError("The solution needs the time points of the writer")
+
+        species = np.full((1, len(self.time), len(solution.names)), np.nan)
+        species[0, :num_time] = solution.species
+        sample_id = self.num_samples if sample_id is None else sample_id
+
+        self._append_block(solution.names, species, [num_time], [sample_id], [parameters])
+
+    def _append_block(self, names, species, lengths, index, parameters):
+        if list(names) != self.names or species.shape[1] != len(self.time):
+            raise ValueError("The solutions need the species and time points of the writer")
+
+        start = self.num_samples
+        stop = start + species.shape[0]
+
+        fluxes = None
+        if self.flux_names is not None:
+            fluxes = [self._compute_fluxes(x, n, p)
+                      for x, n, p in zip(species, lengths, parameters)]
+
+        with h5py.File(self.filename, 'a') as fid:
+            names = ['species', 'index', 'lengths'] + ([] if fluxes is None else ['fluxes'])
+            for name in names:
+                fid[name].resize(stop, axis=0)
+
+            fid['species'][start:stop] = species
+            fid['index'][start:stop] = np.array([str(x) for x in index], dtype=object)
+            fid['lengths'][start:stop] = lengths
+            if fluxes is not None:
+                fid['fluxes'][start:stop] = fluxes
+
+        self.num_samples = stop
+
+    def _compute_fluxes(self, species, length, parameters):
+        if parameters is None:
+            parameters = self.parameters
+
+        fluxes = np.full((len(self.time), len(self.flux_names)), np.nan)
+        concentrations = pd.DataFrame(species[:length], columns=self.names)
+        fluxes[:length] = self.flux_fun.batch(concentrations, parameters)
+        return fluxes
+
+    def close(self):
+        # The file is closed after every append
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ODESolutionFile:
+    """
+    Lazy reader of the files written by ODESolutionWriter, only the requested
+    slices are read from the disk
+    """
+    def __init__(self, filename):
+        self.file = h5py.File(filename, 'r')
+        self.species = self.file['species']
+        self.fluxes = self.file['fluxes'] if 'fluxes' in self.file else None
+
+        self.time = self.file['time'][:]
+        self.names = list(self.file['names'].asstr()[:])
+        self.index = list(self.file['index'].asstr()[:])
+        self.lengths = self.file['lengths'][:]
+        self.flux_names = list(self.file['flux_names'].asstr()[:]) \
+            if self.fluxes is not None else None
+
+        self._name_ix = {k: i for i, k in enumerate(self.names)}
+        self._sample_ix = {k: i for i, k in enumerate(self.index)}
+
+    def __len__(self):
+        return self.species.shape[0]
+
+    def get_variable(self, name, samples=slice(None)):
+        """
+        :param name: name of a species
+        :param samples: slice of the samples
+        :return: (sample x time) array of the trajectories of the species
+        """
+        return self.species[samples, :, self._name_ix[name]]
+
+    def get_flux(self, name, samples=slice(None)):
+        """
+        :param name: name of a reaction
+        :param samples: slice of the samples
+        :return: (sample x time) array of the fluxes of the reaction
+        """
+        if self.fluxes is None:
+            raise RuntimeError("The file contains no fluxes")
+        return self.fluxes[samples, :, self.flux_names.index(name)]
+
+    def get_sample(self, sample_id):
+        """
+        :param sample_id: id of a solution as string
+        :return: (time x species) array of the solution
+        """
+        return self.species[self._sample_ix[sample_id]]
+
+    def to_population(self, samples=slice(None)):
+        """
+        :param samples: slice of the samples
+        :return: ODESolutionPopulation of the samples
+        """
+        return ODESolutionPopulation.from_arrays(self.time, self.species[samples],
+                                                 self.names,
+                                                 index=self.index[samples],
+                                                 lengths=self.lengths[samples])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -44,3 +44,50 @@ class SteadyStateExperiment(object):
 
         return p_i
 
+
+
+class TimeCourseExperiment(object):
+    def __init__(self, data, var=1.0):
+        """
+        Measured time course of concentrations with normal errors, the loss
+        is the negative log likelihood of a trajectory up to a constant
+
+        :param data: pd.DataFrame of the measurements indexed by the time with
+                     a column per variable, nan if not measured
+        :param var: variance of the measurements, a scalar, a pd.Series
+                    indexed by variable or a pd.DataFrame shaped as data
+        """
+        self.data = data.sort_index()
+        self.var = var
+
+    @property
+    def time(self):
+        return self.data.index.values.astype(np.float64)
+
+    def _get_arrays(self, names):
+        data = self.data.reindex(columns=names).values
+        if isinstance(self.var, pd.DataFrame):
+            var = self.var.reindex(index=self.data.index, columns=names).values
+        elif isinstance(self.var, pd.Series):
+            var = np.tile(self.var.reindex(names).values, (len(data), 1))
+        else:
+            var = np.full(data.shape, float(self.var))
+        return data, var
+
+    def loss(self, species, names):
+        """
+        :param species: (time x variables) array of the trajectory at the
+                        time points of the experiment
+        :param names: names of the variables
+        :return: 1/2 sum of the squared weighted residuals
+        """
+        data, var = self._get_arrays(names)
+        return 0.5*np.nansum((species - data)**2/var)
+
+    def loss_gradient(self, species, names):
+        """
+        :return: (time x variables) array of the derivatives of the loss by
+                 the trajectory at the time points of the experiment
+        """
+        data, var = self._get_arrays(names)
+        return np.nan_to_num((species - data)/var)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+import pickle
+import shutil
+from copy import copy
+
+from skimpy.io.yaml import export_to_yaml, load_yaml_model
+from skimpy.core.kinmodel import COMPILED_FUNCTIONS, SYMBOLIC_ATTRIBUTES
+from skimpy.analysis.ode.utils import make_flux_fun
+from skimpy.utils.compile_sympy import CompiledFunction
+from skimpy.analysis.ode.symbolic_jacobian_fun import SymbolicJacobianFunction
+from skimpy.analysis.mca.volume_ratio_function import VolumeRatioFunction
+from skimpy.utils.tabdict import TabDict
+from skimpy.utils.namespace import *
+
+
+MODEL_FILE = 'model.yml'
+BUNDLE_FILE = 'bundle.pkl'
+
+# Results of KineticModel.prepare
+PREPARED_ATTRIBUTES = ['reduced_stoichiometry',
+                       'conservation_relation',
+                       'independent_variables_ix',
+                       'dependent_variables_ix',
+                       ]
+
+
+def export_compiled_bundle(kmodel, path):
+    """
+    Export a compiled model to a bundle directory containing the model yaml,
+    the prepared matrices, the variable and parameter orderings and the
+    shared objects of the compiled functions. The flux function is compiled
+    and attached to the model if it does not have one yet.
+
+    :param kmodel: KineticModel compiled with compile_ode and/or compile_mca
+    :param path: path of the bundle directory
+    """
+    if not hasattr(kmodel, 'ode_fun') \
+            and not hasattr(kmodel, 'independent_elasticity_fun'):
+        raise ValueError("The model needs to be compiled to export a bundle")
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    export_to_yaml(kmodel, os.path.join(path, MODEL_FILE))
+
+    sim_type = kmodel.sim_type if kmodel.sim_type is not None else QSSA
+
+    functions = dict()
+    for name in COMPILED_FUNCTIONS:
+        function = getattr(kmodel, name, None)
+
+        if name == 'flux_fun' and function is None:
+            kmodel.check_frozen('compiling the flux function')
+            function = make_flux_fun(kmodel, sim_type)
+            kmodel.flux_fun = function
+            kmodel.link_parameter_index(function)
+        # The jacobian of the MCA is rebuilt from the elasticity functions
+        if name == 'jacobian_fun' \
+                and not isinstance(function, SymbolicJacobianFunction):
+            continue
+        if function is None:
+            continue
+
+        functions[name] = _strip_function(function, path)
+
+    bundle = dict(functions=functions,
+                  sim_type=sim_type,
+                  backend=kmodel.backend,
+                  variables=list(kmodel.reactants),
+                  parameters=list(kmodel.parameters),)
+
+    if hasattr(kmodel, 'concentration_control_fun'):
+        bundle['mca_type'] = kmodel.concentration_control_fun.mca_type
+
+    for name in PREPARED_ATTRIBUTES:
+        if hasattr(kmodel, name):
+            bundle[name] = getattr(kmodel, name)
+
+    with open(os.path.join(path, BUNDLE_FILE), 'wb') as fid:
+        pickle.dump(bundle, fid, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_compiled_bundle(path):
+    """
+    Load a model from a bundle directory, the compiled functions are linked
+    directly such that neither the preparation nor the compilation have to
+    be repeated
+
+    :param path: path of the bundle directory
+    :return: KineticModel
+    """
+    kmodel = load_yaml_model(os.path.join(path, MODEL_FILE))
+
+    with open(os.path.join(path, BUNDLE_FILE), 'rb') as fid:
+        bundle = pickle.load(fid)
+
+    if list(kmodel.reactants) != bundle['variables']:
+        raise ValueError("The variables of the model in {} do not match the "
+                         "compiled functions".format(path))
+
+    kmodel.variables = TabDict([(k, v.symbol) for k, v in kmodel.reactants.items()])
+
+    if kmodel.compartments:
+        kmodel.volume_ratio_func = VolumeRatioFunction(kmodel,
+                                                       kmodel.variables,
+                                                       kmodel.parameters, )
+    else:
+        kmodel.volume_ratio_func = None
+
+    for name in PREPARED_ATTRIBUTES:
+        if name in bundle:
+            setattr(kmodel, name, bundle[name])
+
+    if 'dependent_variables_ix' in bundle:
+        kmodel.dependent_reactants = TabDict([kmodel.reactants.iloc(ix)
+                                              for ix in kmodel.dependent_variables_ix])
+
+    functions = bundle['functions']
+    for function in functions.values():
+        if isinstance(function.function, CompiledFunction):
+            function.function.path_to_so_file = os.path.join(path,
+                function.function.path_to_so_file)
+
+    kmodel._simtype = bundle['sim_type']
+    kmodel._backend = bundle.get('backend', GCC)
+
+    if 'independent_elasticity_fun' in functions:
+        kmodel.independent_elasticity_fun = functions['independent_elasticity_fun']
+        kmodel.dependent_elasticity_fun = functions.get('dependent_elasticity_fun')
+        kmodel.parameter_elasticities_fun = functions.get('parameter_elasticities_fun')
+        kmodel.displacement_function = functions.get('displacement_function')
+        kmodel.link_mca_functions(mca_type=bundle['mca_type'])
+
+    if 'ode_fun' in functions:
+        kmodel.ode_fun = functions['ode_fun']
+        kmodel.ode_fun.model = kmodel
+        kmodel.link_parameter_index(kmodel.ode_fun)
+
+        kmodel._modified = False
+        kmodel._recompiled = True
+
+        initial_conditions = TabDict([(x, 0.0) for x in kmodel.variables])
+        initial_conditions.update(kmodel.initial_conditions)
+        kmodel.initial_conditions = initial_conditions
+
+    kmodel.flux_fun = functions['flux_fun']
+    kmodel.flux_fun._parameter_values = {k: p.value for k, p in kmodel.parameters.items()}
+    kmodel.link_parameter_index(kmodel.flux_fun)
+
+    if 'jacobian_fun' in functions:
+        kmodel.jacobian_fun = functions['jacobian_fun']
+        kmodel.link_parameter_index(kmodel.jacobian_fun)
+
+    return kmodel
+
+
+def _strip_function(function, path):
+    """
+    Copy of a compiled function without its symbolic expressions, the shared
+    object is copied to the bundle and referenced by its file name. NumPy
+    functions are pickled with their source.
+    """
+    function = copy(function)
+    for attribute in SYMBOLIC_ATTRIBUTES:
+        if hasattr(function, attribute):
+            setattr(function, attribute, None)
+
+    if not isinstance(function.function, CompiledFunction):
+        return function
+
+    compiled = copy(function.function)
+    file_name = os.path.basename(compiled.path_to_so_file)
+    shutil.copyfile(compiled.path_to_so_file, os.path.join(path, file_name))
+    compiled.path_to_so_file = file_name
+    function.function = compiled
+
+    return function
@@ -25,6 +25,9 @@ limitations under the License.
 
 """
 
+import hashlib
+from copy import deepcopy
+
 import yaml
 from yaml.representer import SafeRepresenter
 from re import sub as re_sub
@@ -38,7 +41,9 @@ from skimpy.core import Item, Reactant, Parameter, Reaction, BoundaryCondition,
     ConstantConcentration, KineticModel, ExpressionModifier
 from skimpy.core.compartments import Compartment
 from skimpy.mechanisms import *
-from skimpy.utils.general import make_subclasses_dict, get_stoichiometry, get_all_reactants
+from skimpy.utils.general import make_subclasses_dict, get_stoichiometry, get_all_reactants, \
+    LRUCache
+from skimpy.utils.executor import make_executor
 from skimpy.utils.namespace import PARAMETER, VARIABLE
 
 
@@ -92,7 +97,7 @@ FIELDS_TO_SERIALIZE = [
 
 def parameter_representer(dumper, data):
     if data.value is not None:
-        return dumper.represent_float(data.value)
+        return dumper.represent_float(float(data.value))
     else:
         return  dumper.represent_none(data.value)
 
@@ -148,6 +153,8 @@ def refresh_representers():
     (n-to-m Convenience Kinetics for example)
     """
     yaml.add_representer(TabDict, SafeRepresenter.represent_dict)
+    # Registries and observed TabDicts of the models
+    yaml.add_multi_representer(TabDict, SafeRepresenter.represent_dict)
     yaml.add_representer(Reactant, reactant_representer)
     yaml.add_representer(Parameter, parameter_representer)
     yaml.add_representer(Reaction, reaction_representer)
@@ -164,7 +171,8 @@ def export_to_yaml(model, path=None, **kwargs):
     # In case new custom mechanisms have been made 
     refresh_representers()
 
-    dict_model = vars(model)
+    # Copy the attributes so that the model itself is left untouched
+    dict_model = dict(vars(model))
     # Add parameters that are properties
     dict_model['parameters'] = model.parameters
     dict_model['reactants'] = get_all_reactants(model)
@@ -232,10 +240,84 @@ def get_stoich(s):
     splitted = s.split('_')
     return [int(x.replace('m','-')) for x in splitted[1:]]
 
+# The C loader of libyaml is several times faster if available
+YAML_LOADER = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+# Parsed model files indexed by the hash of their content
+MODEL_CACHE_SIZE = 64
+model_file_cache = LRUCache(MODEL_CACHE_SIZE)
+
+
+def read_model_file(path):
+    """
+    :return: tuple of the hash and the content of a model file
+    """
+    with open(path, 'rb') as fid:
+        content = fid.read()
+    return hashlib.sha1(content).hexdigest(), content
+
+
+def parse_yaml_content(content):
+    return yaml.load(content, Loader=YAML_LOADER)
+
+
 def load_yaml_model(path):
-    with open(path,'r') as fid:
-        the_dict = yaml.full_load(fid)
+    """
+    Load a model from a yaml file, the parsed file is cached by its hash
+    such that loading the same file again only rebuilds the model
+
+    :param path: path to the yaml file
+    :return: KineticModel
+    """
+    return load_yaml_models([path])[0]
 
+
+def load_yaml_models(paths, ncpu=None, executor=None):
+    """
+    Load several models, the files that are not cached are parsed in
+    parallel. The models themselves are built in the calling process.
+
+    :param paths: paths to the yaml files
+    :param ncpu: number of workers parsing the files
+    :param executor: optional executor, see make_executor
+    :return: list of KineticModel
+    """
+    files = [read_model_file(path) for path in paths]
+
+    # The dicts of this call are kept here, the cache may evict them
+    # before the models are built
+    parsed = dict()
+    missing = dict()
+    for key, content in files:
+        the_dict = model_file_cache.lookup(key)
+        if the_dict is None:
+            missing[key] = content
+        else:
+            parsed[key] = the_dict
+
+    if missing:
+        if ncpu is None and executor is None:
+            dicts = [parse_yaml_content(content) for content in missing.values()]
+        else:
+            pool = make_executor(executor, ncpu)
+            dicts = pool.map(parse_yaml_content, list(missing.values()))
+            # Only the executors made here are shut down
+            if executor is None or isinstance(executor, str):
+                pool.close()
+
+        for key, the_dict in zip(missing, dicts):
+            parsed[key] = the_dict
+            model_file_cache.store(key, the_dict)
+
+    # The model construction consumes the dict
+    return [make_model_from_dict(deepcopy(parsed[key])) for key, _ in files]
+
+
+def make_model_from_dict(the_dict):
+    """
+    :param the_dict: dict of a parsed yaml model, it is modified
+    :return: KineticModel
+    """
     new = KineticModel(name = the_dict['name'])
 
     # Rebuild the reactions
@@ -27,7 +27,8 @@ limitations under the License.
 import numpy as np
 
 from sympy import symbols,Symbol
-from skimpy.utils.compile_sympy import make_cython_function
+from skimpy.utils.compile_sympy import make_function
+from skimpy.analysis.ode.utils import get_qssa_rate_expressions
 
 class FluxParameterFunction():
     def __init__(self,
@@ -35,17 +36,19 @@ class FluxParameterFunction():
                  parameters,
                  concentration_dict):
 
+        model.check_frozen('parameter sampling')
+
         self.sym_concentrations = [c for c in concentration_dict]
 
         self.sym_parameters = [p.symbol for p in parameters.values()
                                if p.symbol not in self.sym_concentrations ]
 
-        self.expressions = [ rxn.mechanism.reaction_rates['v_net']
-                             for rxn in model.reactions.values()]
+        self.expressions = [get_qssa_rate_expressions(rxn)[1]
+                            for rxn in model.reactions.values()]
 
         sym_vars = self.sym_parameters+self.sym_concentrations
-        self.function = make_cython_function(sym_vars, self.expressions, simplify=True,
-                                             pool=model.pool)
+        self.function = make_function(sym_vars, self.expressions, simplify=True,
+                                      pool=model.pool, backend=model.backend)
 
     def __call__(self,
                  model,
@@ -29,7 +29,7 @@ import numpy as np
 from numpy.random import sample
 
 from sympy import symbols,Symbol
-from skimpy.utils.compile_sympy import make_cython_function
+from skimpy.utils.compile_sympy import make_function
 
 class SaturationParameterFunction():
     """
@@ -73,7 +73,8 @@ class SaturationParameterFunction():
 
             # Create the cython function
             sym_vars = sym_saturations + self.sym_concentrations
-            self.function = make_cython_function(sym_vars, expressions, simplify=False, pool=model.pool)
+            self.function = make_function(sym_vars, expressions, simplify=False, pool=model.pool,
+                                          backend=model.backend)
 
 
     def __call__(self, saturations, parameters, concentrations, parameters_to_resample,
@@ -102,7 +102,7 @@ class SimpleParameterSampler(ParameterSampler):
             # Check stability: real part of all eigenvalues of the jacobian is
             # <= 0
             this_jacobian = compiled_model.jacobian_fun(fluxes, concentrations,
-                                                        parameter_sample)
+                                                        compiled_model.get_parameter_vector(parameter_sample))
 
             # largest_eigenvalue = eigenvalues(this_jacobian, k=1, which='LR',
             #                                  return_eigenvectors=False)
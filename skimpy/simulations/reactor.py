@@ -26,10 +26,12 @@ limitations under the License.
 """
 import yaml
 
-from skimpy.io.yaml import load_yaml_model
+from skimpy.io.yaml import load_yaml_models
 from skimpy.core import BoundaryCondition
 from skimpy.core.reactor import Reactor
+from skimpy.core.operation import Chemostat, FedBatch, make_feed_profile
 from skimpy.utils.general import make_subclasses_dict
+from skimpy.utils.namespace import *
 from skimpy.utils.tabdict import TabDict
 
 
@@ -37,10 +39,65 @@ def get_boundary_subclasses():
     return make_subclasses_dict(BoundaryCondition)
 
 
-def make_batch_reactor(path):
+def make_profile(value, time_scaling=1.0):
     """
+    :param value: rate as number or dict with the keys profile (see
+                  make_feed_profile), time and values
+    :param time_scaling: scaling of the time, the rates are divided and the
+                         time points multiplied by it as for the fluxes
+    :return: number or sympy expression of the time
+    """
+    if isinstance(value, dict):
+        return make_feed_profile(value.get('profile', PIECEWISE),
+                                 [float(x) * time_scaling for x in value['time']],
+                                 [float(x) / time_scaling for x in value['values']])
+    return float(value) / time_scaling
+
+
+def make_operation(the_dict, concentration_scaling=1.0, time_scaling=1.0):
+    """
+    Operation mode from the operation section of the reactor config, e.g.
+
+        operation:
+          mode: chemostat
+          dilution_rate: 0.1
+          feed:
+            glc_D_e: 0.12
+
+    For a fed_batch the feed_rate replaces the dilution_rate, both can be
+    profiles with the keys profile, time and values.
+
+    :param the_dict: dict of the operation section
+    :param concentration_scaling: scaling of the feed concentrations
+    :param time_scaling: scaling of the time of the rates and the profiles
+    :return: ReactorOperation or None for a batch reactor
+    """
+    mode = the_dict.get('mode', BATCH)
+    feed = {k: float(v) * concentration_scaling
+            for k, v in the_dict.get('feed', dict()).items()}
+
+    if mode == BATCH:
+        return None
+    elif mode == CHEMOSTAT:
+        return Chemostat(make_profile(the_dict['dilution_rate'], time_scaling),
+                         feed=feed)
+    elif mode == FED_BATCH:
+        return FedBatch(make_profile(the_dict['feed_rate'], time_scaling),
+                        feed=feed)
+    else:
+        raise ValueError('Operation mode {} is not recognized'.format(mode))
+
+
+def make_batch_reactor(path, ncpu=None, executor=None):
+    """
+    Reactor from a config yml file, the optional operation section sets a
+    chemostat or fed-batch mode (see make_operation)
 
     :param path: path to config yml file to setup reactor
+    :param ncpu: number of workers parsing the model files, the parsed files
+                 are cached such that e.g. a parameter scan rebuilding the
+                 reactor only parses them once
+    :param executor: optional executor, see make_executor
     :return:
     """
     with open(path,'r') as fid:
@@ -48,8 +105,9 @@ def make_batch_reactor(path):
 
     # Load models
     models = dict()
-    for name, file in the_dict['models'].items():
-        model =  load_yaml_model(file)
+    loaded_models = load_yaml_models(the_dict['models'].values(),
+                                     ncpu=ncpu, executor=executor)
+    for name, model in zip(the_dict['models'], loaded_models):
         model.name = name
         models[name] = model
 
@@ -86,11 +144,20 @@ def make_batch_reactor(path):
         the_bc = TheBoundaryCondition(reactant, **the_bc_dict)
         reactor.add_boundary_condition(the_bc)
 
+    # Operation mode
+    operation = make_operation(the_dict.get('operation', dict()),
+                               concentration_scaling=concentration_scaling,
+                               time_scaling=time_scaling)
+    reactor.set_operation(operation)
+
     # Init the reactor initial conditions in correct order
     reactor.initial_conditions = TabDict([(x,0.0) for x in reactor.variables])
     # Add medium:
     for met, conc in the_dict['initial_medium'].items():
         reactor.initial_conditions[met]  = float(conc) * concentration_scaling
+    # The reactor volume is the initial volume of a fed-batch
+    if operation is not None and operation.mode == FED_BATCH:
+        reactor.initial_conditions[operation.volume.name] = reactor_volume
 
     # Add scaling fator to the rectaor
     reactor.concentration_scaling = concentration_scaling
@@ -25,4 +25,5 @@ limitations under the License.
 
 """
 
-from .tabdict import TabDict,iterable_to_tabdict
+from .tabdict import TabDict,iterable_to_tabdict, ObservedTabDict, ReadOnlyTabDict, \
+    get_structure_version
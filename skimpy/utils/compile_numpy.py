@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIE CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+
+from sympy import Symbol, sympify, cse, numbered_symbols
+from sympy.printing.numpy import NumPyPrinter
+
+from skimpy.utils.compile_sympy import TEMPLATE_ARGUMENT
+
+# Names in the generated code
+INPUT = '_in_{}'
+TEMPLATE = '_template_{}'
+COMMON_SUBEXPRESSION = '_cse_'
+
+
+def make_numpy_function(symbols, expressions, simplify=True, rates=None):
+    """
+    Generate a NumPy function evaluating the expressions. Contrary to the
+    compiled functions no compiler is required and the inputs can be batched,
+    the function then evaluates all the columns of an (inputs x samples)
+    array at once.
+
+    :param symbols: input symbols
+    :param expressions: output expressions
+    :param simplify: use common sub expressions
+    :param rates: optional list of tuples (rate symbol, template, arguments),
+                  the templates are evaluated for all their instances at
+                  once, see make_templated_function
+    :return: NumpyFunction
+    """
+    printer = NumPyPrinter()
+    input_index = OrderedDict((str(e), i) for i, e in enumerate(symbols))
+    num_inputs = len(symbols)
+
+    header = []
+    body = []
+
+    if rates:
+        # Group the instances by template
+        templates = OrderedDict()
+        for k, (_, this_template, arguments) in enumerate(rates):
+            templates.setdefault(this_template, []).append((num_inputs + k, arguments))
+
+        body.append("work = numpy.empty(({},) + input_array.shape[1:])"
+                    .format(num_inputs + len(rates)))
+        body.append("work[:{}] = input_array".format(num_inputs))
+
+        for i, (this_template, instances) in enumerate(templates.items()):
+            # Only the arguments the template depends on are passed
+            this_template = sympify(this_template)
+            argument_ix = [j for j in range(len(instances[0][1]))
+                           if Symbol(TEMPLATE_ARGUMENT.format(j)) in this_template.free_symbols]
+            header += make_numpy_template_code(TEMPLATE.format(i), this_template,
+                                               argument_ix, simplify, printer)
+
+            input_ix = [[input_index[str(arguments[j])] for j in argument_ix]
+                        for _, arguments in instances]
+            output_ix = [output for output, _ in instances]
+            header.append("tix_{} = numpy.array({}, dtype=int).reshape({}, {})"
+                          .format(i, input_ix, len(instances), len(argument_ix)))
+            header.append("tout_{} = numpy.array({}, dtype=int)".format(i, output_ix))
+
+            body.append("work[tout_{0}] = {1}(*work[tix_{0}].swapaxes(0, 1))"
+                        .format(i, TEMPLATE.format(i)))
+
+        body.append("input_array = work")
+
+        # The outputs read the rates behind the inputs
+        input_index.update((str(x), num_inputs + k) for k, (x, _, _) in enumerate(rates))
+
+    expressions = [sympify(e) for e in expressions]
+
+    # Replace the inputs by valid names
+    used = set().union(*[e.free_symbols for e in expressions])
+    placeholders = {x: Symbol(INPUT.format(input_index[str(x)])) for x in used}
+    expressions = [e.xreplace(placeholders) for e in expressions]
+
+    body += ["{} = input_array[{}]".format(x, input_index[str(k)])
+             for k, x in sorted(placeholders.items(), key=lambda i: input_index[str(i[0])])]
+
+    if simplify:
+        common, expressions = cse(expressions,
+                                  symbols=numbered_symbols(COMMON_SUBEXPRESSION))
+        body += ["{} = {}".format(x, printer.doprint(e)) for x, e in common]
+
+    body += ["output_array[{}] = {}".format(i, printer.doprint(e))
+             for i, e in enumerate(expressions)]
+
+    source = "\n".join(header) + "\n" \
+             + "def function(input_array, output_array):\n    " \
+             + "\n    ".join(body + ["return output_array"]) + "\n"
+
+    return NumpyFunction(source, symbols, len(expressions))
+
+
+def make_numpy_template_code(name, template, argument_ix, simplify, printer):
+    """
+    Code of a function evaluating a rate template on arrays of its arguments
+
+    :param name: name of the function
+    :param template: expression in the placeholder arguments
+    :param argument_ix: positions of the placeholder arguments of the function
+    :return: list of code lines
+    """
+    arguments = [TEMPLATE_ARGUMENT.format(i) for i in argument_ix]
+    lines = ["def {}({}):".format(name, ", ".join(arguments))]
+
+    if simplify:
+        common, (template,) = cse([template],
+                                  symbols=numbered_symbols(COMMON_SUBEXPRESSION))
+        lines += ["    {} = {}".format(x, printer.doprint(e)) for x, e in common]
+
+    lines.append("    return {}".format(printer.doprint(template)))
+    return lines
+
+
+class NumpyFunction(object):
+    """
+    Picklable NumPy function with the call signature of CompiledFunction.
+    Only the generated source is serialized, it is executed on the first
+    call. Inputs of shape (inputs, samples) give outputs of shape
+    (outputs, samples).
+    """
+    def __init__(self, source, symbols, num_outputs):
+        self.source = source
+        self.symbols = tuple(str(x) for x in symbols)
+        self.num_outputs = num_outputs
+        self._function = None
+
+    # The templates are evaluated on a work array of the generated code
+    num_work = 0
+
+    @property
+    def num_inputs(self):
+        return len(self.symbols)
+
+    def make_input_buffer(self, num_samples=None):
+        """
+        Zero input buffer, see CompiledFunction.make_input_buffer
+        """
+        return np.zeros(self.num_inputs if num_samples is None
+                        else (num_samples, self.num_inputs))
+
+    def load(self):
+        namespace = {'numpy': np}
+        exec(compile(self.source, '<skimpy numpy function>', 'exec'), namespace)
+        self._function = namespace['function']
+        return self._function
+
+    def __call__(self, input_array, output_array):
+        function = self._function
+        if function is None:
+            function = self.load()
+
+        input_array = np.asarray(input_array, dtype=np.float64)
+        return function(input_array, output_array)
+
+    def bind(self, input_array):
+        """
+        Bind the function to an input buffer, see CompiledFunction.bind
+
+        :param input_array: np.array of float64
+        :return: callable kernel(output_array)
+        """
+        function = self._function
+        if function is None:
+            function = self.load()
+
+        return partial(function, input_array)
+
+    def batch(self, input_array, output_array):
+        """
+        Evaluate the function for each row of the input array, see
+        CompiledFunction.batch
+
+        :param input_array: (samples x inputs) array
+        :param output_array: (samples x outputs) array
+        """
+        self(np.asarray(input_array).T, output_array.T)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_function'] = None
+        return state
+
+    def __repr__(self):
+        return "{}({} inputs, {} outputs)".format(self.__class__.__name__,
+                                                 self.num_inputs,
+                                                 self.num_outputs)
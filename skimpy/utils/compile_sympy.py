@@ -26,16 +26,27 @@ limitations under the License.
 """
 
 import ctypes
+import getpass
 import re
 import os
+import shutil
+import stat
+import hashlib
+import subprocess
 
 import numpy as np
 
 import tempfile
+import time
+
+from collections import OrderedDict
 
-import multiprocessing
 from sympy.printing import ccode
-from sympy import Symbol
+from sympy import Symbol, sympify, cse, numbered_symbols, count_ops
+
+from skimpy.utils.general import LRUCache
+from skimpy.utils.namespace import GCC, NUMPY
+from skimpy.utils.profiling import active_report, phase, count
 
 
 """
@@ -48,6 +59,28 @@ But as sympy code printer directly prints C-code we should use this to generate
 
 # This should be plat form depednent using distrtools
 COMPILER = "gcc -fPIC -shared -w -O3"
+OBJECT_COMPILER = "gcc -fPIC -w -O3 -c"
+
+# Compiled blocks and shared objects are cached by the hash of their code in
+# a private directory of the user, see get_cache_dir
+CACHE_DIR = os.environ.get('SKIMPY_CACHE_DIR',
+                           os.path.join(tempfile.gettempdir(), 'skimpy_cache_{}'.format(
+                               os.getuid() if hasattr(os, 'getuid') else getpass.getuser())))
+
+# Maximal size of the cache in bytes, the least recently used files are
+# removed when new functions are compiled
+CACHE_MAX_SIZE = int(os.environ.get('SKIMPY_CACHE_MAX_SIZE', 2**30))
+# Files used more recently (in seconds) are never removed, they may be linked
+# by a concurrent compilation
+CACHE_MIN_AGE = 60
+
+# The output rows are split in blocks at content defined boundaries, such that
+# adding or changing an expression only changes the blocks around it
+BLOCK_BOUNDARY = 16
+BLOCK_MAX_SIZE = 64
+
+# Maximal number of expressions kept in the code cache
+CODE_CACHE_SIZE = 2**16
 
 # Test to write our own compiler
 INCLUDE = "#include <stdlib.h>\n" \
@@ -56,41 +89,351 @@ INCLUDE = "#include <stdlib.h>\n" \
 FUNCTION_DEFINITION_HEADER = "void function(double *input_array, double *output_array){ \n"
 FUNCTION_DEFINITION_FOOTER = ";\n}"
 
-def make_cython_function(symbols, expressions, quiet=True, simplify=True, optimize=False, pool=None):
-
-    code_expressions = generate_vectorized_code(symbols,
-                                                expressions,
-                                                simplify=simplify,
-                                                pool=pool)
-
+# Evaluates the function on the rows of (samples x inputs) and (samples x outputs) arrays
+BATCH_FUNCTION_DEFINITION = "void function_batch(double *input_array, double *output_array, " \
+                            "int num_samples, int num_inputs, int num_outputs){\n" \
+                            "int _s;\n" \
+                            "for (_s = 0; _s < num_samples; _s++) " \
+                            "function(input_array + _s*num_inputs, output_array + _s*num_outputs);\n" \
+                            "}\n"
+
+BLOCK_PROTOTYPE = "void {}(const double *input_array, const int *input_ix, double *output_array)"
+
+OUTPUT = '__output__'
+
+# Placeholder arguments of the rate templates
+TEMPLATE_ARGUMENT = '_x_{}'
+
+
+# Code lines indexed by the expression and the simplify flag
+code_cache = LRUCache(CODE_CACHE_SIZE)
+
+
+def make_function(symbols, expressions, simplify=True, pool=None, backend=GCC, rates=None):
+    """
+    Make a function evaluating the expressions with the given backend
+
+    :param symbols: input symbols
+    :param expressions: output expressions
+    :param simplify: use common sub expressions
+    :param pool: optional pool to generate the missing lines
+    :param backend: GCC compiles the expressions to a shared object, NUMPY
+                    generates a vectorized python function
+    :param rates: optional list of rates to evaluate with one template per
+                  mechanism, see make_templated_function
+    :return: CompiledFunction or NumpyFunction
+    """
+    if backend == NUMPY:
+        # Imported here as the numpy backend uses the placeholders of this module
+        from skimpy.utils.compile_numpy import make_numpy_function
+        with phase('numpy code generation'):
+            function = make_numpy_function(symbols, expressions, simplify=simplify, rates=rates)
+        count('python code bytes', len(function.source))
+        return function
+    elif backend != GCC:
+        raise ValueError('Backend {} is not recognized'.format(backend))
+
+    if rates is None:
+        return make_cython_function(symbols, expressions, simplify=simplify, pool=pool)
+    else:
+        return make_templated_function(symbols, expressions, rates,
+                                       simplify=simplify, pool=pool)
 
-    # Write the code to a temp file
-    code = INCLUDE + FUNCTION_DEFINITION_HEADER + code_expressions + FUNCTION_DEFINITION_FOOTER
-    path_to_c_file = write_code_to_tempfile(code)
-    path_to_so_file = path_to_c_file.replace('.c', '.so')
 
-    # Compile the code
-    cmd = " ".join([COMPILER, '-o ',path_to_so_file, path_to_c_file] )
-    # Todo catch errors
-    # Todo catch errors
-    os.system(cmd)
+def make_cython_function(symbols, expressions, quiet=True, simplify=True, optimize=False, pool=None):
 
-    # Import the function
-    fun = ctypes.CDLL(path_to_so_file)
+    # Generate the position independent code for each expression, only the
+    # expressions that are not yet in the cache are translated
+    code_lines = generate_code_lines(expressions, simplify=simplify, pool=pool)
+
+    # Input substitution dict
+    input_index = {str(e): i for i, e in enumerate(symbols)}
+
+    with phase('code blocks'):
+        blocks = [make_code_block(rows, input_index)
+                  for rows in split_code_lines(code_lines)]
+
+    # Compile the blocks that are not cached and link them
+    path_to_so_file = compile_and_link(blocks)
+
+    return CompiledFunction(path_to_so_file, symbols, len(code_lines))
+
+
+class CompiledFunction(object):
+    """
+    Picklable handle of a compiled function. Only the path and the content
+    hash of the shared object, the ordering of the input symbols and the
+    number of outputs are serialized, the shared object is opened lazily on
+    the first call. Thus the handle can be sent cheaply to worker processes.
+
+    Templated functions write intermediate values to a work space of
+    num_work entries behind the inputs, the input buffers of bound kernels
+    are made with make_input_buffer such that no memory is allocated per call.
+    """
+    def __init__(self, path_to_so_file, symbols, num_outputs, num_work=0):
+        self.path_to_so_file = path_to_so_file
+        self.file_hash = hash_file(path_to_so_file)
+        self.symbols = tuple(str(x) for x in symbols)
+        self.num_outputs = num_outputs
+        self.num_work = num_work
+        self._library = None
+        self._function = None
+        self._batch_function = None
+
+    @property
+    def num_inputs(self):
+        return len(self.symbols)
+
+    def make_input_buffer(self, num_samples=None):
+        """
+        :param num_samples: optional number of rows for batched calls
+        :return: zero buffer of the inputs followed by the work space, of
+                 shape (inputs + work) or (samples x (inputs + work))
+        """
+        size = self.num_inputs + self.num_work
+        return np.zeros(size if num_samples is None else (num_samples, size))
+
+    def load(self):
+        """
+        Open the shared object, if it does not exist anymore at its original
+        location it is looked up by its name in the cache of this process.
+        Only a file with the content hash recorded at compilation is loaded.
+        """
+        path_to_so_file = self.path_to_so_file
+        if not os.path.exists(path_to_so_file):
+            path_to_so_file = os.path.join(get_cache_dir(), os.path.basename(path_to_so_file))
+        if not os.path.exists(path_to_so_file):
+            raise IOError("Shared object {} not found, the function needs to be "
+                          "recompiled".format(self.path_to_so_file))
+
+        if hash_file(path_to_so_file) != self.file_hash:
+            raise RuntimeError("Shared object {} differs from the compiled "
+                               "function, it is not loaded".format(path_to_so_file))
+
+        with phase('dlopen'):
+            self._library = ctypes.CDLL(path_to_so_file)
+        self._function = self._library.function
+        # Raw addresses are cheaper to convert than typed pointers
+        self._function.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        self._function.restype = None
+
+        self._batch_function = self._library.function_batch
+        self._batch_function.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
+                                         ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        self._batch_function.restype = None
+
+        return self._function
+
+    def __call__(self, input_array, output_array):
+        function = self._function
+        if function is None:
+            function = self.load()
 
-    def this_function(input_array,output_array):
-        # Input pointers
-        fun.function.argtypes = [ctypes.POINTER(ctypes.c_double),
-                                 ctypes.POINTER(ctypes.c_double),]
         #Cast to numpy float
-        if not type(input_array) ==  np.ndarray.dtype:
-            input_array = np.array(input_array, dtype=np.float)
-
-        #x.ctypes.data_as(ctypes.POINTER(ctypes.c_long))
-        fun.function(input_array.ctypes.data_as(ctypes.POINTER(ctypes.c_double)) ,
-                     output_array.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), )
+        input_array = np.ascontiguousarray(input_array, dtype=np.float64)
+        if input_array.size < self.num_inputs + self.num_work:
+            buffer = self.make_input_buffer()
+            buffer[:self.num_inputs] = input_array
+            input_array = buffer
+
+        function(input_array.ctypes.data, output_array.ctypes.data)
+
+    def bind(self, input_array):
+        """
+        Bind the function to an input buffer, the returned kernel only takes
+        the output array and reads the current content of the buffer. The
+        buffer and the output arrays need to be contiguous float64 arrays and
+        the buffer must be kept alive by the caller.
+
+        :param input_array: np.array of float64 from make_input_buffer
+        :return: callable kernel(output_array)
+        """
+        function = self._function
+        if function is None:
+            function = self.load()
+
+        if input_array.size < self.num_inputs + self.num_work:
+            raise ValueError("The input buffer needs {} entries for the inputs "
+                             "and the work space, see make_input_buffer"
+                             .format(self.num_inputs + self.num_work))
+
+        input_pointer = input_array.ctypes.data
+
+        def kernel(output_array):
+            function(input_pointer, output_array.ctypes.data)
+
+        return kernel
+
+    def batch(self, input_array, output_array):
+        """
+        Evaluate the function for each row of the input array in one native call
+
+        :param input_array: (samples x inputs) array or a buffer of
+                            make_input_buffer
+        :param output_array: contiguous (samples x outputs) array of float64
+        """
+        if self._function is None:
+            self.load()
+
+        input_array = np.ascontiguousarray(input_array, dtype=np.float64)
+        if input_array.ndim != 2 \
+                or input_array.shape[1] not in (self.num_inputs, self.num_inputs + self.num_work) \
+                or input_array.shape[0] != output_array.shape[0] \
+                or output_array.shape[1:] != (self.num_outputs,):
+            raise ValueError("Expected (samples x {}) inputs and (samples x {}) "
+                             "outputs".format(self.num_inputs, self.num_outputs))
+
+        if input_array.shape[1] < self.num_inputs + self.num_work:
+            buffer = self.make_input_buffer(input_array.shape[0])
+            buffer[:, :self.num_inputs] = input_array
+            input_array = buffer
+
+        self._batch_function(input_array.ctypes.data, output_array.ctypes.data,
+                             input_array.shape[0], input_array.shape[1], self.num_outputs)
+
+    def __getstate__(self):
+        # ctypes handles can not be pickled, they are reopened on the first call
+        state = self.__dict__.copy()
+        state['_library'] = None
+        state['_function'] = None
+        state['_batch_function'] = None
+        return state
+
+    def __repr__(self):
+        return "{}({}, {} inputs, {} outputs)".format(self.__class__.__name__,
+                                                     os.path.basename(self.path_to_so_file),
+                                                     self.num_inputs,
+                                                     self.num_outputs)
+
+
+def hash_file(path):
+    """
+    :param path: path of a file
+    :return: sha256 hex digest of the content of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_templated_function(symbols, expressions, rates, simplify=True, pool=None):
+    """
+    Compile a function evaluating the rates with one code block per rate
+    template, i.e. per mechanism class. The block of a template is called for
+    every instance with an index table mapping its arguments into the input
+    array. The outputs are then computed from the inputs and the rates.
+
+    :param symbols: input symbols
+    :param expressions: output expressions in terms of the input and the rate
+                        symbols
+    :param rates: list of tuples (rate symbol, template, arguments), the
+                  template is expressed in the placeholder arguments
+                  TEMPLATE_ARGUMENT that are replaced by the arguments
+    :param simplify: use common sub expressions
+    :param pool: optional pool to generate the missing lines
+    :return: CompiledFunction
+    """
+    input_index = {str(e): i for i, e in enumerate(symbols)}
+    num_inputs = len(symbols)
+
+    # Group the instances by template
+    templates = OrderedDict()
+    for k, (_, this_template, arguments) in enumerate(rates):
+        templates.setdefault(this_template, []).append((num_inputs + k, arguments))
+
+    template_lines = generate_code_lines(templates.keys(), simplify=simplify, pool=pool)
+
+    template_blocks = []
+    for this_line, instances in zip(template_lines, templates.values()):
+        argument_index = {TEMPLATE_ARGUMENT.format(i): i
+                          for i in range(len(instances[0][1]))}
+        name, code, argument_ix, _ = make_code_block([this_line], argument_index)
+        # Input positions of the arguments of each instance in the order of the block
+        input_ix = [[input_index[str(arguments[i])] for i in argument_ix]
+                    for _, arguments in instances]
+        output_ix = [output for output, _ in instances]
+        template_blocks.append((name, code, input_ix, output_ix))
+
+    # The outputs read the rates from the work array behind the inputs
+    input_index.update({str(x): num_inputs + k for k, (x, _, _) in enumerate(rates)})
+
+    code_lines = generate_code_lines(expressions, simplify=simplify, pool=pool)
+    with phase('code blocks'):
+        blocks = [make_code_block(rows, input_index)
+                  for rows in split_code_lines(code_lines)]
+
+    dispatcher_code = make_templated_dispatcher_code(blocks, template_blocks)
+
+    path_to_so_file = compile_and_link(blocks + template_blocks,
+                                       dispatcher_code=dispatcher_code)
+
+    # The rates are written to the work space behind the inputs
+    return CompiledFunction(path_to_so_file, symbols, len(code_lines),
+                            num_work=len(rates))
+
+
+def instantiate_rates(expressions, rates):
+    """
+    Replace the rate symbols in the expressions by the instantiated templates
+
+    :param expressions: dict of expressions in terms of the rate symbols
+    :param rates: list of tuples (rate symbol, template, arguments)
+    :return: dict of the expressions
+    """
+    substitutions = dict()
+    for this_symbol, this_template, arguments in rates:
+        placeholders = {Symbol(TEMPLATE_ARGUMENT.format(i)): x
+                        for i, x in enumerate(arguments)}
+        substitutions[this_symbol] = this_template.xreplace(placeholders)
+
+    return expressions.__class__((k, sympify(v).xreplace(substitutions))
+                                 for k, v in expressions.items())
+
+
+def make_templated_dispatcher_code(blocks, template_blocks):
+    """
+    Code of the function evaluating the templates for all their instances
+    into the work space behind the inputs and calling the output blocks on
+    the inputs and the rates. The input array is provided by the caller with
+    the work space (see CompiledFunction.make_input_buffer), thus the function
+    does not allocate memory.
+
+    :param blocks: list of output blocks from make_code_block
+    :param template_blocks: list of tuples (block name, block code, argument
+                            tables, rate positions)
+    :return: code
+    """
+    prototypes = OrderedDict((b[0], BLOCK_PROTOTYPE.format(b[0]) + ";")
+                             for b in blocks + template_blocks)
+
+    tables = []
+    calls = ["int _j"]
+
+    for i, (name, _, input_ix, output_ix) in enumerate(template_blocks):
+        num_arguments = len(input_ix[0])
+        tables.append("static const int tix_{}[] = {{{}}};"
+                      .format(i, ",".join(str(x) for row in input_ix for x in row) or "0"))
+        tables.append("static const int tout_{}[] = {{{}}};"
+                      .format(i, ",".join(str(x) for x in output_ix)))
+        calls.append("for (_j = 0; _j < {}; _j++) "
+                     "{}(input_array, tix_{} + _j*{}, input_array + tout_{}[_j])"
+                     .format(len(output_ix), name, i, num_arguments, i))
+
+    offset = 0
+    for i, (name, _, input_ix, num_outputs) in enumerate(blocks):
+        tables.append("static const int ix_{}[] = {{{}}};"
+                      .format(i, ",".join(str(x) for x in input_ix) or "0"))
+        calls.append("{}(input_array, ix_{}, output_array + {})"
+                     .format(name, i, offset))
+        offset += num_outputs
+
+    return INCLUDE + "\n".join(prototypes.values()) + "\n" \
+           + "\n".join(tables) + "\n" \
+           + FUNCTION_DEFINITION_HEADER + ";\n".join(calls) \
+           + FUNCTION_DEFINITION_FOOTER + "\n"
 
-    return this_function
 
 def write_code_to_tempfile(code,file_path=None):
     if file_path is None:
@@ -101,102 +444,360 @@ def write_code_to_tempfile(code,file_path=None):
         text_file.write(code)
     return file_path
 
-def generate_vectorized_code(inputs, expressions, simplify=True, optimize=False, pool=None):
-    # input substitution dict:
-    input_subs = {str(e): "input_array[{}]".format(i)
-                  for i, e in enumerate(inputs)}
-
-    if pool is None:
-        cython_code = []
-        for i,e in enumerate(expressions):
-            if simplify:
-                cython_code.append(generate_a_code_line_simplfied((i,e,input_subs)))
-            else:
-                cython_code.append(generate_a_code_line((i, e, input_subs)))
-
-    else:
-        if simplify:
-            input_subs_input = [input_subs, ]*len(expressions)
-            i,e =zip(*enumerate(expressions))
-            cython_code = pool.map(generate_a_code_line_simplfied, zip(i,e,input_subs_input) )
-
-        else:
-            input_subs_input = [input_subs, ] * len(expressions)
-            i, e = zip(*enumerate(expressions))
-            cython_code = pool.map(generate_a_code_line, zip(i, e, input_subs_input))
 
-    cython_code = ';\n'.join(cython_code)
+def generate_code_lines(expressions, simplify=True, pool=None):
+    """
+    Get the code lines of the expressions from the cache and generate the
+    missing ones
 
-    return cython_code
+    :param expressions: iterable of sympy expressions
+    :param simplify: use common sub expressions
+    :param pool: optional pool to generate the missing lines
+    :return: list of tuples (code, free symbol names)
+    """
+    keys = [(sympify(e), simplify) for e in expressions]
 
+    code_lines = [code_cache.lookup(k) for k in keys]
+    missing = list(OrderedDict.fromkeys(k for k, c in zip(keys, code_lines)
+                                        if c is None))
 
-from sympy import cse
+    report = active_report()
+    if report is not None:
+        report.add('expressions', len(keys))
+        report.add('generated expressions', len(missing))
 
-def generate_a_code_line_simplfied(input , optimize=False):
-    i, e, input_subs = input
+    if missing:
+        if report is None:
+            function, inputs = generate_a_code_line, missing
+        else:
+            function = profile_a_code_line
+            inputs = [(k, report.count_operations) for k in missing]
 
-    # Use common sub expressions instead of simpilfy
-    # Generate directly unique CSE Symbols and tranlate them to ccode
-    if optimize:
-        common_sub_expressions, main_expression = cse(e.simplify())
+        with phase('code generation'):
+            if pool is None:
+                missing_lines = [function(x) for x in inputs]
+            else:
+                missing_lines = pool.map(function, inputs)
+
+        if report is not None:
+            missing_lines, all_stats = zip(*missing_lines)
+            for stats in all_stats:
+                for k, v in stats.items():
+                    if k.endswith('operations'):
+                        report.add(k, v)
+                    else:
+                        report.add_time(k, v)
+
+        missing_lines = dict(zip(missing, missing_lines))
+        for k, c in missing_lines.items():
+            code_cache.store(k, c)
+
+        code_lines = [missing_lines[k] if c is None else c
+                      for k, c in zip(keys, code_lines)]
+
+    return code_lines
+
+
+def generate_a_code_line(input, stats=None):
+    """
+    Position independent C code of an expression: the result is assigned to
+    OUTPUT and the symbols keep their names
+
+    :param input: tuple of expression and simplify flag
+    :param stats: optional dict, the time of the steps is added to it
+    :return: tuple of code and free symbol names
+    """
+    e, simplify = input
+
+    if stats is None:
+        stats = dict()
+
+    start = time.perf_counter()
+    if simplify:
+        # Use common sub expressions instead of simpilfy
+        # Generate directly unique CSE Symbols and tranlate them to ccode
+        # the code is scoped in a block thus the names only need to be unique
+        # within the expression
+        common_sub_expressions, main_expression = cse(e, symbols=numbered_symbols('_cse_'))
+        stats['cse'] = time.perf_counter() - start
+        start = time.perf_counter()
+
+        code = ''
+        for this_cse in common_sub_expressions:
+            code = code + 'double {} = {} ;\n'.format(str(this_cse[0]),
+                                                     ccode(this_cse[1], standard='C99'))
+
+        code = code + "{} = {} ;".format(OUTPUT, ccode(main_expression[0], standard='C99'))
     else:
-        common_sub_expressions, main_expression = cse(e)
-
-    # Generate unique symbols for the common subexpressions
-    cse_subs = {}
-    common_sub_expressions_unique = []
-    for this_cse in common_sub_expressions:
-        gen_sym = str(this_cse[0])
-        unique_sym = Symbol("cse_{}_{}".format(i,gen_sym))
-        cse_subs[ this_cse[0]] = unique_sym
-        common_sub_expressions_unique.append(
-            [unique_sym,this_cse[1]] )
-
-    # Substitute the cse symbols in mainexpression and other cse
-    for this_cse in common_sub_expressions_unique:
-        this_cse[1] = this_cse[1].subs(cse_subs)
-
-    main_expression = main_expression[0].subs(cse_subs)
-
-    cython_code = ''
-    for this_cse in common_sub_expressions_unique:
-        cython_code=cython_code+'double {} = {} ;\n'.format(str(this_cse[0]),
-                                                    ccode(this_cse[1],standard='C99'))
-
-
-    cython_code = cython_code+"output_array[{}] = {} ;".format(i,ccode(main_expression
-                                                                      ,standard='C99')
-                                                              )
+        code = "{} = {} ;".format(OUTPUT, ccode(e, standard='C99'))
+    stats['ccode'] = time.perf_counter() - start
+    start = time.perf_counter()
 
     # Substitute integers in the cython code
-    cython_code = re.sub(r"(\ |\+|[^e]\-|\*|\(|\)|\/|\,)([1-9])(\ |\+|\-|\*|\(|\)|\/|\,)",
-                         r"\1 \2.0 \3 ",
-                         cython_code)
-
-    for str_sym, array_sym in input_subs.items():
-        cython_code = re.sub(r"(\ |\+|\-|\*|\(|\)|\/|\,)({})(\ |\+|\-|\*|\(|\)|\/|\,)".format(str_sym),
-                             r"\1 {} \3 ".format(array_sym),
-                             cython_code)
+    code = re.sub(r"(\ |\+|[^e]\-|\*|\(|\)|\/|\,)([1-9])(\ |\+|\-|\*|\(|\)|\/|\,)",
+                  r"\1 \2.0 \3 ",
+                  code)
+    stats['integer substitution'] = time.perf_counter() - start
 
-    return cython_code
+    free_symbols = tuple(sorted(str(x) for x in e.free_symbols))
 
+    return code, free_symbols
 
-def generate_a_code_line(input, optimize=False):
-    i, e, input_subs = input
 
-    if optimize:
-        cython_code = "output_array[{}] = {} ".format(i, ccode(e.simplify()), standard='C99')
-    else:
-        cython_code = "output_array[{}] = {} ".format(i,ccode(e, standard='C99'))
+def profile_a_code_line(input):
+    """
+    Generate a code line and measure its steps
 
+    :param input: tuple of the input of generate_a_code_line and a flag
+                  to count the operations before and after the cse
+    :return: tuple of the code line and a dict of the step times and
+             operation counts
+    """
+    input, count_operations = input
+    stats = dict()
+    code_line = generate_a_code_line(input, stats)
 
-    # Substitute integers in the cython code
-    cython_code = re.sub(r"(\ |\+|[^e]\-|\*|\(|\)|\/|\,)([1-9])(\ |\+|\-|\*|\(|\)|\/|\,)",
-                         r"\1 \2.0 \3 ",
-                         cython_code)
-
-    for str_sym, array_sym in input_subs.items():
-        cython_code = re.sub(r"(\ |\+|\-|\*|\(|\)|\/|\,)({})(\ |\+|\-|\*|\(|\)|\/|\,)".format(str_sym),
-                             r"\1 {} \3 ".format(array_sym),
-                             cython_code)
-    return cython_code
\ No newline at end of file
+    if count_operations:
+        e, simplify = input
+        stats['operations'] = count_ops(e)
+        if simplify:
+            common_sub_expressions, main_expression = cse(e)
+            stats['cse operations'] = count_ops(main_expression[0]) \
+                + sum(count_ops(x) for _, x in common_sub_expressions)
+        else:
+            stats['cse operations'] = stats['operations']
+
+    return code_line, stats
+
+
+def split_code_lines(code_lines):
+    """
+    Split the code lines into blocks, a block ends after a line whose hash
+    hits the boundary condition or if the block reaches the maximal size
+
+    :param code_lines: list of tuples (code, free symbol names)
+    :return: list of lists of code lines
+    """
+    blocks = []
+    this_block = []
+    for line in code_lines:
+        this_block.append(line)
+        digest = hashlib.sha1(line[0].encode()).digest()
+        if len(this_block) >= BLOCK_MAX_SIZE \
+                or int.from_bytes(digest[:4], 'little') % BLOCK_BOUNDARY == 0:
+            blocks.append(this_block)
+            this_block = []
+
+    if this_block:
+        blocks.append(this_block)
+
+    return blocks
+
+
+def make_code_block(code_lines, input_index):
+    """
+    Make a relocatable block function: the inputs are gathered through an
+    index table and the outputs are written relative to an offset. The code
+    only depends on the expressions, thus the compiled block can be reused
+    in any function containing the same expressions.
+
+    :param code_lines: list of tuples (code, free symbol names)
+    :param input_index: dict of input names and their position in the
+                        input array
+    :return: tuple of block name, block code, list of input positions and
+             number of outputs
+    """
+    local_index = OrderedDict()
+    for _, free_symbols in code_lines:
+        for this_symbol in free_symbols:
+            if this_symbol in input_index and this_symbol not in local_index:
+                local_index[this_symbol] = len(local_index)
+
+    body = []
+    for i, (code, free_symbols) in enumerate(code_lines):
+        names = sorted((x for x in free_symbols if x in local_index),
+                       key=len, reverse=True)
+        if names:
+            pattern = r"(?<![\w.])({})(?![\w.])".format("|".join(re.escape(x) for x in names))
+            code = re.sub(pattern,
+                          lambda m: "_in[{}]".format(local_index[m.group(1)]),
+                          code)
+        body.append("{\n" + code.replace(OUTPUT, "output_array[{}]".format(i)) + "\n}")
+
+    num_inputs = len(local_index)
+    body = "double _in[{}];\n".format(max(num_inputs, 1)) \
+           + "int _i;\n" \
+           + "for (_i = 0; _i < {}; _i++) _in[_i] = input_array[input_ix[_i]];\n".format(num_inputs) \
+           + "\n".join(body)
+
+    name = "block_" + hashlib.sha1((OBJECT_COMPILER + body).encode()).hexdigest()
+    code = INCLUDE + BLOCK_PROTOTYPE.format(name) + "{\n" + body + "\n}\n"
+
+    input_ix = [input_index[x] for x in local_index]
+
+    return name, code, input_ix, len(code_lines)
+
+
+def make_dispatcher_code(blocks):
+    """
+    Code of the function calling all blocks with their index tables and
+    output offsets
+
+    :param blocks: list of blocks from make_code_block
+    :return: code
+    """
+    prototypes = OrderedDict((name, BLOCK_PROTOTYPE.format(name) + ";")
+                             for name, _, _, _ in blocks)
+
+    tables = []
+    calls = []
+    offset = 0
+    for i, (name, _, input_ix, num_outputs) in enumerate(blocks):
+        tables.append("static const int ix_{}[] = {{{}}};"
+                      .format(i, ",".join(str(x) for x in input_ix) or "0"))
+        calls.append("{}(input_array, ix_{}, output_array + {})"
+                     .format(name, i, offset))
+        offset += num_outputs
+
+    return INCLUDE + "\n".join(prototypes.values()) + "\n" \
+           + "\n".join(tables) + "\n" \
+           + FUNCTION_DEFINITION_HEADER + ";\n".join(calls) \
+           + FUNCTION_DEFINITION_FOOTER + "\n"
+
+
+def compile_and_link(blocks, dispatcher_code=None):
+    """
+    Compile the blocks that are not yet in the cache and link them with a
+    dispatcher to a shared object
+
+    :param blocks: list of blocks, tuples starting with the name and the code
+    :param dispatcher_code: optional code of the dispatcher, by default the
+                            blocks are called one after the other
+    :return: path to the shared object
+    """
+    cache_dir = get_cache_dir()
+
+    if dispatcher_code is None:
+        dispatcher_code = make_dispatcher_code(blocks)
+    dispatcher_hash = hashlib.sha1((COMPILER + dispatcher_code
+                                    + BATCH_FUNCTION_DEFINITION).encode()).hexdigest()
+    path_to_so_file = os.path.join(cache_dir, 'function_{}.so'.format(dispatcher_hash))
+
+    if os.path.exists(path_to_so_file):
+        count('cached shared objects')
+        # The modification time orders the files for pruning
+        os.utime(path_to_so_file)
+        return path_to_so_file
+
+    # Build in a private directory and move the results to the cache
+    build_dir = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        missing = OrderedDict((b[0], b[1]) for b in blocks
+                              if not os.path.exists(os.path.join(cache_dir, b[0] + '.o')))
+        count('cached blocks', len(blocks) - len(missing))
+        count('compiled blocks', len(missing))
+        count('C code bytes', sum(len(code) for code in missing.values())
+                              + len(dispatcher_code))
+
+        if missing:
+            for name, code in missing.items():
+                write_code_to_tempfile(code, os.path.join(build_dir, name + '.c'))
+
+            # Compile in parallel chunks
+            names = list(missing.keys())
+            num_jobs = min(os.cpu_count() or 1, len(names))
+            with phase('gcc'):
+                jobs = [subprocess.Popen(OBJECT_COMPILER.split()
+                                         + [name + '.c' for name in names[i::num_jobs]],
+                                         cwd=build_dir,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT)
+                        for i in range(num_jobs)]
+                for this_job in jobs:
+                    output, _ = this_job.communicate()
+                    if this_job.returncode != 0:
+                        raise RuntimeError("Compilation failed:\n{}".format(output.decode()))
+
+            for name in names:
+                os.replace(os.path.join(build_dir, name + '.o'),
+                           os.path.join(cache_dir, name + '.o'))
+
+        path_to_c_file = write_code_to_tempfile(dispatcher_code + BATCH_FUNCTION_DEFINITION,
+                                                os.path.join(build_dir, 'function.c'))
+        path_to_tmp_file = os.path.join(build_dir, 'function.so')
+        object_files = [os.path.join(cache_dir, name + '.o')
+                        for name in OrderedDict.fromkeys(b[0] for b in blocks)]
+        for this_file in object_files:
+            os.utime(this_file)
+
+        with phase('link'):
+            try:
+                subprocess.check_output(COMPILER.split()
+                                        + ['-o', path_to_tmp_file, path_to_c_file]
+                                        + object_files,
+                                        stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError as e:
+                raise RuntimeError("Linking failed:\n{}".format(e.output.decode()))
+
+        os.replace(path_to_tmp_file, path_to_so_file)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    with phase('cache pruning'):
+        prune_cache(CACHE_MAX_SIZE)
+
+    return path_to_so_file
+
+
+def get_cache_dir():
+    """
+    Create the cache directory with mode 0700 or check that the existing one
+    is a directory of the user that other users can not write to, as the
+    shared objects in it are loaded into the process
+
+    :return: path of the cache directory
+    """
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+
+    status = os.lstat(CACHE_DIR)
+    if not stat.S_ISDIR(status.st_mode):
+        raise RuntimeError("The cache {} is not a directory".format(CACHE_DIR))
+    if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+        raise RuntimeError("The cache {} is not owned by the user".format(CACHE_DIR))
+    if status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise RuntimeError("The cache {} is writable by other users".format(CACHE_DIR))
+
+    return CACHE_DIR
+
+
+def prune_cache(max_size):
+    """
+    Remove the least recently used compiled files until the cache is smaller
+    than max_size, files used within the last CACHE_MIN_AGE seconds are kept
+
+    :param max_size: size in bytes
+    """
+    cache_dir = get_cache_dir()
+
+    files = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(('.o', '.so')):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            status = os.stat(path)
+        except OSError:
+            continue
+        files.append((status.st_mtime, status.st_size, path))
+
+    size = sum(this_size for _, this_size, _ in files)
+    oldest = time.time() - CACHE_MIN_AGE
+    for mtime, this_size, path in sorted(files):
+        if size <= max_size or mtime > oldest:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        size -= this_size
+        count('pruned cache files')
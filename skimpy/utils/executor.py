@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from skimpy.utils.namespace import SERIAL, THREAD, PROCESS
+
+
+class Executor(object):
+    """
+    Serial executor and base class of the executors used to parallelize the
+    code generation and batch evaluations. Executors have the same map
+    interface as multiprocessing.Pool, hold their workers until close() is
+    called and can be used as context managers.
+    """
+    def __init__(self, ncpu=1):
+        self._ncpu = ncpu
+        self._pool = None
+        self._pool_size = None
+
+    @property
+    def ncpu(self):
+        return self._ncpu
+
+    @ncpu.setter
+    def ncpu(self, value):
+        # The workers are recreated with the new size on the next map
+        self._ncpu = value
+
+    def map(self, function, iterable, ncpu=None):
+        """
+        Apply function to all elements of iterable
+
+        :param ncpu: number of workers for this call, defaults to self.ncpu
+        :return: list of results
+        """
+        if ncpu is None:
+            ncpu = self.ncpu
+
+        if ncpu is None or ncpu <= 1:
+            return list(map(function, iterable))
+
+        return self._map(self._get_pool(ncpu), function, iterable)
+
+    def imap(self, function, iterable, ncpu=None):
+        """
+        Lazy map yielding the results in order as they are done, such that
+        the caller can consume them without holding all of them
+
+        :param ncpu: number of workers for this call, defaults to self.ncpu
+        :return: iterator of the results
+        """
+        if ncpu is None:
+            ncpu = self.ncpu
+
+        if ncpu is None or ncpu <= 1:
+            return map(function, iterable)
+
+        return self._imap(self._get_pool(ncpu), function, iterable)
+
+    def _get_pool(self, ncpu):
+        if self._pool is None or self._pool_size != ncpu:
+            self.close()
+            self._pool = self._make_pool(ncpu)
+            self._pool_size = ncpu
+        return self._pool
+
+    def _make_pool(self, ncpu):
+        return None
+
+    def _map(self, pool, function, iterable):
+        return list(map(function, iterable))
+
+    def _imap(self, pool, function, iterable):
+        return map(function, iterable)
+
+    def close(self):
+        """
+        Shut down the workers, they are restarted by the next map
+        """
+        if self._pool is not None:
+            self._close_pool(self._pool)
+        self._pool = None
+        self._pool_size = None
+
+    def _close_pool(self, pool):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # Workers are not sent along, they are restarted when needed
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_pool_size'] = None
+        return state
+
+    def __repr__(self):
+        return "{}(ncpu={})".format(self.__class__.__name__, self.ncpu)
+
+
+class SerialExecutor(Executor):
+    """
+    Evaluates everything in the calling process
+    """
+    def map(self, function, iterable, ncpu=None):
+        return list(map(function, iterable))
+
+    def imap(self, function, iterable, ncpu=None):
+        return map(function, iterable)
+
+
+class ThreadExecutor(Executor):
+    """
+    Thread pool, useful for functions that release the GIL such as the
+    compiled functions
+    """
+    def _make_pool(self, ncpu):
+        return ThreadPoolExecutor(max_workers=ncpu)
+
+    def _map(self, pool, function, iterable):
+        return list(pool.map(function, iterable))
+
+    def _imap(self, pool, function, iterable):
+        return pool.map(function, iterable)
+
+    def _close_pool(self, pool):
+        pool.shutdown(wait=True)
+
+
+class ProcessExecutor(Executor):
+    """
+    Process pool based on multiprocessing.Pool
+    """
+    def _make_pool(self, ncpu):
+        return multiprocessing.Pool(ncpu)
+
+    def _map(self, pool, function, iterable):
+        return pool.map(function, iterable)
+
+    def _imap(self, pool, function, iterable):
+        return pool.imap(function, iterable)
+
+    def _close_pool(self, pool):
+        pool.close()
+        pool.join()
+
+
+EXECUTORS = {SERIAL: SerialExecutor,
+             THREAD: ThreadExecutor,
+             PROCESS: ProcessExecutor}
+
+
+def make_executor(executor=None, ncpu=None):
+    """
+    Get an executor
+
+    :param executor: an Executor, an object with a map method (e.g. a
+                     multiprocessing.Pool) or one of 'serial', 'thread' and
+                     'process' (default)
+    :param ncpu: number of workers, if None new executors use a single
+                 worker and given executors keep their setting
+    :return: executor
+    """
+    if executor is None:
+        executor = PROCESS
+
+    if isinstance(executor, str):
+        try:
+            return EXECUTORS[executor](ncpu=1 if ncpu is None else ncpu)
+        except KeyError:
+            raise ValueError("Executor type {} is not recognized, use one of {}"
+                             .format(executor, list(EXECUTORS.keys())))
+
+    if isinstance(executor, Executor) and ncpu is not None:
+        executor.ncpu = ncpu
+
+    return executor
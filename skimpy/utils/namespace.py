@@ -40,6 +40,37 @@ SYMBOLIC = 'symbolic'
 NET = 'net'
 SPLIT = 'split'
 
+""" Executor types """
+SERIAL = 'serial'
+THREAD = 'thread'
+PROCESS = 'process'
+
+""" Code generation modes """
+INLINED = 'inlined'
+TEMPLATED = 'templated'
+
+""" Symbol of the time in the ode expressions """
+TIME = 't'
+
+""" Evaluation backends """
+GCC = 'gcc'
+NUMPY = 'numpy'
+
+""" Reactor operation modes """
+BATCH = 'batch'
+CHEMOSTAT = 'chemostat'
+FED_BATCH = 'fed_batch'
+
+""" Feed profiles """
+CONSTANT = 'constant'
+PIECEWISE = 'piecewise'
+LINEAR = 'linear'
+SPLINE = 'spline'
+
+""" Stochastic simulation methods """
+SSA = 'ssa'
+TAU_LEAPING = 'tau_leaping'
+
 
 """ Item types """
 PARAMETER = 'parameter'
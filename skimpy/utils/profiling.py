@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIE CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+import pandas as pd
+
+# Stack of the active reports, the phases are recorded in the outermost
+_active_reports = []
+
+
+class CompileReport(object):
+    """
+    Wall time of the phases of a compilation and size counters such as the
+    number of expressions, the operation counts before and after the common
+    sub expression elimination and the size of the generated code.
+
+    Phases run by the code generation workers (cse, ccode, ...) are cumulated
+    over the workers and can thus exceed the wall time of the enclosing phase.
+    """
+    def __init__(self, name, count_operations=False):
+        """
+        :param name: name of the report
+        :param count_operations: count the operations of the expressions
+                                 before and after the cse, this is as
+                                 expensive as the cse itself
+        """
+        self.name = name
+        self.count_operations = count_operations
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+
+    def add_time(self, phase, seconds, calls=1):
+        this_time, this_calls = self.phases.get(phase, (0.0, 0))
+        self.phases[phase] = (this_time + seconds, this_calls + calls)
+
+    def add(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @property
+    def total_time(self):
+        return self.phases.get(self.name, (0.0, 0))[0]
+
+    def to_frame(self):
+        """
+        :return: pd.DataFrame of the phases with their time and calls
+        """
+        return pd.DataFrame([(k, t, n) for k, (t, n) in self.phases.items()],
+                            columns=['phase', 'time', 'calls']).set_index('phase')
+
+    def __str__(self):
+        lines = ["Compile report {}".format(self.name)]
+        lines += ["  {:<28s} {:10.4f} s {:8d} calls".format(k, t, n)
+                  for k, (t, n) in self.phases.items()]
+        lines += ["  {:<28s} {:>10}".format(k, v)
+                  for k, v in self.counters.items()]
+        return "\n".join(lines)
+
+    def log(self, logger, level=logging.INFO):
+        logger.log(level, str(self))
+
+
+def active_report():
+    """
+    :return: the report recording the current compilation or None
+    """
+    return _active_reports[0] if _active_reports else None
+
+
+@contextmanager
+def profile(name, count_operations=False):
+    """
+    Record the phases of everything compiled within the context, nested
+    calls are recorded as phases of the outermost report.
+
+    :param name: name of the report or the phase when nested
+    :param count_operations: see CompileReport
+    :return: CompileReport
+    """
+    report = active_report()
+    if report is not None:
+        with phase(name):
+            yield report
+        return
+
+    report = CompileReport(name, count_operations=count_operations)
+    _active_reports.append(report)
+    try:
+        with phase(name):
+            yield report
+    finally:
+        _active_reports.remove(report)
+
+
+@contextmanager
+def phase(name):
+    """
+    Time a phase of the active report, does nothing if no report is active
+    """
+    report = active_report()
+    if report is None:
+        yield
+        return
+
+    # Keep the phases in the order they start
+    report.phases.setdefault(name, (0.0, 0))
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        report.add_time(name, time.perf_counter() - start)
+
+
+def count(counter, value=1):
+    """
+    Add to a counter of the active report, does nothing if no report is active
+    """
+    report = active_report()
+    if report is not None:
+        report.add(counter, value)
+
+
+def profiled(method):
+    """
+    Decorator of the KineticModel methods that compile, the report of the
+    last call is kept as compile_report
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with profile(method.__name__) as report:
+            result = method(self, *args, **kwargs)
+        self.compile_report = report
+        return result
+
+    return wrapper
+
+
+class EvaluationStatistics(object):
+    """
+    Number of calls of a compiled function and the time spent in the
+    compiled kernel and in the whole call, the difference is the python
+    overhead of the call
+    """
+    def __init__(self):
+        self.calls = 0
+        self.kernel_time = 0.0
+        self.total_time = 0.0
+
+    def add(self, kernel_time, total_time):
+        self.calls += 1
+        self.kernel_time += kernel_time
+        self.total_time += total_time
+
+    @property
+    def overhead_time(self):
+        return self.total_time - self.kernel_time
+
+    def __repr__(self):
+        return "{}({} calls, {:.4f} s kernel, {:.4f} s overhead)".format(
+            self.__class__.__name__, self.calls, self.kernel_time, self.overhead_time)
+
+
+class SolverStatistics(object):
+    """
+    Statistics of a simulation: the evaluations of the right hand side, the
+    statistics reported by the solver and the wall time
+    """
+    def __init__(self, rhs, solver=None, wall_time=0.0):
+        """
+        :param rhs: EvaluationStatistics of the right hand side
+        :param solver: dict of the solver statistics, e.g. NumSteps
+        :param wall_time: time of the integration
+        """
+        self.rhs = rhs
+        self.solver = solver if solver is not None else dict()
+        self.wall_time = wall_time
+
+    @property
+    def jacobian_evaluations(self):
+        """
+        Number of jacobian evaluations of the solver, None if the solver
+        does not report them
+        """
+        return self.solver.get('NumJacEvals')
+
+    def __str__(self):
+        lines = ["Solver statistics",
+                 "  {:<28s} {:10.4f} s".format('wall time', self.wall_time),
+                 "  {:<28s} {}".format('rhs', self.rhs)]
+        lines += ["  {:<28s} {:>10}".format(k, v) for k, v in self.solver.items()]
+        return "\n".join(lines)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import numpy as np
+
+
+class WelfordAccumulator(object):
+
+    def __init__(self, shape):
+        """
+        Online mean and variance of a stream of equally shaped arrays
+        using Welford's algorithm. Accumulators of partial streams can be
+        merged (Chan et al. parallel update).
+
+        :param shape: Shape of the arrays in the stream
+        :type shape: tuple(int)
+        """
+        self.shape = tuple(shape)
+        self.count = 0
+        self._mean = np.zeros(self.shape)
+        self._m2 = np.zeros(self.shape)
+
+    def update(self, values):
+        """
+        Add one sample to the accumulator
+
+        :param values: array of shape `self.shape`
+        :return:
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.count += 1
+        delta = values - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (values - self._mean)
+
+    def merge(self, other):
+        """
+        Merge the statistics of another accumulator into this one
+
+        :param other: WelfordAccumulator of the same shape
+        :return: self
+        """
+        if other.shape != self.shape:
+            raise ValueError('Cannot merge accumulators of shape {} and {}'
+                             .format(self.shape, other.shape))
+        if other.count == 0:
+            return self
+
+        count = self.count + other.count
+        delta = other._mean - self._mean
+        self._mean = self._mean + delta * other.count / count
+        self._m2 = self._m2 + other._m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    def mean(self):
+        return self._mean.copy()
+
+    def var(self, ddof=0):
+        if self.count - ddof <= 0:
+            return np.full(self.shape, np.nan)
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof=0):
+        return np.sqrt(self.var(ddof=ddof))
+
+
+class QuantileSketch(object):
+
+    def __init__(self, shape, k=64, seed=None):
+        """
+        Mergeable KLL-style quantile sketch for a stream of equally shaped
+        arrays. Every entry of the arrays gets its own sketch, but the
+        compactions are done synchronously for all entries so that the whole
+        sketch is a handful of numpy arrays.
+
+        Each level holds at most `k` items of weight 2**level. A full level is
+        sorted, every other item (random offset) is promoted to the next
+        level and the level is emptied. The memory is thus
+        O(k*log2(n/k)) per entry, independent of the number of samples n,
+        and the rank error is O(log2(n/k)/k).
+
+        :param shape: Shape of the arrays in the stream
+        :type shape: tuple(int)
+        :param k: Capacity of each compactor level (even integer)
+        :param seed: Seed for the compaction offsets
+        """
+        if k < 2 or k % 2:
+            raise ValueError('The sketch capacity k must be an even integer >= 2')
+
+        self.shape = tuple(shape)
+        self.k = k
+        self.count = 0
+        self._levels = []
+        self._fill = []
+        self._random = np.random.RandomState(seed)
+
+    def update(self, values):
+        """
+        Add one sample to the sketch
+
+        :param values: array of shape `self.shape`
+        :return:
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self._push(0, values[..., np.newaxis])
+        self.count += 1
+
+    def merge(self, other):
+        """
+        Merge another sketch of the same shape into this one
+
+        :param other: QuantileSketch
+        :return: self
+        """
+        if other.shape != self.shape:
+            raise ValueError('Cannot merge sketches of shape {} and {}'
+                             .format(self.shape, other.shape))
+
+        for level, (buffer, fill) in enumerate(zip(other._levels, other._fill)):
+            if fill:
+                self._push(level, buffer[..., :fill])
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        """
+        Approximate quantile of every entry
+
+        :param q: Quantile in [0,1]
+        :return: array of shape `self.shape`
+        """
+        if self.count == 0:
+            return np.full(self.shape, np.nan)
+
+        values, weights = self._weighted_items()
+
+        order = np.argsort(values, axis=-1)
+        sorted_values = np.take_along_axis(values, order, axis=-1)
+        cumulative_weights = np.cumsum(weights[order], axis=-1)
+
+        target = q * cumulative_weights[..., -1:]
+        ix = (cumulative_weights < target).sum(axis=-1, keepdims=True)
+        ix = np.minimum(ix, values.shape[-1] - 1)
+
+        return np.take_along_axis(sorted_values, ix, axis=-1)[..., 0]
+
+    def _weighted_items(self):
+        values = [buffer[..., :fill] for buffer, fill in zip(self._levels, self._fill)]
+        weights = [np.full(fill, 2.0**level)
+                   for level, fill in enumerate(self._fill)]
+        return np.concatenate(values, axis=-1), np.concatenate(weights)
+
+    def _push(self, level, items):
+        """
+        Append items to a level and compact the level whenever it is full
+        """
+        while len(self._levels) <= level:
+            self._levels.append(np.empty(self.shape + (self.k,)))
+            self._fill.append(0)
+
+        buffer = self._levels[level]
+        num_items = items.shape[-1]
+        start = 0
+        while start < num_items:
+            fill = self._fill[level]
+            stop = min(num_items, start + self.k - fill)
+            buffer[..., fill:fill + stop - start] = items[..., start:stop]
+            self._fill[level] = fill + stop - start
+            start = stop
+
+            if self._fill[level] == self.k:
+                buffer.sort(axis=-1)
+                offset = self._random.randint(2)
+                promoted = buffer[..., offset::2].copy()
+                self._fill[level] = 0
+                self._push(level + 1, promoted)
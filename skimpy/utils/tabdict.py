@@ -62,6 +62,86 @@ class TabDict(OrderedDict):
 
 
 
+# Incremented on every change of an ObservedTabDict, see get_structure_version
+_structure_version = 0
+
+
+def get_structure_version():
+    """
+    Version of the structure of all the models, registries built from
+    ObservedTabDicts compare it to the version they were built at
+
+    :return: int
+    """
+    return _structure_version
+
+
+def bump_structure_version():
+    global _structure_version
+    _structure_version += 1
+
+
+class ObservedTabDict(TabDict):
+    """
+    TabDict bumping the structure version on every change, used for the
+    reactions, compartments and modifiers whose changes invalidate the
+    registries of the models
+    """
+    def __setitem__(self, key, value):
+        TabDict.__setitem__(self, key, value)
+        bump_structure_version()
+
+    def __delitem__(self, key):
+        TabDict.__delitem__(self, key)
+        bump_structure_version()
+
+    def pop(self, *args):
+        value = TabDict.pop(self, *args)
+        bump_structure_version()
+        return value
+
+    def popitem(self, last=True):
+        item = TabDict.popitem(self, last=last)
+        bump_structure_version()
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def clear(self):
+        TabDict.clear(self)
+        bump_structure_version()
+
+    def move_to_end(self, key, last=True):
+        TabDict.move_to_end(self, key, last=last)
+        bump_structure_version()
+
+
+class ReadOnlyTabDict(TabDict):
+    """
+    TabDict that can not be changed, returned as view of the registries
+    """
+    def __init__(self, *args, **kwargs):
+        TabDict.__init__(self)
+        self._extend(OrderedDict(*args, **kwargs))
+
+    def _extend(self, items):
+        # Only for the owner of the registry
+        for key, value in items.items():
+            OrderedDict.__setitem__(self, key, value)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("{} can not be changed".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = pop = popitem = setdefault = clear = \
+        update = move_to_end = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (list(self.items()),)
+
+
 def iterable_to_tabdict(iterable, use_name = True):
     """
     Takes the items from an iterable and puts them in a TabDict, indexed by the
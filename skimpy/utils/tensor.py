@@ -29,6 +29,8 @@ from collections import deque, OrderedDict
 import numpy as np
 import pandas as pd
 
+from .streaming import WelfordAccumulator, QuantileSketch
+
 class Tensor(object):
 
     def __init__(self, data, indexes, *args, **kwargs):
@@ -171,6 +173,124 @@ class Tensor(object):
                             columns=index2)
 
 
+class TensorSummary(object):
+
+    def __init__(self, indexes, sample_index_name='sample', sketch_size=64, seed=None):
+        """
+        Streaming summary of a 3D tensor along its sample axis. Samples are
+        added one 2D slice at a time, so only the statistics are stored
+        and the memory does not depend on the number of samples.
+        Summaries of partial populations (e.g. from parallel workers) can be
+        merged.
+
+        :param indexes: The two indexes of the slices
+        :type indexes: list{2}(pandas.Index)
+        :param sample_index_name: Name of the summarized axis
+        :param sketch_size: Capacity of the quantile sketch levels
+        :param seed: Seed of the quantile sketch
+        """
+        assert len(indexes) == 2
+        for ix in indexes:
+            assert isinstance(ix, pd.Index)
+
+        self._i = indexes[0]
+        self._j = indexes[1]
+        self.sample_index_name = sample_index_name
+
+        shape = (len(self._i), len(self._j))
+        self._moments = WelfordAccumulator(shape)
+        self._sketch = QuantileSketch(shape, k=sketch_size, seed=seed)
+
+    def __len__(self):
+        return self._moments.count
+
+    def update(self, data):
+        """
+        Add a sample slice to the summary
+
+        :param data: 2D array with the shape of the indexes
+        :return:
+        """
+        self._moments.update(data)
+        self._sketch.update(data)
+
+    def merge(self, other):
+        """
+        Merge the summary of another population into this one
+
+        :param other: TensorSummary with the same indexes
+        :return: self
+        """
+        if not (self._i.equals(other._i) and self._j.equals(other._j)):
+            raise ValueError('Only summaries with identical indexes can be merged')
+
+        self._moments.merge(other._moments)
+        self._sketch.merge(other._sketch)
+        return self
+
+    def check_slicer(self, slicer):
+        """
+        Only the sample axis is summarized, the statistics along the other
+        axes are not available
+
+        :param slicer: None or the name of the sample axis
+        :return:
+        """
+        if slicer is not None and slicer != self.sample_index_name:
+            raise ValueError("A summary can only be flattened along '{}', not '{}'"
+                             .format(self.sample_index_name, slicer))
+
+    def mean(self, slicer=None):
+        """
+        Mean along the sample axis
+
+        :param slicer: None or the name of the sample axis, as in `Tensor.mean`
+        :return:
+        """
+        self.check_slicer(slicer)
+        return self.make_df(self._moments.mean())
+
+    def var(self, slicer=None, ddof=0):
+        """
+        Variance along the sample axis
+
+        :param slicer: None or the name of the sample axis
+        :param ddof: Delta degrees of freedom
+        :return:
+        """
+        self.check_slicer(slicer)
+        return self.make_df(self._moments.var(ddof=ddof))
+
+    def std(self, slicer=None, ddof=0):
+        """
+        Standard deviation along the sample axis
+
+        :param slicer: None or the name of the sample axis, as in `Tensor.std`
+        :param ddof: Delta degrees of freedom
+        :return:
+        """
+        self.check_slicer(slicer)
+        return self.make_df(self._moments.std(ddof=ddof))
+
+    def quantile(self, slicer=None, quantile=0.5):
+        """
+        Approximate quantile along the sample axis
+
+        :param slicer: None or the name of the sample axis, as in
+                       `Tensor.quantile`
+        :param quantile: Quantile in [0,1]
+        :return:
+        """
+        self.check_slicer(slicer)
+        return self.make_df(self._sketch.quantile(quantile))
+
+    def make_df(self, data):
+
+        return pd.DataFrame(data,
+                            index=self._i,
+                            columns=self._j)
+
+
 if __name__ == '__main__':
 
     # Example: Control coefficient samples
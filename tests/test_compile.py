@@ -0,0 +1,483 @@
+import gc
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+from sympy import Atom, Basic, Symbol, sin
+from sympy.core.cache import clear_cache
+
+from skimpy.analysis.ode.utils import make_flux_fun
+from skimpy.core.modifiers import ActivationModifier
+from skimpy.inference.experiment import TimeCourseExperiment
+from skimpy.utils import compile_sympy
+from skimpy.utils.namespace import *
+from skimpy.utils.profiling import profile, SolverStatistics
+from skimpy.utils.tabdict import TabDict
+from tests.utils import build_linear_pathway_model, build_long_pathway_model, \
+    set_missing_parameters
+
+
+def add_activation(kmodel, reaction='E2', activator='C'):
+    reaction = kmodel.reactions[reaction]
+    modifier = ActivationModifier(activator, reaction=reaction)
+    reaction.modifiers[modifier.name] = modifier
+    kmodel.parameters = {str(p.symbol): 0.5 for p in modifier.parameters.values()}
+
+
+def evaluate_ode(kmodel):
+    set_missing_parameters(kmodel)
+    kmodel.ode_fun.get_params()
+    y = np.linspace(1.0, 3.0, len(kmodel.variables))
+    ydot = np.zeros(len(kmodel.variables))
+    kmodel.ode_fun(0, y, ydot)
+    return ydot
+
+
+def test_incremental_recompilation(tmp_path, monkeypatch):
+    # Start from empty caches to count the generated code
+    monkeypatch.setattr(compile_sympy, 'CACHE_DIR', str(tmp_path / 'cache'))
+    compile_sympy.code_cache.clear()
+
+    kmodel = build_long_pathway_model(40)
+    kmodel.compile_ode(sim_type=QSSA)
+    unmodified = evaluate_ode(kmodel)
+    report = kmodel.compile_report
+    assert report.counters['generated expressions'] == len(kmodel.variables)
+    assert report.counters['cached blocks'] == 0
+
+    # Only the expressions of the substrate and product of E20 change
+    add_activation(kmodel, reaction='E20', activator='M30')
+    kmodel.compile_ode(sim_type=QSSA)
+    incremental = evaluate_ode(kmodel)
+    report = kmodel.compile_report
+    assert report.counters['generated expressions'] == 2
+    assert report.counters['compiled blocks'] == 1
+    assert report.counters['cached blocks'] >= 1
+
+    fresh_model = build_long_pathway_model(40)
+    add_activation(fresh_model, reaction='E20', activator='M30')
+    fresh_model.compile_ode(sim_type=QSSA)
+    fresh = evaluate_ode(fresh_model)
+
+    assert np.allclose(incremental, fresh)
+    assert not np.allclose(incremental, unmodified)
+
+
+def test_executors():
+    results = []
+    for executor in [SERIAL, THREAD, PROCESS]:
+        kmodel = build_linear_pathway_model()
+        kmodel.compile_ode(sim_type=QSSA, ncpu=2, executor=executor)
+        results.append(evaluate_ode(kmodel))
+        kmodel.close()
+
+    assert all(np.allclose(results[0], r) for r in results)
+
+
+def evaluate_detached(ode_fun, parameters, y):
+    ode_fun.get_params(parameters)
+    ydot = np.zeros(len(y))
+    ode_fun(0, y, ydot)
+    return ydot
+
+
+def test_pickle_compiled_function(tmp_path):
+    kmodel = build_linear_pathway_model()
+    kmodel.compile_ode(sim_type=QSSA)
+    ydot = evaluate_ode(kmodel)
+
+    ode_fun = pickle.loads(pickle.dumps(kmodel.ode_fun))
+    assert ode_fun.model is None
+    assert ode_fun.function._function is None
+
+    parameters = kmodel.get_parameter_vector()
+    y = np.linspace(1.0, 3.0, len(kmodel.variables))
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(evaluate_detached,
+                                [kmodel.ode_fun, ode_fun],
+                                [parameters, parameters],
+                                [y, y]))
+
+    assert all(np.allclose(ydot, r) for r in results)
+
+    # Only the shared object the function was compiled to is loaded
+    function = pickle.loads(pickle.dumps(kmodel.ode_fun.function))
+    function.path_to_so_file = str(tmp_path / 'function.so')
+    with open(kmodel.ode_fun.function.path_to_so_file, 'rb') as fid:
+        content = fid.read()
+    with open(function.path_to_so_file, 'wb') as fid:
+        fid.write(content + b'0')
+    with pytest.raises(RuntimeError):
+        function.load()
+
+    with open(function.path_to_so_file, 'wb') as fid:
+        fid.write(content)
+    function.load()
+
+
+def test_freeze():
+    kmodel = build_linear_pathway_model()
+    kmodel.compile_ode(sim_type=QSSA)
+    ydot = evaluate_ode(kmodel)
+
+    kmodel.freeze()
+    assert kmodel.ode_fun.expressions is None
+    assert all(r.mechanism.reaction_rates is None for r in kmodel.reactions.values())
+    assert np.allclose(ydot, evaluate_ode(kmodel))
+
+    with pytest.raises(RuntimeError):
+        kmodel.compile_ode(sim_type=QSSA)
+
+    # No expression of the model is reachable, neither from the shared caches
+    names = set(kmodel.parameters)
+    clear_cache()
+    gc.collect()
+    assert not any(isinstance(x, Basic) and not isinstance(x, Atom)
+                   and not names.isdisjoint(str(y) for y in x.free_symbols)
+                   for x in gc.get_objects())
+
+
+def test_templated_codegen():
+    results = []
+    fluxes = []
+    for codegen in [INLINED, TEMPLATED]:
+        kmodel = build_linear_pathway_model()
+        add_activation(kmodel)
+        kmodel.compile_ode(sim_type=QSSA, codegen=codegen)
+        results.append(evaluate_ode(kmodel))
+
+        flux_fun = make_flux_fun(kmodel, QSSA, codegen=codegen)
+        concentrations = {k: 2.0 for k in kmodel.reactants}
+        parameters = {k: p.value for k, p in kmodel.parameters.items()}
+        fluxes.append(np.array(list(flux_fun(concentrations, parameters).values())))
+
+    assert np.allclose(results[0], results[1])
+    assert np.allclose(fluxes[0], fluxes[1])
+
+    # The rates are written to the work space of the input buffer
+    function = kmodel.ode_fun.function
+    assert function.num_work == len(kmodel.reactions)
+    with pytest.raises(ValueError):
+        function.bind(np.zeros(function.num_inputs))
+
+    inputs = 1.0 + np.random.rand(3, function.num_inputs)
+    buffer = function.make_input_buffer(3)
+    buffer[:, :function.num_inputs] = inputs
+    outputs = np.zeros((2, 3, function.num_outputs))
+    function.batch(inputs, outputs[0])
+    function.batch(buffer, outputs[1])
+    assert np.allclose(outputs[0], outputs[1])
+
+
+def test_numpy_backend():
+    results = []
+    for backend in [GCC, NUMPY]:
+        for codegen in [INLINED, TEMPLATED]:
+            kmodel = build_linear_pathway_model()
+            add_activation(kmodel)
+            kmodel.backend = backend
+            kmodel.compile_ode(sim_type=QSSA, codegen=codegen)
+            results.append(evaluate_ode(kmodel))
+
+    assert all(np.allclose(results[0], r) for r in results)
+
+    # Batched inputs evaluate every column
+    function = pickle.loads(pickle.dumps(kmodel.ode_fun.function))
+    inputs = 1.0 + np.random.rand(function.num_inputs, 5)
+    outputs = np.zeros((function.num_outputs, 5))
+    function(inputs, outputs)
+    for i in range(5):
+        output = np.zeros(function.num_outputs)
+        function(inputs[:, i], output)
+        assert np.allclose(output, outputs[:, i])
+
+
+def test_compile_report():
+    # The operations are only counted for generated code lines
+    compile_sympy.code_cache.clear()
+    kmodel = build_linear_pathway_model()
+    with profile('test', count_operations=True) as report:
+        kmodel.prepare()
+        kmodel.compile_ode(sim_type=QSSA)
+
+    assert kmodel.compile_report is report
+    assert list(report.phases)[:2] == ['test', 'prepare']
+    assert report.phases['compile_ode'][0] >= report.phases['rate expressions'][0]
+    assert report.counters['expressions'] == len(kmodel.variables)
+    assert report.counters['cse operations'] <= report.counters['operations']
+
+    kmodel.compile_ode(sim_type=QSSA)
+    assert kmodel.compile_report.name == 'compile_ode'
+
+
+def test_solver_statistics():
+    kmodel = build_linear_pathway_model(parametrize=True, initial_concentration=1.0)
+    kmodel.compile_ode(sim_type=QSSA)
+
+    solution = kmodel.solve_ode(np.linspace(0, 1, 5), statistics=True)
+    statistics = solution.statistics
+    assert statistics.rhs.calls > 0
+    assert 0 < statistics.rhs.kernel_time <= statistics.rhs.total_time
+    assert kmodel.ode_fun.statistics is None
+    # The jacobian evaluations are reported by the solver
+    assert statistics.jacobian_evaluations == statistics.solver.get('NumJacEvals')
+    assert 'rhs' in str(statistics)
+
+    statistics = SolverStatistics(statistics.rhs, solver={'NumJacEvals': 3})
+    assert statistics.jacobian_evaluations == 3
+
+    assert kmodel.solve_ode(np.linspace(0, 1, 5)).statistics is None
+
+
+def test_custom_ode_terms():
+    kmodel = build_linear_pathway_model(parametrize=True)
+    parameter = kmodel.parameters['vmax_forward_E1']
+    variable = kmodel.reactants['B']
+    time = Symbol(TIME)
+    kmodel.compile_ode(sim_type=QSSA,
+                       custom_ode_terms={'B': -parameter.symbol*variable.symbol*sin(time)})
+
+    y = np.linspace(1.0, 3.0, len(kmodel.variables))
+    kmodel.ode_fun.get_params()
+    ydot = np.zeros(len(y))
+    kmodel.ode_fun(0.5, y, ydot)
+
+    def custom_ode_update(t, y, ydot):
+        ydot[0] -= parameter.value*y[0]*np.sin(t)
+
+    kmodel.compile_ode(sim_type=QSSA)
+    kmodel.ode_fun.custom_ode_update = custom_ode_update
+    kmodel.ode_fun.get_params()
+    expected = np.zeros(len(y))
+    kmodel.ode_fun(0.5, y, expected)
+
+    assert list(kmodel.variables)[0] == 'B'
+    assert np.allclose(ydot, expected)
+
+
+def test_forward_sensitivities():
+    kmodel = build_linear_pathway_model(parametrize=True, initial_concentration=1.0)
+    kmodel.compile_ode(sim_type=QSSA)
+
+    time = np.linspace(0, 1, 5)
+    names = ['vmax_forward_E1', 'km_substrate_E2']
+    solution = kmodel.solve_ode(time, sensitivities=names)
+    assert solution.sensitivities.shape == (5, len(kmodel.variables), 2)
+    assert np.allclose(solution.species, kmodel.solve_ode(time).species)
+
+    # Central finite differences of the parameters
+    parameters = kmodel.get_parameter_vector()
+    for k, name in enumerate(names):
+        delta = np.zeros(len(parameters))
+        delta[kmodel.parameter_index.get_index([name])] = 1e-4
+        forward = kmodel.solve_ode(time, parameters=parameters + delta).species
+        backward = kmodel.solve_ode(time, parameters=parameters - delta).species
+        assert np.allclose(solution.sensitivities[:, :, k],
+                           (forward - backward)/2e-4, atol=1e-5)
+
+    # The augmented jacobian applies the jacobian of the variables to the
+    # variables and to each column of the sensitivities
+    sensitivity_fun = kmodel.sensitivity_fun
+    y = np.linspace(1.0, 3.0, sensitivity_fun.num_states)
+    v = np.linspace(-1.0, 1.0, sensitivity_fun.num_states)
+    Jv = np.ones(len(v))
+    sensitivity_fun.jacobian_times_vector(v, Jv, 0, y)
+    n = len(kmodel.variables)
+    jacobian = kmodel.sensitivity_fun.jacobian_fun(None, y[:n], parameters).T.toarray()
+    assert np.allclose(Jv[:n], jacobian.dot(v[:n]))
+    assert np.allclose(Jv[n:].reshape(n, 2), jacobian.dot(v[n:].reshape(n, 2)))
+    assert solution.get_sensitivities('B').shape == (5, 2)
+
+
+def test_adjoint_gradient():
+    kmodel = build_linear_pathway_model(parametrize=True, initial_concentration=1.0)
+    kmodel.compile_ode(sim_type=QSSA)
+
+    time = np.linspace(0.5, 2, 4)
+    data = kmodel.solve_ode(np.append(0, time)).concentrations.iloc[1:]
+    data = 1.1*data.set_index(time)
+    data.iloc[1, 0] = np.nan
+    experiment = TimeCourseExperiment(data, var=0.5)
+
+    loss, gradient = kmodel.solve_adjoint(experiment)
+    parameters = kmodel.get_parameter_vector()
+
+    def get_loss(this_parameters):
+        species = kmodel.solve_ode(np.append(0, time), parameters=this_parameters).species
+        return experiment.loss(species[1:], list(kmodel.variables))
+
+    assert np.isclose(loss, get_loss(parameters))
+
+    # Central finite differences of the parameters of the ode
+    for name in kmodel.ode_fun._parameters:
+        delta = np.zeros(len(parameters))
+        delta[kmodel.parameter_index.get_index([name])] = 1e-5
+        expected = (get_loss(parameters + delta) - get_loss(parameters - delta))/2e-5
+        assert np.isclose(gradient[name], expected, rtol=1e-3, atol=1e-6)
+
+
+def test_cache_directory(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setattr(compile_sympy, 'CACHE_DIR', cache_dir)
+    assert compile_sympy.get_cache_dir() == cache_dir
+    assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+
+    # Directories other users can write to are not trusted
+    os.chmod(cache_dir, 0o777)
+    with pytest.raises(RuntimeError):
+        compile_sympy.get_cache_dir()
+    os.chmod(cache_dir, 0o700)
+
+    # The least recently used files are removed first
+    now = time.time()
+    for i, name in enumerate(['a.o', 'b.so', 'c.o', 'recent.o']):
+        path = os.path.join(cache_dir, name)
+        with open(path, 'wb') as fid:
+            fid.write(b'0'*100)
+        age = 3600*(3 - i) + 2*compile_sympy.CACHE_MIN_AGE if i < 3 else 0
+        os.utime(path, (now - age, now - age))
+
+    compile_sympy.prune_cache(max_size=250)
+    assert sorted(os.listdir(cache_dir)) == ['c.o', 'recent.o']
+
+    # Recently used files are kept even if the cache is too large
+    compile_sympy.prune_cache(max_size=0)
+    assert os.listdir(cache_dir) == ['recent.o']
+
+
+@pytest.mark.parametrize('codegen', [INLINED, TEMPLATED])
+def test_ode_function_buffer(codegen):
+    kmodel = build_linear_pathway_model(parametrize=True)
+    parameter = kmodel.parameters['vmax_forward_E1']
+    variable = kmodel.reactants['B']
+    kmodel.compile_ode(sim_type=QSSA, codegen=codegen,
+                       custom_ode_terms={'B': -parameter.symbol*variable.symbol*Symbol(TIME)})
+    ode_fun = kmodel.ode_fun
+    n = len(kmodel.variables)
+    y = np.linspace(1.0, 3.0, n)
+    ydot = np.zeros(n)
+
+    with pytest.raises(RuntimeError):
+        ode_fun(0.5, y, ydot)
+
+    # Time, state and parameters are written in place
+    ode_fun.get_params()
+    ode_fun(0.5, y, ydot)
+    buffer = ode_fun._input_buffer
+    num_inputs = ode_fun.function.num_inputs
+    assert ode_fun.with_time
+    assert buffer[0] == 0.5
+    assert np.array_equal(buffer[1:n + 1], y)
+    assert np.array_equal(buffer[n + 1:num_inputs], list(ode_fun.parameters.values()))
+    assert len(buffer) == num_inputs + ode_fun.function.num_work
+
+    # The templated kernels evaluate the same expressions
+    expected = np.zeros(n)
+    inlined = build_linear_pathway_model()
+    inlined.parameters = {k: p.value for k, p in kmodel.parameters.items()}
+    inlined.compile_ode(sim_type=QSSA, custom_ode_terms={
+        'B': -inlined.parameters['vmax_forward_E1'].symbol
+             * inlined.reactants['B'].symbol*Symbol(TIME)})
+    inlined.ode_fun.get_params()
+    inlined.ode_fun(0.5, y, expected)
+    assert np.allclose(ydot, expected)
+
+    # The kernel is bound again to the buffer of new parameters
+    parameters = kmodel.get_parameter_vector()
+    ode_fun.get_params(2*parameters)
+    assert ode_fun._input_buffer is not buffer
+    doubled = np.zeros(n)
+    ode_fun(0.5, y, doubled)
+    assert not np.allclose(doubled, ydot)
+
+    ode_fun.get_params(parameters)
+    again = np.zeros(n)
+    ode_fun(0.5, y, again)
+    assert np.allclose(again, ydot)
+
+    # and to the unpickled buffer
+    detached = pickle.loads(pickle.dumps(ode_fun))
+    assert detached._kernel is None
+    unpickled = np.zeros(n)
+    detached(0.5, y, unpickled)
+    assert np.allclose(unpickled, ydot)
+
+
+def compile_mca(kmodel):
+    parameter_list = TabDict([(k, p.symbol) for k, p in kmodel.parameters.items()
+                              if p.name.startswith('vmax_forward')])
+    kmodel.prepare(mca=True)
+    kmodel.compile_mca(sim_type=QSSA, parameter_list=parameter_list)
+
+
+def test_shared_expression_caches(monkeypatch):
+    from skimpy.analysis.modal import modal_matrix
+    from skimpy.analysis.mca import make as mca_make
+    from skimpy.analysis.ode import utils as ode_utils
+    from skimpy.sampling.flux_parameter_function import FluxParameterFunction
+
+    ode_utils.rate_expression_cache.clear()
+    mca_make.elasticity_cache.clear()
+
+    derived = []
+    make_qssa_rate_expressions = ode_utils.make_qssa_rate_expressions
+    def counting_make_qssa_rate_expressions(reaction):
+        derived.append(reaction.name)
+        make_qssa_rate_expressions(reaction)
+    monkeypatch.setattr(ode_utils, 'make_qssa_rate_expressions',
+                        counting_make_qssa_rate_expressions)
+
+    kmodel = build_linear_pathway_model()
+    compile_mca(kmodel)
+    assert sorted(derived) == ['E1', 'E2', 'E3']
+    num_elasticities = len(mca_make.elasticity_cache)
+    assert num_elasticities > 0
+
+    # The other builders reuse the rate expressions of the MCA
+    set_missing_parameters(kmodel)
+    concentration_dict = {'A': 10.0, 'B': 5.0, 'C': 1.0, 'D': 0.05}
+    FluxParameterFunction(kmodel, kmodel.parameters, concentration_dict)
+    modal_matrix(kmodel, concentration_dict, kmodel.get_parameter_vector())
+    kmodel.compile_ode(sim_type=QSSA)
+    assert len(derived) == 3
+
+    # and so does another model with the same reactions
+    compile_mca(build_linear_pathway_model())
+    assert len(derived) == 3
+    assert len(mca_make.elasticity_cache) == num_elasticities
+
+
+def test_cached_expressions_after_modification():
+    from skimpy.analysis.mca import make as mca_make
+    from skimpy.analysis.ode import utils as ode_utils
+
+    def get_expressions(kmodel):
+        flux_fun = make_flux_fun(kmodel, QSSA)
+        return (dict(kmodel.independent_elasticity_fun.expressions),
+                dict(kmodel.parameter_elasticities_fun.expressions),
+                dict(flux_fun.expr))
+
+    # Cached: the model is compiled before and after the modification
+    kmodel = build_linear_pathway_model()
+    compile_mca(kmodel)
+    add_activation(kmodel)
+    compile_mca(kmodel)
+    cached = get_expressions(kmodel)
+
+    # Uncached: the modified model is derived from scratch
+    ode_utils.rate_expression_cache.clear()
+    mca_make.elasticity_cache.clear()
+    fresh_model = build_linear_pathway_model()
+    add_activation(fresh_model)
+    compile_mca(fresh_model)
+    uncached = get_expressions(fresh_model)
+
+    for cached_expressions, uncached_expressions in zip(cached, uncached):
+        assert cached_expressions == uncached_expressions
+
+    # The modified reaction depends on the activator
+    activator = kmodel.reactants['C'].symbol
+    assert activator in cached[2]['E2'].free_symbols
@@ -89,3 +89,64 @@ def test_cobra_import():
 def test_import():
     model = load_yaml_model(dummy_model_path)
     model.compile_ode()
+
+
+def test_compiled_bundle(tmpdir):
+    from skimpy.io.bundle import export_compiled_bundle, load_compiled_bundle
+    from tests.utils import build_linear_pathway_model
+
+    kmodel = build_linear_pathway_model(parametrize=True)
+    kmodel.prepare()
+    kmodel.compile_mca(sim_type=QSSA)
+    kmodel.compile_ode(sim_type=QSSA)
+
+    path = str(tmpdir.join('bundle'))
+    export_compiled_bundle(kmodel, path)
+    loaded = load_compiled_bundle(path)
+
+    assert loaded.ode_fun.expressions is None
+    assert not loaded._modified
+
+    y = np.linspace(1.0, 3.0, len(kmodel.variables))
+    concentrations = dict(zip(kmodel.variables, y))
+    results = []
+    for this_model in [kmodel, loaded]:
+        this_model.ode_fun.get_params()
+        ydot = np.zeros(len(y))
+        this_model.ode_fun(0, y, ydot)
+
+        parameters = this_model.get_parameter_vector()
+        fluxes = this_model.flux_fun(concentrations, parameters=parameters)
+        elasticities = this_model.independent_elasticity_fun(y, parameters)
+
+        results.append((ydot, list(fluxes.values()), elasticities.toarray()))
+
+    for expected, actual in zip(*results):
+        assert np.allclose(expected, actual)
+
+
+def test_load_more_models_than_cached(tmpdir, monkeypatch):
+    from skimpy.io import yaml as skimpy_yaml
+    from skimpy.io.yaml import load_yaml_models
+    from skimpy.utils.general import LRUCache
+
+    # Three distinct files do not fit in the cache
+    monkeypatch.setattr(skimpy_yaml, 'model_file_cache', LRUCache(2))
+
+    path = str(tmpdir.join('model.yaml'))
+    export_to_yaml(dummy_model, path)
+    with open(path) as fid:
+        content = fid.read()
+
+    paths = []
+    for i in range(3):
+        this_path = str(tmpdir.join('model_{}.yaml'.format(i)))
+        with open(this_path, 'w') as fid:
+            fid.write(content + '# copy {}\n'.format(i))
+        paths.append(this_path)
+
+    models = load_yaml_models(paths)
+    assert len(models) == 3
+    for model in models:
+        assert list(model.reactions) == list(dummy_model.reactions)
+    assert len(skimpy_yaml.model_file_cache) == 2
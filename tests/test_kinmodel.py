@@ -0,0 +1,85 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from skimpy.analysis.ode.utils import make_flux_fun
+from skimpy.core import Reaction
+from skimpy.core.compartments import Compartment
+from skimpy.core.modifiers import ActivationModifier
+from skimpy.mechanisms import ReversibleMichaelisMenten
+from skimpy.utils.namespace import *
+from tests.utils import build_linear_pathway_model
+
+
+def rebuilt_parameters(kmodel):
+    parameters = {}
+    for this_item in list(kmodel.reactions.values()) + list(kmodel.compartments.values()):
+        parameters.update({str(p.symbol): p for p in this_item.parameters.values()})
+    return list(parameters)
+
+
+def test_registries_follow_the_model():
+    kmodel = build_linear_pathway_model()
+    num_parameters = len(kmodel.parameters)
+
+    # Modifiers added to a reaction of the model
+    modifier = ActivationModifier('C', reaction=kmodel.reactions['E2'])
+    kmodel.reactions['E2'].modifiers[modifier.name] = modifier
+    assert 'k_activation_AM_C_E2' in kmodel.parameters
+    assert list(kmodel.parameters) == rebuilt_parameters(kmodel)
+
+    kmodel.parameters = {'k_activation_AM_C_E2': 0.5}
+    assert kmodel.parameters['k_activation_AM_C_E2'].value == 0.5
+    kmodel.compile_ode(sim_type=QSSA)
+
+    del kmodel.reactions['E2'].modifiers[modifier.name]
+    assert len(kmodel.parameters) == num_parameters
+
+    # Reactions and compartments
+    reaction = Reaction(name='E4',
+                        mechanism=ReversibleMichaelisMenten,
+                        reactants=ReversibleMichaelisMenten.Reactants(substrate='D',
+                                                                      product='F'),
+                        parameters=ReversibleMichaelisMenten.Parameters(k_equilibrium=1.0))
+    kmodel.add_reaction(reaction)
+    assert 'F' in kmodel.reactants
+    assert list(kmodel.parameters) == rebuilt_parameters(kmodel)
+
+    kmodel.add_compartment(Compartment(name='cell'))
+    assert list(kmodel.parameters) == rebuilt_parameters(kmodel)
+
+    kmodel.reactions.pop('E4')
+    assert 'F' not in kmodel.reactants
+    assert list(kmodel.parameters) == rebuilt_parameters(kmodel)
+
+
+def test_registries_are_read_only():
+    kmodel = build_linear_pathway_model()
+    with pytest.raises(TypeError):
+        kmodel.parameters['vmax_forward_E1'] = None
+    with pytest.raises(TypeError):
+        kmodel.reactants.pop('B')
+
+    assert list(pickle.loads(pickle.dumps(kmodel.parameters))) == list(kmodel.parameters)
+
+
+def test_functions_follow_the_parameter_index():
+    kmodel = build_linear_pathway_model(parametrize=True)
+    kmodel.compile_ode(sim_type=QSSA)
+    flux_fun = make_flux_fun(kmodel, QSSA)
+    kmodel.link_parameter_index(flux_fun)
+    parameter_index = kmodel.parameter_index
+
+    # The new parameter shifts the parameters of the following reactions
+    modifier = ActivationModifier('C', reaction=kmodel.reactions['E1'])
+    kmodel.reactions['E1'].modifiers[modifier.name] = modifier
+    kmodel.parameters = {'k_activation_AM_C_E1': 0.5}
+    kmodel.compile_ode(sim_type=QSSA)
+    assert kmodel.parameter_index is not parameter_index
+
+    concentrations = {k: 2.0 for k in kmodel.reactants}
+    parameters = {k: p.value for k, p in kmodel.parameters.items()}
+    expected = flux_fun(concentrations, parameters)
+    fluxes = flux_fun(concentrations, kmodel.get_parameter_vector())
+    assert np.allclose(list(fluxes.values()), list(expected.values()))
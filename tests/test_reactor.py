@@ -0,0 +1,238 @@
+import numpy as np
+import yaml
+from sympy import Symbol
+
+from skimpy.core import KineticModel, Reaction
+from skimpy.core.compartments import Compartment
+from skimpy.core.modifiers import ActivationModifier, BoundaryFlux
+from skimpy.core.operation import Chemostat, FedBatch, make_feed_profile
+from skimpy.core.parameters import ParameterValuePopulation
+from skimpy.core.reactor import Reactor, ReplicatedReactor
+from skimpy.core.solution import ODESolutionWriter, ODESolutionFile
+from skimpy.io.yaml import export_to_yaml, model_file_cache
+from skimpy.mechanisms import ReversibleMichaelisMenten
+from skimpy.simulations.reactor import make_batch_reactor, make_operation
+from skimpy.utils.namespace import *
+
+
+def build_strain_model(name):
+    model = KineticModel(name=name)
+    for reaction, substrate, product in [('uptake', 'A_e', 'A_c'), ('growth', 'A_c', 'B_c')]:
+        reactants = ReversibleMichaelisMenten.Reactants(substrate=substrate, product=product)
+        model.add_reaction(Reaction(name=reaction,
+                                    mechanism=ReversibleMichaelisMenten,
+                                    reactants=reactants))
+
+    for compartment in ['e', 'c']:
+        model.add_compartment(Compartment(name=compartment))
+    for k, v in model.reactants.items():
+        v.compartment = model.compartments[k[-1]]
+
+    model.parametrize_by_reaction({
+        'uptake': ReversibleMichaelisMenten.Parameters(
+            k_equilibrium=2.0, vmax_forward=1.0, km_substrate=1.0, km_product=1.0),
+        'growth': ReversibleMichaelisMenten.Parameters(
+            k_equilibrium=10.0, vmax_forward=0.5, km_substrate=1.0, km_product=1.0)})
+    model.parameters = {'volume_e': 100.0, 'cell_volume_e': 1.0,
+                        'volume_c': 1.0, 'cell_volume_c': 1.0}
+    return model
+
+
+def evaluate_ode(reactor, y):
+    reactor.compile_ode(add_dilution=True)
+    reactor.ode_fun.get_params()
+    ydot = np.zeros(len(y))
+    reactor.ode_fun(0, y, ydot)
+    return ydot
+
+
+def test_replicated_reactor():
+    names = ['strain_1', 'strain_2']
+    scaling = {'strain_1': 2.0, 'strain_2': 3.0}
+
+    models = [build_strain_model(k) for k in names]
+    models[1].parameters = {'vmax_forward_uptake': 3.0}
+    reactor = Reactor(models, {m.name: m.reactions['growth'] for m in models}, scaling)
+    reactor.add_boundary_condition(BoundaryFlux(reactor.variables['A_e'], 0.1))
+
+    model = build_strain_model('strain')
+    replicated = ReplicatedReactor({k: model for k in names},
+                                   {k: model.reactions['growth'] for k in names},
+                                   scaling)
+    replicated.parametrize({'vmax_forward_uptake': 3.0}, 'strain_2')
+    replicated.add_boundary_condition(BoundaryFlux(replicated.variables['A_e'], 0.1))
+
+    assert list(reactor.variables) == list(replicated.variables)
+
+    y = np.linspace(0.5, 2.0, len(reactor.variables))
+    assert np.allclose(evaluate_ode(reactor, y), evaluate_ode(replicated, y))
+
+    # Strains of a compiled model reuse its kernel
+    kernels = list(replicated.strain_kernels.values())
+    replicated.add_strain('strain_3', model, model.reactions['growth'], 4.0)
+    replicated.compile_ode(add_dilution=True)
+    assert list(replicated.strain_kernels.values()) == kernels
+    assert replicated.ode_fun.kernels[0][1] == names + ['strain_3']
+
+
+def add_activation(model):
+    reaction = model.reactions['growth']
+    modifier = ActivationModifier('A_e', reaction=reaction)
+    modifier.reactants['activator'] = model.reactants['A_e']
+    reaction.modifiers[modifier.name] = modifier
+    model.parameters = {str(p.symbol): 0.5 for p in modifier.parameters.values()}
+
+
+def test_replicated_reactor_model_change():
+    names = ['strain_1', 'strain_2']
+    scaling = {'strain_1': 2.0, 'strain_2': 3.0}
+
+    def build_reactor(model):
+        return ReplicatedReactor({k: model for k in names},
+                                 {k: model.reactions['growth'] for k in names},
+                                 scaling)
+
+    model = build_strain_model('strain')
+    replicated = build_reactor(model)
+    y = np.linspace(0.5, 2.0, len(replicated.variables))
+    unmodified = evaluate_ode(replicated, y)
+    kernels = list(replicated.strain_kernels.values())
+
+    # Building an unrelated model does not invalidate the kernel
+    build_strain_model('other')
+    assert np.allclose(evaluate_ode(replicated, y), unmodified)
+    assert list(replicated.strain_kernels.values()) == kernels
+
+    # The kernel and the strain parameters follow the shared model
+    add_activation(model)
+    modified = evaluate_ode(replicated, y)
+    assert len(replicated.strain_kernels) == 1
+    assert 'k_activation_AM_A_e_growth' in replicated.strain_parameters['strain_1']
+
+    fresh_model = build_strain_model('strain')
+    add_activation(fresh_model)
+    fresh = evaluate_ode(build_reactor(fresh_model), y)
+
+    assert np.allclose(modified, fresh)
+    assert not np.allclose(modified, unmodified)
+
+
+def test_operation_modes():
+    model = build_strain_model('strain_1')
+    reactor = Reactor([model], {'strain_1': model.reactions['growth']}, {'strain_1': 2.0})
+    y = np.linspace(0.5, 2.0, len(reactor.variables))
+    batch = evaluate_ode(reactor, y)
+
+    dilution_rate = make_feed_profile(PIECEWISE, [0.0, 1.0], [0.1, 0.2])
+    reactor.set_operation(Chemostat(dilution_rate, feed={'A_e': 5.0}))
+    chemostat = evaluate_ode(reactor, y)
+
+    ix = list(reactor.variables).index('A_e')
+    assert np.isclose(chemostat[ix] - batch[ix], 0.1*(5.0 - y[ix]))
+    assert np.isclose(chemostat[0] - batch[0], -0.1*y[0])
+
+    feed_rate = make_feed_profile(SPLINE, [-1.0, 0.0, 1.0, 2.0], [0.0, 2.0, 1.0, 3.0])
+    reactor.set_operation(FedBatch(feed_rate, feed={'A_e': 5.0}))
+    y = np.append(y, 100.0)
+    fed_batch = evaluate_ode(reactor, y)
+
+    assert list(reactor.variables)[-1] == 'volume'
+    assert np.isclose(fed_batch[-1], 2.0)
+    assert np.isclose(fed_batch[ix] - batch[ix], 2.0/100.0*(5.0 - y[ix]))
+
+
+def test_operation_time_scaling():
+    # Rates are per scaled time unit as the fluxes, time points are scaled
+    chemostat = make_operation({'mode': 'chemostat', 'dilution_rate': 0.1,
+                                'feed': {'A_e': 5.0}},
+                               concentration_scaling=10.0, time_scaling=2.0)
+    assert np.isclose(chemostat.dilution_rate, 0.05)
+    assert np.isclose(chemostat.feed['A_e'], 50.0)
+
+    feed_rate = {'profile': PIECEWISE, 'time': [0.0, 1.0], 'values': [0.2, 0.4]}
+    fed_batch = make_operation({'mode': 'fed_batch', 'feed_rate': feed_rate},
+                               time_scaling=2.0)
+    t = Symbol(TIME)
+    assert np.isclose(float(fed_batch.feed_rate.subs(t, 1.5)), 0.1)
+    assert np.isclose(float(fed_batch.feed_rate.subs(t, 2.5)), 0.2)
+
+
+def test_make_batch_reactor(tmpdir):
+    model = build_strain_model('strain')
+    model_path = str(tmpdir.join('strain.yml'))
+    export_to_yaml(model, model_path)
+
+    config = {'models': {'strain_1': model_path, 'strain_2': model_path},
+              'biomass': {'strain_1': 'growth', 'strain_2': 'growth'},
+              'biomass_scaling': {'strain_1': 2.0, 'strain_2': 2.0},
+              'extracellular_compartment': 'e',
+              'initial_medium': {'A_e': 1.0},
+              'reactor_volume': 100.0,
+              'scaling': {'concentration': 1.0, 'density': 1.0, 'gDW_gWW': 1.0, 'time': 1.0},
+              'boundary_conditions': {},
+              'operation': {'mode': 'chemostat', 'dilution_rate': 0.1, 'feed': {'A_e': 5.0}}}
+    config_path = str(tmpdir.join('reactor.yml'))
+    with open(config_path, 'w') as fid:
+        yaml.dump(config, fid)
+
+    model_file_cache.clear()
+    reactor = make_batch_reactor(config_path, ncpu=2, executor=THREAD)
+    assert len(model_file_cache) == 1
+    assert 'strain_2_A_c' in reactor.variables
+    assert 'strain_2_vmax_forward_uptake' in reactor.parameters
+
+    # The cached file gives an independent reactor
+    cached = make_batch_reactor(config_path)
+    y = np.linspace(0.5, 2.0, len(reactor.variables))
+    assert np.allclose(evaluate_ode(reactor, y), evaluate_ode(cached, y))
+
+
+def test_solve_ode_population(tmpdir):
+    names = ['strain_1', 'strain_2']
+    scaling = {'strain_1': 2.0, 'strain_2': 3.0}
+    populations = {k: ParameterValuePopulation([{'vmax_forward_uptake': v}
+                                                for v in [1.0, 2.0, 3.0]])
+                   for k in names}
+    time = np.linspace(0, 1, 5)
+
+    model = build_strain_model('strain')
+    replicated = ReplicatedReactor({k: model for k in names},
+                                   {k: model.reactions['growth'] for k in names},
+                                   scaling)
+    models = [build_strain_model(k) for k in names]
+    reactor = Reactor(models, {m.name: m.reactions['growth'] for m in models}, scaling)
+
+    # The process workers receive a pickled ode function without the model
+    # that reloads its compiled shared object
+    for this_reactor, executor in [(reactor, SERIAL), (replicated, THREAD),
+                                   (reactor, PROCESS), (replicated, PROCESS)]:
+        this_reactor.compile_ode()
+        for k in this_reactor.initial_conditions:
+            this_reactor.initial_conditions[k] = 1.0
+
+        population = this_reactor.solve_ode_population(time, populations,
+                                                        ncpu=2, executor=executor)
+        assert len(population) == 9
+        assert population.index[5] == ('1', '2')
+
+        # Reference with the strains parametrized one at a time
+        this_reactor.parametrize({'vmax_forward_uptake': 2.0}, 'strain_1')
+        this_reactor.parametrize({'vmax_forward_uptake': 3.0}, 'strain_2')
+        expected = this_reactor.solve_ode(time)
+        assert np.allclose(population.get_sample(('1', '2')), expected.species)
+
+        subset = this_reactor.solve_ode_population(time, populations,
+                                                   index=[('1', '2')])
+        assert np.allclose(subset.species[0], expected.species)
+
+    # The chunks are appended to the sink as they are done
+    population = reactor.solve_ode_population(time, populations)
+    filename = str(tmpdir.join('population.h5'))
+    with ODESolutionWriter(filename, reactor.ode_fun.variables, time,
+                           chunk_samples=2) as sink:
+        assert reactor.solve_ode_population(time, populations, ncpu=2,
+                                            executor=PROCESS, sink=sink) is None
+
+    with ODESolutionFile(filename) as trajectories:
+        assert trajectories.index == [str(i) for i in population.index]
+        assert np.allclose(trajectories.species[:], population.species, equal_nan=True)
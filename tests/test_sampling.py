@@ -1,7 +1,9 @@
+import numpy as np
 import pytest
 # Test models
 from skimpy.sampling.simple_parameter_sampler import SimpleParameterSampler
 from skimpy.utils.namespace import *
+from skimpy.analysis.ode.utils import make_flux_fun
 from tests.utils import build_linear_pathway_model
 
 
@@ -30,4 +32,51 @@ def test_parameter_sampling_linear_pathway():
                                           concentration_dict, seed = 20)
 
     assert(parameter_population_A == parameter_population_B)
-    assert( not(parameter_population_B == parameter_population_C))
\ No newline at end of file
+    assert( not(parameter_population_B == parameter_population_C))
+
+def test_parameter_vector():
+    this_model = build_linear_pathway_model()
+
+    this_model.prepare(mca=True)
+    this_model.compile_mca(sim_type = QSSA)
+
+    flux_dict = {'E1': 1.0, 'E2': 1.0, 'E3': 1.0}
+    concentration_dict = {'A': 10.0, 'B': 5.0, 'C': 1.0, 'D': 0.05}
+    fluxes = [flux_dict[r] for r in this_model.reactions]
+    concentrations = [concentration_dict[r] for r in this_model.reactants]
+
+    parameters = SimpleParameterSampler.Parameters(n_samples=3)
+    sampler = SimpleParameterSampler(parameters)
+    parameter_population = sampler.sample(this_model, flux_dict,
+                                          concentration_dict, seed = 10)
+
+    parameter_array = this_model.get_parameter_array(parameter_population)
+    assert parameter_array.shape == (3, len(this_model.parameters))
+
+    for parameter_sample, parameter_vector in zip(parameter_population, parameter_array):
+        dict_jacobian = this_model.jacobian_fun(fluxes, concentrations, parameter_sample)
+        vector_jacobian = this_model.jacobian_fun(fluxes, concentrations, parameter_vector)
+        assert abs(dict_jacobian - vector_jacobian).max() == 0
+
+
+def test_missing_parameter_values():
+    # Only the parameters read by the linked functions are required
+    this_model = build_linear_pathway_model()
+    this_model.link_parameter_index(make_flux_fun(this_model, QSSA))
+    values = {k: 1.0 for k in this_model.parameters}
+    del values['vmax_forward_E2']
+
+    with pytest.raises(KeyError, match='vmax_forward_E2'):
+        this_model.get_parameter_vector(values)
+
+    with pytest.raises(KeyError, match='vmax_forward_E2'):
+        this_model.get_parameter_array([values, values])
+
+    vector = this_model.get_parameter_vector(values, allow_missing=True)
+    assert np.isnan(vector[this_model.parameter_index.get_index(['vmax_forward_E2'])]).all()
+
+    # The parameters of the mechanisms that are not used are not required
+    values['vmax_forward_E2'] = 1.0
+    del values['kcat_forward_E2']
+    vector = this_model.get_parameter_vector(values)
+    assert np.isnan(vector[this_model.parameter_index.get_index(['kcat_forward_E2'])]).all()
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from skimpy.analysis.ode.utils import make_flux_fun
+from skimpy.core.solution import ODESolutionPopulation, ODESolutionWriter, \
+    ODESolutionFile
+from skimpy.utils.namespace import *
+from tests.utils import build_linear_pathway_model, set_missing_parameters
+
+
+def solve_population(kmodel, time_out, num_samples):
+    solutions = []
+    for i in range(num_samples):
+        for k in kmodel.initial_conditions:
+            kmodel.initial_conditions[k] = 1.0 + i
+        solutions.append(kmodel.solve_ode(time_out))
+    return solutions
+
+
+def test_solution_population():
+    kmodel = build_linear_pathway_model(parametrize=True)
+    kmodel.compile_ode(sim_type=QSSA)
+
+    time_out = np.linspace(0, 1, 5)
+    solutions = solve_population(kmodel, time_out, 3)
+    population = ODESolutionPopulation(solutions, index=['a', 'b', 'c'])
+
+    assert population.species.shape == (3, len(time_out), len(kmodel.variables))
+    assert np.shares_memory(population.get_variable('B'), population.species)
+    assert np.allclose(population.get_variable('B')[1],
+                       solutions[1].concentrations['B'].values)
+    assert np.allclose(population.get_sample('c'), solutions[2].species)
+
+    data = population.data
+    assert len(data) == 3*len(time_out)
+    assert np.allclose(data[data['solution_id'] == 'b']['B'].values,
+                       solutions[1].concentrations['B'].values)
+
+
+def test_hdf5_sink(tmpdir):
+    kmodel = build_linear_pathway_model(parametrize=True)
+    kmodel.compile_ode(sim_type=QSSA)
+    flux_fun = make_flux_fun(kmodel, QSSA)
+    parameters = {k: p.value for k, p in kmodel.parameters.items()}
+
+    filename = str(tmpdir.join('trajectories.h5'))
+    time_out = np.linspace(0, 1, 5)
+    with ODESolutionWriter(filename, kmodel.variables, time_out, flux_fun=flux_fun,
+                           parameters=parameters, chunk_samples=2) as sink:
+        solutions = []
+        for i in range(3):
+            for k in kmodel.initial_conditions:
+                kmodel.initial_conditions[k] = 1.0 + i
+            solutions.append(kmodel.solve_ode(time_out, sink=sink))
+        sink.append(ODESolutionPopulation(solutions[:2], index=['a', 'b']))
+
+    with ODESolutionFile(filename) as trajectories:
+        assert len(trajectories) == 5
+        assert trajectories.index == ['0', '1', '2', 'a', 'b']
+        assert np.allclose(trajectories.get_variable('B', slice(1, 3)),
+                           [s.concentrations['B'].values for s in solutions[1:]])
+        assert np.allclose(trajectories.get_sample('b'), solutions[1].species)
+
+        concentrations = dict(zip(solutions[2].names, solutions[2].species[-1]))
+        assert np.allclose(trajectories.get_flux('E2', slice(2, 3))[0, -1],
+                           flux_fun(concentrations, parameters)['E2'])
+
+        population = trajectories.to_population(slice(3, 5))
+        assert np.allclose(population.species, trajectories.species[:2])
+        assert np.allclose(trajectories.fluxes[3], trajectories.fluxes[0])
+
+
+def test_batched_fluxes():
+    kmodel = build_linear_pathway_model(parametrize=True, initial_concentration=1.0)
+    kmodel.compile_ode(sim_type=QSSA)
+    solution = kmodel.solve_ode(np.linspace(0, 1, 5))
+
+    parameters = {k: p.value for k, p in kmodel.parameters.items()}
+    for backend in [GCC, NUMPY]:
+        kmodel.backend = backend
+        flux_fun = make_flux_fun(kmodel, QSSA)
+        kmodel.link_parameter_index(flux_fun)
+        parameter_vector = kmodel.get_parameter_vector()
+
+        fluxes = solution.fluxes(flux_fun, parameters)
+        for (_, concentrations), (_, these_fluxes) in zip(solution.concentrations.iterrows(),
+                                                          fluxes.iterrows()):
+            expected = flux_fun(concentrations, parameters)
+            assert np.allclose(these_fluxes.values, list(expected.values()))
+
+        batched = flux_fun(solution.species, np.tile(parameter_vector, (5, 1)))
+        assert np.allclose(batched, fluxes.values)
+
+
+def test_default_flux_parameters():
+    kmodel = build_linear_pathway_model()
+    concentrations = np.array([[1.0, 2.0], [3.0, 4.0]])
+
+    # Parameters without value can not be defaulted
+    flux_fun = make_flux_fun(kmodel, QSSA)
+    with pytest.raises(ValueError):
+        flux_fun(concentrations)
+
+    set_missing_parameters(kmodel)
+    flux_fun = make_flux_fun(kmodel, QSSA)
+    parameters = {k: p.value for k, p in kmodel.parameters.items()}
+    assert np.allclose(flux_fun(concentrations), flux_fun(concentrations, parameters))
+
+    values = dict(zip(flux_fun.variables, concentrations[0]))
+    assert np.allclose(list(flux_fun(values).values()), flux_fun(concentrations)[0])
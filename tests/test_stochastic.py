@@ -0,0 +1,58 @@
+import numpy as np
+
+from skimpy.core import *
+from skimpy.mechanisms import *
+from skimpy.utils.namespace import *
+
+
+def build_gene_expression_model():
+    degradation = make_irrev_massaction([-1])
+
+    expression = Reaction(name='expression',
+                          mechanism=SimpleRegulatedGeneExpression,
+                          inhibitors=SimpleRegulatedGeneExpression.SingleRegulator(
+                              factor_1='repressor'),
+                          reactants=SimpleRegulatedGeneExpression.Reactants(
+                              product='protein'))
+    decay = Reaction(name='degradation',
+                     mechanism=degradation,
+                     reactants=degradation.Reactants(substrate1='protein'))
+
+    kmodel = KineticModel()
+    kmodel.add_reaction(expression)
+    kmodel.add_reaction(decay)
+    kmodel.parametrize_by_reaction({
+        'expression': SimpleRegulatedGeneExpression.Parameters(
+            basal_transcription_rate=2.0, transcription_rate_factor_1=18.0,
+            hill_coefficient_factor_1=1, kd_factor_1=1.0),
+        'degradation': degradation.Parameters(vmax_forward=0.5)})
+    kmodel.repair()
+    return kmodel
+
+
+def test_stochastic_simulation():
+    kmodel = build_gene_expression_model()
+    kmodel.compile_propensities()
+    assert kmodel.propensity_fun.channels == ['expression_forward', 'degradation_forward']
+
+    kmodel.compile_ode(sim_type=QSSA)
+    kmodel.initial_conditions['repressor'] = 1.0
+    time = np.linspace(0, 20, 11)
+    expected = kmodel.solve_ode(time).concentrations['protein'].values
+
+    for method in [SSA, TAU_LEAPING]:
+        solution = kmodel.solve_stochastic(time, 4000, method=method, seed=1)
+        assert len(solution) == 4000
+        assert np.all(solution.realizations.get_variable('repressor') == 1.0)
+
+        # Birth death process, the copy numbers are Poisson distributed
+        mean = solution.mean['protein'].values
+        variance = solution.std['protein'].values[-1]**2
+        assert np.allclose(mean, expected, rtol=0.03, atol=0.2)
+        assert np.isclose(variance, expected[-1], rtol=0.1)
+
+    # The realizations only depend on the seed and the chunk size
+    first = kmodel.solve_stochastic(time, 300, seed=2, chunk_size=100)
+    second = kmodel.solve_stochastic(time, 300, seed=2, chunk_size=100,
+                                     ncpu=3, executor=THREAD)
+    assert np.array_equal(first.realizations.species, second.realizations.species)
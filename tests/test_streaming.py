@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from skimpy.utils.streaming import WelfordAccumulator, QuantileSketch
+from skimpy.utils.tensor import Tensor, TensorSummary
+
+
+def test_welford_merge():
+    data = np.random.RandomState(1).lognormal(size=(500, 3, 4))
+
+    left = WelfordAccumulator((3, 4))
+    right = WelfordAccumulator((3, 4))
+    for x in data[:200]:
+        left.update(x)
+    for x in data[200:]:
+        right.update(x)
+    left.merge(right)
+
+    assert left.count == 500
+    assert np.allclose(left.mean(), data.mean(axis=0))
+    assert np.allclose(left.var(), data.var(axis=0))
+
+
+def test_quantile_sketch_merge():
+    data = np.random.RandomState(2).normal(size=(5000, 2, 3))
+
+    sketches = [QuantileSketch((2, 3), k=128, seed=i) for i in range(4)]
+    for i, x in enumerate(data):
+        sketches[i % 4].update(x)
+
+    sketch = sketches[0]
+    for other in sketches[1:]:
+        sketch.merge(other)
+
+    assert sketch.count == 5000
+    for q in [0.05, 0.5, 0.95]:
+        exact = np.quantile(data, q, axis=0)
+        assert np.allclose(sketch.quantile(q), exact, atol=0.1)
+
+
+def test_tensor_summary():
+    data = np.random.RandomState(3).normal(size=(2, 3, 50))
+    i = pd.Index(['r1', 'r2'], name='flux')
+    j = pd.Index(['p1', 'p2', 'p3'], name='parameter')
+    k = pd.Index(range(50), name='sample')
+
+    tensor = Tensor(data, [i, j, k])
+    summary = TensorSummary([i, j])
+    for s in range(50):
+        summary.update(data[:, :, s])
+
+    assert np.allclose(summary.mean(), tensor.mean('sample'))
+    assert np.allclose(summary.std(), tensor.std('sample'))
+
+
+def test_summarized_control_coefficients():
+    from skimpy.sampling.simple_parameter_sampler import SimpleParameterSampler
+    from skimpy.utils.namespace import QSSA
+    from skimpy.utils.tabdict import TabDict
+    from tests.utils import build_linear_pathway_model
+
+    kmodel = build_linear_pathway_model()
+    kmodel.prepare(mca=True)
+    parameter_list = TabDict([(k, p.symbol) for k, p in kmodel.parameters.items()
+                              if p.name.startswith('vmax_forward')])
+    kmodel.compile_mca(sim_type=QSSA, parameter_list=parameter_list)
+
+    flux_dict = {'E1': 1.0, 'E2': 1.0, 'E3': 1.0}
+    concentration_dict = {'A': 10.0, 'B': 5.0, 'C': 1.0, 'D': 0.05}
+
+    sampler = SimpleParameterSampler(SimpleParameterSampler.Parameters(n_samples=11))
+    parameter_population = sampler.sample(kmodel, flux_dict,
+                                          concentration_dict, seed=10)
+
+    for control_fun in [kmodel.concentration_control_fun, kmodel.flux_control_fun]:
+        tensor = control_fun(flux_dict, concentration_dict, parameter_population)
+        summary = control_fun(flux_dict, concentration_dict, parameter_population,
+                              summarize=True)
+
+        assert len(summary) == len(parameter_population)
+        assert np.allclose(summary.mean('sample'), tensor.mean('sample'))
+        assert np.allclose(summary.std('sample'), tensor.std('sample'))
+        # The sketch holds every sample of a small population, the median
+        # of an odd number of samples and the extremes are exact
+        for q in [0.0, 0.5, 1.0]:
+            assert np.allclose(summary.quantile('sample', q),
+                               tensor.quantile('sample', q))
+
+        with pytest.raises(ValueError):
+            summary.mean('parameter')
@@ -1,9 +1,23 @@
 from skimpy.core import Reaction, KineticModel, ConstantConcentration
 from skimpy.mechanisms import ReversibleMichaelisMenten
+from skimpy.utils.tabdict import TabDict
 
 
-def build_linear_pathway_model():
-    # Build linear Pathway model
+def set_missing_parameters(model, value=1.0):
+    # Set the parameters that have no value yet
+    model.parameters = {str(p.symbol): value for p in model.parameters.values()
+                        if p.value is None}
+
+
+def set_initial_concentrations(model, value):
+    # Initial concentration of all reactants, the variables are only known
+    # after the compilation
+    model.initial_conditions = TabDict([(k, value) for k in model.reactants])
+
+
+def build_linear_pathway_model(parametrize=False, initial_concentration=None):
+    # Build linear Pathway model, with parametrize the parameters without a
+    # value are set to 1.0
     metabolites_1 = ReversibleMichaelisMenten.Reactants(substrate='A', product='B')
     metabolites_2 = ReversibleMichaelisMenten.Reactants(substrate='B', product='C')
     metabolites_3 = ReversibleMichaelisMenten.Reactants(substrate='C', product='D')
@@ -42,5 +56,30 @@ def build_linear_pathway_model():
     this_model.parametrize_by_reaction({'E1': parameters_1,
                                         'E2': parameters_2,
                                         'E3': parameters_3})
+
+    if parametrize:
+        set_missing_parameters(this_model)
+    if initial_concentration is not None:
+        set_initial_concentrations(this_model, initial_concentration)
     return this_model
 
+
+
+def build_long_pathway_model(num_reactions):
+    # Linear pathway M0 -> M1 -> ... with the reactions E1, E2, ...
+    this_model = KineticModel()
+    parameters = dict()
+    for i in range(1, num_reactions + 1):
+        name = 'E{}'.format(i)
+        metabolites = ReversibleMichaelisMenten.Reactants(substrate='M{}'.format(i - 1),
+                                                          product='M{}'.format(i))
+        this_model.add_reaction(Reaction(name=name,
+                                         mechanism=ReversibleMichaelisMenten,
+                                         reactants=metabolites))
+        parameters[name] = ReversibleMichaelisMenten.Parameters(k_equilibrium=1.5)
+
+    the_boundary_condition = ConstantConcentration(this_model.reactants['M0'])
+    this_model.add_boundary_condition(the_boundary_condition)
+
+    this_model.parametrize_by_reaction(parameters)
+    return this_model
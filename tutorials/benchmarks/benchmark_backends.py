@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+# Compare the gcc and the NumPy backends on a linear pathway: compilation
+# time, single evaluations as used by the ODE solvers and the evaluation of
+# the fluxes of a whole parameter population
+import time
+
+import numpy as np
+from skimpy.core import *
+from skimpy.mechanisms import *
+from skimpy.analysis.ode.utils import make_flux_fun
+from skimpy.utils.namespace import *
+
+NUM_REACTIONS = 200
+NUM_SAMPLES = 1000
+NUM_CALLS = 1000
+
+
+def build_pathway(num_reactions):
+    model = KineticModel()
+    for i in range(num_reactions):
+        reactants = ReversibleMichaelisMenten.Reactants(substrate='x_{}'.format(i),
+                                                        product='x_{}'.format(i+1))
+        reaction = Reaction(name='r_{}'.format(i),
+                            mechanism=ReversibleMichaelisMenten,
+                            reactants=reactants)
+        model.add_reaction(reaction)
+
+    model.parametrize_by_reaction({'r_{}'.format(i): ReversibleMichaelisMenten.Parameters(
+        k_equilibrium=2.0, vmax_forward=1.0, km_substrate=1.0, km_product=1.0)
+        for i in range(num_reactions)})
+    return model
+
+
+for backend in [GCC, NUMPY]:
+    for codegen in [INLINED, TEMPLATED]:
+        model = build_pathway(NUM_REACTIONS)
+        model.backend = backend
+
+        t = time.time()
+        model.compile_ode(sim_type=QSSA, codegen=codegen)
+        flux_fun = make_flux_fun(model, QSSA, codegen=codegen)
+        compile_time = time.time() - t
+
+        # Single evaluations of the right hand side
+        model.ode_fun.get_params()
+        y = np.random.rand(len(model.variables))
+        ydot = np.zeros(len(model.variables))
+        t = time.time()
+        for _ in range(NUM_CALLS):
+            model.ode_fun(0, y, ydot)
+        call_time = (time.time() - t) / NUM_CALLS
+
+        # Fluxes of a population, the NumPy backend evaluates all samples at once
+        function = flux_fun.function
+        inputs = 1.0 + np.random.rand(function.num_inputs, NUM_SAMPLES)
+        fluxes = np.zeros((function.num_outputs, NUM_SAMPLES))
+        t = time.time()
+        if backend == NUMPY:
+            function(inputs, fluxes)
+        else:
+            for i in range(NUM_SAMPLES):
+                output = np.zeros(function.num_outputs)
+                function(inputs[:, i], output)
+                fluxes[:, i] = output
+        population_time = time.time() - t
+
+        print("{:6s} {:9s} compile {:8.3f} s  rhs {:10.2f} us  "
+              "population of {} {:8.3f} s".format(backend, codegen,
+                                                  compile_time,
+                                                  call_time * 1e6,
+                                                  NUM_SAMPLES,
+                                                  population_time))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+# Compile time and right hand side of a community of identical strains with
+# the monolithic Reactor, which compiles every strain, and the
+# ReplicatedReactor, which compiles the strain model once
+import time
+
+import numpy as np
+from skimpy.core import *
+from skimpy.core.compartments import Compartment
+from skimpy.core.reactor import Reactor, ReplicatedReactor
+from skimpy.mechanisms import *
+from skimpy.utils.namespace import *
+
+NUM_REACTIONS = 30
+NUM_CALLS = 2000
+
+
+def build_strain(name):
+    model = KineticModel(name=name)
+    names = ['x_e'] + ['x_{}_c'.format(i) for i in range(NUM_REACTIONS)]
+    for i in range(NUM_REACTIONS):
+        reactants = ReversibleMichaelisMenten.Reactants(substrate=names[i],
+                                                        product=names[i+1])
+        model.add_reaction(Reaction(name='r_{}'.format(i),
+                                    mechanism=ReversibleMichaelisMenten,
+                                    reactants=reactants))
+    for this_compartment in ['e', 'c']:
+        model.add_compartment(Compartment(name=this_compartment))
+    for k, v in model.reactants.items():
+        v.compartment = model.compartments[k[-1]]
+
+    model.parametrize_by_reaction({'r_{}'.format(i): ReversibleMichaelisMenten.Parameters(
+        k_equilibrium=2.0, vmax_forward=1.0, km_substrate=1.0, km_product=1.0)
+        for i in range(NUM_REACTIONS)})
+    model.parameters = {'volume_e': 100.0, 'cell_volume_e': 1.0,
+                        'volume_c': 1.0, 'cell_volume_c': 1.0}
+    return model
+
+
+def time_calls(function, *args):
+    start = time.perf_counter()
+    for _ in range(NUM_CALLS):
+        function(*args)
+    return (time.perf_counter() - start) / NUM_CALLS * 1e6
+
+
+growth = 'r_{}'.format(NUM_REACTIONS - 1)
+for num_strains in [1, 4, 16]:
+    names = ['strain_{}'.format(i) for i in range(num_strains)]
+
+    models = [build_strain(k) for k in names]
+    reactor = Reactor(models, {m.name: m.reactions[growth] for m in models},
+                      {k: 1.0 for k in names})
+    start = time.perf_counter()
+    reactor.compile_ode()
+    reactor_compile = time.perf_counter() - start
+
+    model = build_strain('strain')
+    replicated = ReplicatedReactor({k: model for k in names},
+                                   {k: model.reactions[growth] for k in names},
+                                   {k: 1.0 for k in names})
+    start = time.perf_counter()
+    replicated.compile_ode()
+    replicated_compile = time.perf_counter() - start
+
+    y = np.random.rand(len(reactor.variables))
+    ydot = np.zeros(len(reactor.variables))
+    reactor.ode_fun.get_params()
+    replicated.ode_fun.get_params()
+
+    print("{:3d} strains  compile {:7.2f} s / {:7.2f} s  rhs {:8.2f} us / {:8.2f} us"
+          .format(num_strains, reactor_compile, replicated_compile,
+                  time_calls(reactor.ode_fun, 0, y, ydot),
+                  time_calls(replicated.ode_fun, 0, y, ydot)))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: skimpy
+   :platform: Unix, Windows
+   :synopsis: Simple Kinetic Models in Python
+
+.. moduleauthor:: SKiMPy team
+
+[---------]
+
+Copyright 2017 Laboratory of Computational Systems Biotechnology (LCSB),
+Ecole Polytechnique Federale de Lausanne (EPFL), Switzerland
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+# Overhead of the ODE right hand side: the call path of ODEFunction with
+# its preallocated input buffer against building the input list on every
+# call and against the bare compiled kernel
+import time
+
+import numpy as np
+from skimpy.core import *
+from skimpy.mechanisms import *
+from skimpy.utils.namespace import *
+
+NUM_CALLS = 20000
+
+
+def build_pathway(num_reactions):
+    model = KineticModel()
+    for i in range(num_reactions):
+        reactants = ReversibleMichaelisMenten.Reactants(substrate='x_{}'.format(i),
+                                                        product='x_{}'.format(i+1))
+        reaction = Reaction(name='r_{}'.format(i),
+                            mechanism=ReversibleMichaelisMenten,
+                            reactants=reactants)
+        model.add_reaction(reaction)
+
+    model.parametrize_by_reaction({'r_{}'.format(i): ReversibleMichaelisMenten.Parameters(
+        k_equilibrium=2.0, vmax_forward=1.0, km_substrate=1.0, km_product=1.0)
+        for i in range(num_reactions)})
+    return model
+
+
+def time_calls(function, *args):
+    start = time.perf_counter()
+    for _ in range(NUM_CALLS):
+        function(*args)
+    return (time.perf_counter() - start) / NUM_CALLS * 1e6
+
+
+for num_reactions in [10, 100, 1000]:
+    model = build_pathway(num_reactions)
+    model.compile_ode(sim_type=QSSA)
+
+    ode_fun = model.ode_fun
+    ode_fun.get_params()
+    parameter_values = list(ode_fun._parameters_values)
+
+    y = np.random.rand(len(model.variables))
+    ydot = np.zeros(len(model.variables))
+
+    # Input list built on every call
+    def list_call(t, y, ydot):
+        ode_fun.function(list(y) + parameter_values, ydot)
+
+    # Kernel on a buffer that is already filled
+    kernel = ode_fun.function.bind(ode_fun._input_buffer)
+
+    print("{:5d} reactions  list {:8.2f} us  buffer {:8.2f} us  kernel {:8.2f} us"
+          .format(num_reactions,
+                  time_calls(list_call, 0, y, ydot),
+                  time_calls(ode_fun, 0, y, ydot),
+                  time_calls(kernel, ydot)))